@@ -0,0 +1,107 @@
+# -*- coding: UTF-8 -*-
+"""
+compare memory and cpu usage of the scene classes against the previous
+dict based implementation that formatted the command url on every call
+
+    $ python -m benchmarks.bench_devices [count]
+"""
+import asyncio
+import sys
+import timeit
+import tracemalloc
+
+from pydigitalstrom.devices.scene import DSColorScene
+from tests.common import get_testclient
+
+
+class LegacyDevice(object):
+    def __init__(self, client, device_id, device_name, *args, **kwargs):
+        self._client = client
+        self._id = device_id
+        self._name = device_name
+
+    async def request(self, url: str, **kwargs):
+        return await self._client.stack.append(url=url.format(**kwargs))
+
+
+class LegacyColorScene(LegacyDevice):
+    URL_TURN_ON = DSColorScene.URL_TURN_ON
+
+    def __init__(self, client, zone_id, zone_name, scene_id, scene_name, color):
+        self.zone_id = zone_id
+        self.zone_name = zone_name
+        self.scene_id = scene_id
+        self.scene_name = scene_name
+        self.color = color
+        super().__init__(
+            client=client,
+            device_id="{}_{}_{}".format(zone_id, color, scene_id),
+            device_name="{} / {}".format(zone_name, scene_name),
+        )
+
+    async def turn_on(self):
+        return await self.request(
+            url=self.URL_TURN_ON.format(
+                zone_id=self.zone_id, color=self.color, scene_id=self.scene_id
+            )
+        )
+
+
+class NullStack:
+    async def append(self, url: str, priority: int = None, deadline: float = None):
+        return url
+
+
+def create(cls, client, count: int) -> list:
+    return [
+        cls(
+            client=client,
+            zone_id=i // 64,
+            zone_name="Zone",
+            scene_id=i % 64,
+            scene_name="Scene",
+            color=1,
+        )
+        for i in range(count)
+    ]
+
+
+def measure_memory(cls, client, count: int) -> int:
+    tracemalloc.start()
+    scenes = create(cls, client, count)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del scenes
+    return size
+
+
+def measure_turn_on(scenes: list) -> float:
+    async def run():
+        for scene in scenes:
+            await scene.turn_on()
+
+    loop = asyncio.new_event_loop()
+    try:
+        return timeit.timeit(lambda: loop.run_until_complete(run()), number=5)
+    finally:
+        loop.close()
+
+
+def main(count: int = 50000):
+    client = get_testclient()
+    client.stack = NullStack()
+
+    print(f"{count} color scenes")
+    for cls in (LegacyColorScene, DSColorScene):
+        memory = measure_memory(cls, client, count)
+        create_time = timeit.timeit(lambda: create(cls, client, count), number=5)
+        turn_on_time = measure_turn_on(create(cls, client, count))
+        print(
+            f"{cls.__name__:>18}: {memory / count:7.1f} bytes/scene, "
+            f"create {create_time / 5 * 1e6 / count:6.3f} us/scene, "
+            f"turn_on {turn_on_time / 5 * 1e6 / count:6.3f} us/call"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
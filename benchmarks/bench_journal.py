@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+"""
+cost of journaling scene calls, compares DSCommandStack.append with and
+without a DSCommandJournal and counts the fsyncs of the batched flushes
+
+    $ python -m benchmarks.bench_journal [count]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from pydigitalstrom.journal import DSCommandJournal
+from tests.common import get_testclient
+
+
+async def measure(count: int, journal: DSCommandJournal = None) -> float:
+    client = get_testclient(stack_journal=journal)
+    start = time.perf_counter()
+    for i in range(count):
+        future = await client.stack.append(
+            url=f"/json/zone/callScene?id={i}&groupID=1&sceneNumber=5"
+        )
+        # acknowledge like a sent command
+        future.cancel()
+        if i % 100 == 0:
+            await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    duration = time.perf_counter() - start
+    await client.stack.stop()
+    return duration
+
+
+async def main(count: int):
+    with tempfile.TemporaryDirectory() as directory:
+        journal = DSCommandJournal(path=os.path.join(directory, "journal"))
+        plain = await measure(count)
+        journaled = await measure(count, journal=journal)
+        size = os.path.getsize(journal.path)
+
+    print(f"{count} scene calls")
+    print(f"  without journal: {plain / count * 1e6:6.2f} us/call")
+    print(
+        f"     with journal: {journaled / count * 1e6:6.2f} us/call, "
+        f"{journal.flushes} flushes, {journal.compactions} compactions, "
+        f"{size} bytes left"
+    )
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    asyncio.get_event_loop().run_until_complete(main(count))
@@ -0,0 +1,49 @@
+# -*- coding: UTF-8 -*-
+"""
+compare the json backends on a scene tree response of a large apartment and
+on websocket event frames, with and without the event name prefilter
+
+    $ python -m benchmarks.bench_json [zones]
+"""
+import json
+import sys
+import timeit
+
+from pydigitalstrom.generator import DSApartmentGenerator
+from pydigitalstrom.jsoncodec import DSJsonCodec
+from pydigitalstrom.websocket import DSWebsocketEventListener
+from tests.common import get_testclient
+
+
+def main(zones: int):
+    generator = DSApartmentGenerator(zones=zones, groups=8, scenes=4)
+    tree = generator.get_payload()
+    events = [json.dumps(event) for event in generator.get_events(count=1000)]
+    listener = DSWebsocketEventListener(client=get_testclient(), event_name="callScene")
+
+    print(f"scene tree of {zones} zones, {len(tree) / 1024:.0f} KiB")
+    for backend in DSJsonCodec.BACKENDS:
+        if not DSJsonCodec.available(backend):
+            print(f"{backend:>8}: not installed")
+            continue
+        loads = DSJsonCodec(backend=backend).loads
+        tree_time = min(timeit.repeat(lambda: loads(tree), number=10, repeat=5)) / 10
+        event_time = min(
+            timeit.repeat(lambda: [loads(e) for e in events], number=10, repeat=5)
+        ) / (10 * len(events))
+        filtered_time = min(
+            timeit.repeat(
+                lambda: [loads(e) for e in events if listener._is_wanted(data=e)],
+                number=10,
+                repeat=5,
+            )
+        ) / (10 * len(events))
+        print(
+            f"{backend:>8}: tree {tree_time * 1e3:.2f} ms, "
+            f"event {event_time * 1e6:.2f} us, "
+            f"event with prefilter {filtered_time * 1e6:.2f} us"
+        )
+
+
+if __name__ == "__main__":
+    main(zones=int(sys.argv[1]) if len(sys.argv) > 1 else 500)
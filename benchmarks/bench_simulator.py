@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+"""
+load test the client against the bundled dSS simulator, reports the time
+and memory of initialize(), command throughput and latency through the
+command stack, request latency and the websocket event rate
+
+    $ python -m benchmarks.bench_simulator [--zones 500] [--commands 2000]
+        [--concurrency 8] [--latency 0.002] [--json]
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from pydigitalstrom.dispatcher import DSEventDispatcher
+from pydigitalstrom.simulator import DSSimulator
+from pydigitalstrom.websocket import DSWebsocketEventListener
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def bench_initialize(simulator: DSSimulator) -> dict:
+    client = simulator.get_client()
+    start = time.perf_counter()
+    await client.initialize()
+    duration = time.perf_counter() - start
+    await client.close()
+
+    # tracing slows everything down, measure memory in a separate run
+    client = simulator.get_client()
+    tracemalloc.start()
+    await client.initialize()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await client.close()
+    return dict(
+        initialize_s=duration,
+        initialize_peak_mib=peak / 2**20,
+        initialize_retained_mib=current / 2**20,
+        scenes=len(client.get_scenes()),
+    )
+
+
+async def bench_commands(simulator: DSSimulator, commands: int, concurrency: int):
+    client = simulator.get_client(stack_delay=0, stack_concurrency=concurrency)
+    await client.initialize()
+    await client.stack.start()
+    scenes = [scene for scene in client.get_scenes().values() if scene.zone_id]
+    latencies = []
+
+    async def call(scene):
+        start = time.perf_counter()
+        await (await scene.turn_on())
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    # distinct scenes so no command is merged with a pending one
+    await asyncio.gather(
+        *[call(scenes[i % len(scenes)]) for i in range(min(commands, len(scenes)))]
+    )
+    duration = time.perf_counter() - start
+    await client.close()
+    return dict(
+        commands=len(latencies),
+        commands_per_s=len(latencies) / duration,
+        command_p50_ms=percentile(latencies, 0.5) * 1000,
+        command_p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+
+
+async def bench_requests(simulator: DSSimulator, requests: int):
+    client = simulator.get_client()
+    url = client.URL_APARTMENT_SCENE.format(scene_id=5)
+    await client.request(url=url)
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await client.request(url=url)
+        latencies.append(time.perf_counter() - start)
+    await client.close()
+    return dict(
+        request_p50_ms=percentile(latencies, 0.5) * 1000,
+        request_p99_ms=percentile(latencies, 0.99) * 1000,
+    )
+
+
+async def bench_events(simulator: DSSimulator, events: int):
+    client = simulator.get_client()
+    # block instead of dropping events to count every single one
+    listener = DSWebsocketEventListener(
+        client=client,
+        event_name="callScene",
+        dispatcher=DSEventDispatcher(overflow=DSEventDispatcher.OVERFLOW_BLOCK),
+    )
+    received = asyncio.Event()
+    count = 0
+
+    async def callback(event):
+        nonlocal count
+        count += 1
+        if count == events:
+            received.set()
+
+    connected = asyncio.Event()
+
+    async def state_callback(state):
+        if state == listener.STATE_CONNECTED:
+            connected.set()
+
+    listener.register(callback=callback)
+    listener.register_state_callback(callback=state_callback)
+    task = asyncio.ensure_future(listener.start())
+    await connected.wait()
+
+    event = dict(name="callScene", properties=dict(zoneID="1", sceneID="5"))
+    start = time.perf_counter()
+    for _ in range(events):
+        simulator.emit(event)
+    await received.wait()
+    duration = time.perf_counter() - start
+    await listener.stop()
+    await task
+    await client.close()
+    return dict(events_per_s=events / duration)
+
+
+async def main(args) -> dict:
+    results = dict()
+    async with DSSimulator(
+        zones=args.zones, latency=args.latency, jitter=args.latency / 2
+    ) as simulator:
+        results.update(await bench_initialize(simulator))
+        results.update(
+            await bench_commands(
+                simulator, commands=args.commands, concurrency=args.concurrency
+            )
+        )
+        results.update(await bench_requests(simulator, requests=args.requests))
+        results.update(await bench_events(simulator, events=args.events))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--zones", type=int, default=500)
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.002)
+    parser.add_argument("--json", action="store_true", help="print json for CI")
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(main(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for key, value in results.items():
+            print(
+                f"{key:>24}: {value:.2f}"
+                if isinstance(value, float)
+                else f"{key:>24}: {value}"
+            )
@@ -0,0 +1,172 @@
+# -*- coding: UTF-8 -*-
+"""
+scaling of initialize() and of the websocket event path on generated
+apartments of 10 to 10,000 zones, requires pytest-benchmark, psutil adds the
+resident memory to the results, rss_mib is left out without it
+
+    $ python -m pytest benchmarks/test_scaling.py [--benchmark-json=out.json]
+"""
+import asyncio
+import functools
+import gc
+import json
+import tracemalloc
+from typing import Optional
+from unittest.mock import patch
+
+import pytest
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover
+    psutil = None
+
+from pydigitalstrom.dispatcher import DSEventDispatcher
+from pydigitalstrom.generator import DSApartmentGenerator
+from pydigitalstrom.websocket import DSWebsocketEventListener
+from tests.common import get_testclient
+
+pytest.importorskip("pytest_benchmark")
+
+ZONES = (10, 100, 1000, 10000)
+EVENTS = 10000
+
+
+@functools.lru_cache(maxsize=None)
+def get_payload(zones: int) -> bytes:
+    return DSApartmentGenerator(zones=zones).get_payload()
+
+
+def get_rss() -> Optional[int]:
+    return psutil.Process().memory_info().rss if psutil is not None else None
+
+
+def get_rounds(zones: int) -> int:
+    # keep the big apartments from taking minutes
+    return max(3, min(50, 20000 // zones))
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.mark.parametrize("zones", ZONES)
+def test_decode(benchmark, zones):
+    client = get_testclient()
+    payload = get_payload(zones)
+    benchmark.extra_info["payload_kib"] = len(payload) / 1024
+    benchmark.pedantic(
+        client.codec.loads, args=(payload,), rounds=get_rounds(zones), iterations=1
+    )
+
+
+@pytest.mark.parametrize("zones", ZONES)
+def test_parse_structure(benchmark, zones):
+    client = get_testclient()
+    result = client.codec.loads(get_payload(zones))["result"]
+    zones_, named_scenes = benchmark.pedantic(
+        client._parse_structure,
+        kwargs=dict(result=result),
+        rounds=get_rounds(zones),
+        iterations=1,
+    )
+    assert len(named_scenes) == DSApartmentGenerator(zones=zones).scene_count
+
+
+@pytest.mark.parametrize("zones", ZONES)
+def test_create_scenes(benchmark, zones):
+    # fill the registry and create every scene object
+    result = get_testclient().codec.loads(get_payload(zones))["result"]
+    zones_, named_scenes = get_testclient()._parse_structure(result=result)
+
+    def setup():
+        return (get_testclient(),), dict()
+
+    def create(client):
+        client._apply_structure(zones=zones_, named_scenes=named_scenes)
+        return list(client.get_scenes().values())
+
+    scenes = benchmark.pedantic(
+        create, setup=setup, rounds=get_rounds(zones), iterations=1
+    )
+    benchmark.extra_info["scenes"] = len(scenes)
+
+
+@pytest.mark.parametrize("zones", ZONES)
+def test_initialize(benchmark, loop, zones):
+    # everything after the response arrived: decoding, parsing, registry
+    payload = get_payload(zones)
+
+    async def request(self, url, **kwargs):
+        return self.codec.loads(payload)
+
+    def setup():
+        return (get_testclient(),), dict()
+
+    def initialize(client):
+        loop.run_until_complete(client.initialize())
+        return client
+
+    with patch("pydigitalstrom.client.DSClient.request", new=request):
+        benchmark.pedantic(
+            initialize, setup=setup, rounds=get_rounds(zones), iterations=1
+        )
+
+        # memory of one more run, outside of the timed rounds
+        gc.collect()
+        rss = get_rss()
+        tracemalloc.start()
+        client = initialize(get_testclient())
+        list(client.get_scenes().values())
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        benchmark.extra_info["peak_mib"] = peak / 2**20
+        benchmark.extra_info["retained_mib"] = retained / 2**20
+        if rss is not None:
+            benchmark.extra_info["rss_mib"] = (get_rss() - rss) / 2**20
+        benchmark.extra_info["scenes"] = len(client.get_scenes())
+
+
+@pytest.mark.parametrize("prefilter", (True, False))
+def test_handle_event(benchmark, loop, prefilter):
+    # one in four frames is a subscribed callScene event
+    generator = DSApartmentGenerator(zones=100)
+    frames = [json.dumps(event) for event in generator.get_events(count=EVENTS)]
+    client = get_testclient()
+    dispatched = 0
+
+    async def callback(event):
+        nonlocal dispatched
+        dispatched += 1
+
+    def setup():
+        dispatcher = DSEventDispatcher(overflow=DSEventDispatcher.OVERFLOW_BLOCK)
+        listener = DSWebsocketEventListener(
+            client=client,
+            event_name="callScene",
+            dispatcher=dispatcher,
+            prefilter=prefilter,
+        )
+        listener.register(callback=callback)
+        return (listener,), dict()
+
+    async def handle(listener):
+        await listener.dispatcher.start()
+        # the same steps as the read loop of the listener
+        for frame in frames:
+            if listener._is_wanted(data=frame):
+                await listener._handle_event(event=client.codec.loads(frame))
+        await listener.dispatcher.join()
+        await listener.dispatcher.stop()
+
+    benchmark.pedantic(
+        lambda listener: loop.run_until_complete(handle(listener)),
+        setup=setup,
+        rounds=10,
+        iterations=1,
+    )
+    assert dispatched == 10 * EVENTS // 4
+    benchmark.extra_info["events_per_s"] = EVENTS / benchmark.stats.stats.mean
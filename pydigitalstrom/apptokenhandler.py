@@ -23,11 +23,12 @@ class DSAppTokenHandler(DSRequestHandler):
         username: str,
         password: str,
         loop: asyncio.AbstractEventLoop = None,
+        **kwargs,
     ) -> None:
         self.username = username
         self.password = password
 
-        super().__init__(host=host, port=port, loop=loop)
+        super().__init__(host=host, port=port, loop=loop, **kwargs)
 
     async def request_apptoken(self) -> Optional[str]:
         """
@@ -0,0 +1,37 @@
+import random
+
+
+class DSBackoff:
+    """
+    exponential backoff with jitter to not have many clients retry in sync
+    """
+
+    def __init__(
+        self,
+        base: float = 1,
+        maximum: float = 60,
+        factor: float = 2,
+        jitter: float = 0.5,
+    ):
+        """
+        :param base: delay before the first retry in seconds
+        :param maximum: upper bound of the delay in seconds
+        :param factor: growth of the delay per attempt
+        :param jitter: share of the delay that is randomized, 0 to 1
+        """
+        self.base = base
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self) -> float:
+        """
+        :return: seconds to wait before the next attempt
+        """
+        delay = min(self.maximum, self.base * self.factor ** self.attempts)
+        self.attempts += 1
+        return delay * (1 - self.jitter * random.random())
+
+    def reset(self):
+        self.attempts = 0
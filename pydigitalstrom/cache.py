@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+import asyncio
+
+from pydigitalstrom.log import DSLog
+
+
+class DSStructureCache:
+    """
+    persists the parsed apartment structure so a restart does not have to
+    fetch the whole scene tree from the server, the client only uses it while
+    the structure revision of the server is unchanged
+    """
+
+    VERSION = 3
+
+    def __init__(self, path: str, max_age: Optional[float] = 86400):
+        """
+        :param path: file to store the structure in
+        :param max_age: seconds a cached structure is used at most, even if
+            the server reports the same structure revision, None for no limit
+        """
+        self.path = path
+        self.max_age = max_age
+
+    def _load(self) -> Optional[dict]:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            DSLog.logger.warning(f"DS structure cache unreadable: {e!r}")
+            return None
+
+        if data.get("version") != self.VERSION:
+            return None
+        if self.max_age is not None and data["updated"] < time.time() - self.max_age:
+            return None
+        return data
+
+    def _save(self, data: dict):
+        # write to a temp file first to never leave a truncated cache behind
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".dscache")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def load(self) -> Optional[dict]:
+        """
+        :return: dict with fingerprint, revision, zones, zone_ids and scenes
+            or None if there is no valid cache
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, self._load)
+
+    async def save(
+        self,
+        fingerprint: str,
+        zones: list,
+        scenes: list,
+        zone_ids: list = (),
+        revision: str = None,
+    ):
+        """
+        :param fingerprint: hash of the server response the structure was
+            parsed from
+        :param zones: list of (zone_id, zone_name)
+        :param scenes: list of named scenes (zone_id, color, scene_id, name)
+        :param zone_ids: ids of all zones, unnamed ones included
+        :param revision: hash of the structure the scenes are built from, see
+            DSClient.get_structure_revision
+        """
+        data = dict(
+            version=self.VERSION,
+            updated=time.time(),
+            fingerprint=fingerprint,
+            revision=revision,
+            zones=zones,
+            zone_ids=list(zone_ids),
+            scenes=scenes,
+        )
+        await asyncio.get_event_loop().run_in_executor(None, self._save, data)
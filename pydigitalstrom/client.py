@@ -1,28 +1,49 @@
 # -*- coding: UTF-8 -*-
-import time
+import collections
+import hashlib
+import json
+from typing import Iterable, List, Optional
 
 import aiohttp
 import asyncio
 
 from pydigitalstrom.constants import SCENE_NAMES
+from pydigitalstrom.cache import DSStructureCache
+from pydigitalstrom.journal import DSCommandJournal
 from pydigitalstrom.exceptions import (
     DSException,
     DSCommandFailedException,
     DSRequestException,
+    DSUnauthorizedException,
 )
-from pydigitalstrom.requesthandler import DSRequestHandler
+from pydigitalstrom.metrics import DSMetrics, get_url_template
+from pydigitalstrom.properties import DSPropertyReader, extract_result, parse_query
+from pydigitalstrom.registry import DSSceneRegistry
+from pydigitalstrom.requesthandler import DSRequestHandler, ijson
+from pydigitalstrom.sessiontoken import DSSessionTokenManager
 
 
 class DSClient(DSRequestHandler):
     URL_SCENES = (
         "/json/property/query2?query=/apartment/zones/*(*)/" "groups/*(*)/scenes/*(*)"
     )
+    # the parts of the scene tree the scenes are built from, a lot smaller than
+    # URL_SCENES and unchanged by scene calls
+    QUERY_STRUCTURE = (
+        "/apartment/zones/*(ZoneID,name)/groups/*(color)/scenes/*(scene,name)"
+    )
+    URL_STRUCTURE = "/json/property/query2?query=" + QUERY_STRUCTURE
     URL_EVENT_SUBSCRIBE = "/json/event/subscribe?name={name}&" "subscriptionID={id}"
     URL_EVENT_UNSUBSCRIBE = "/json/event/unsubscribe?name={name}&" "subscriptionID={id}"
     URL_EVENT_POLL = "/json/event/get?subscriptionID={id}&timeout={timeout}"
 
     URL_SESSIONTOKEN = "/json/system/loginApplication?loginToken={apptoken}"
 
+    URL_APARTMENT_SCENE = "/json/apartment/callScene?sceneNumber={scene_id}&force=true"
+    URL_APARTMENT_COLOR_SCENE = (
+        "/json/apartment/callScene?sceneNumber={scene_id}&" "groupID={color}&force=true"
+    )
+
     def __init__(
         self,
         host: str,
@@ -30,20 +51,68 @@ class DSClient(DSRequestHandler):
         apptoken: str,
         apartment_name: str,
         stack_delay: int = 500,
+        stack_concurrency: int = 1,
+        stack_burst: int = 1,
+        stack_coalesce: bool = False,
+        stack_priorities: dict = None,
+        stack_journal: DSCommandJournal = None,
+        cache: DSStructureCache = None,
+        state_reconcile_interval: float = None,
+        stream_structure: bool = False,
+        property_ttl: float = 5,
+        property_ttls: dict = None,
         loop: asyncio.AbstractEventLoop = None,
+        **kwargs,
     ):
         self._apptoken = apptoken
         self._apartment_name = apartment_name
 
-        self._last_request = None
-        self._session_token = None
-        self._scenes = dict()
+        self._scenes = DSSceneRegistry(client=self)
+        self._zones = dict()
+        # ids of all zones, unnamed ones are not in _zones
+        self._zone_ids = set()
+        self._cache = cache
+        self._fingerprint = None
+        self._stream_structure = stream_structure
+
+        # session tokens time out 60 seconds after the last request
+        self.token_manager = DSSessionTokenManager(
+            fetch=self.get_session_token, lifetime=60, refresh_margin=10
+        )
 
         from pydigitalstrom.commandstack import DSCommandStack
 
-        self.stack = DSCommandStack(client=self, delay=stack_delay)
+        self.stack = DSCommandStack(
+            client=self,
+            delay=stack_delay,
+            concurrency=stack_concurrency,
+            burst=stack_burst,
+            coalesce_targets=stack_coalesce,
+            priorities=stack_priorities,
+            journal=stack_journal,
+        )
+
+        from pydigitalstrom.state import DSStateCache
+
+        self.state = DSStateCache(
+            client=self, reconcile_interval=state_reconcile_interval
+        )
+
+        self.properties = DSPropertyReader(
+            client=self, ttl=property_ttl, ttls=property_ttls
+        )
+
+        super().__init__(host=host, port=port, loop=loop, **kwargs)
 
-        super().__init__(host=host, port=port, loop=loop)
+    async def close(self):
+        """
+        stop the command stack and close the pooled session
+        """
+        await self.stack.stop()
+        await self.state.stop()
+        await self.properties.stop()
+        await self.token_manager.close()
+        await super().close()
 
     async def request(self, url: str, **kwargs):
         """
@@ -52,19 +121,58 @@ class DSClient(DSRequestHandler):
         :param str url:
         :return:
         """
-        # get a session id, they time out 60 seconds after the last request,
-        # we go for 50 to be secure
-        if not self._last_request or self._last_request < time.time() - 50:
-            self._session_token = await self.get_session_token()
-
-        # update last request timestamp and call api
-        self._last_request = time.time()
-        data = await self.raw_request(
-            url=url, params=dict(token=self._session_token), **kwargs
-        )
+        token = await self.token_manager.get_token()
+        try:
+            data = await self.raw_request(url=url, params=dict(token=token), **kwargs)
+        except DSUnauthorizedException:
+            # the server dropped our session, retry once with a fresh token
+            self.metrics.increment(
+                DSMetrics.REQUEST_RETRIES,
+                endpoint=get_url_template(url),
+                reason="unauthorized",
+            )
+            self.token_manager.invalidate(token=token)
+            token = await self.token_manager.get_token()
+            data = await self.raw_request(url=url, params=dict(token=token), **kwargs)
+        self.token_manager.touch()
         return data
 
+    async def request_items(self, url: str, prefix: str = "result", **kwargs):
+        """
+        run an authenticated request against the digitalstrom server and yield
+        the items of the object at prefix while the response is received
+
+        :param str url:
+        :param str prefix: key of the object to yield the items of
+        :return: async iterator of (key, value)
+        """
+        token = await self.token_manager.get_token()
+        yielded = False
+        try:
+            async for item in self.raw_request_items(
+                url=url, prefix=prefix, params=dict(token=token), **kwargs
+            ):
+                yielded = True
+                yield item
+        except DSUnauthorizedException:
+            if yielded:
+                raise
+            # the server dropped our session, retry once with a fresh token
+            self.metrics.increment(
+                DSMetrics.REQUEST_RETRIES,
+                endpoint=get_url_template(url),
+                reason="unauthorized",
+            )
+            self.token_manager.invalidate(token=token)
+            token = await self.token_manager.get_token()
+            async for item in self.raw_request_items(
+                url=url, prefix=prefix, params=dict(token=token), **kwargs
+            ):
+                yield item
+        self.token_manager.touch()
+
     async def get_session_token(self):
+        self.metrics.increment(DSMetrics.TOKEN_REFRESHES)
         data = await self.raw_request(
             self.URL_SESSIONTOKEN.format(apptoken=self._apptoken)
         )
@@ -73,66 +181,347 @@ class DSClient(DSRequestHandler):
         return data["result"]["token"]
 
     async def initialize(self):
-        from pydigitalstrom.devices.scene import DSScene, DSColorScene
+        """
+        load the scenes, from the structure cache if one is configured and
+        the structure revision of the server still matches or from the server
+        """
+        if self._cache is not None:
+            data = await self._cache.load()
+            # the cached structure is only used while the server reports the
+            # same structure revision
+            if data is not None:
+                if data["revision"] != await self.get_structure_revision():
+                    data = None
+            if data is not None:
+                self._fingerprint = data["fingerprint"]
+                self._zone_ids = set(data["zone_ids"])
+                self._apply_structure(
+                    zones=[tuple(zone) for zone in data["zones"]],
+                    named_scenes=[tuple(scene) for scene in data["scenes"]],
+                )
+                return
+
+        await self.refresh()
+
+    async def refresh(self) -> dict:
+        """
+        fetch the scenes from the server and only add, update or remove the
+        scenes that differ from the known ones
+
+        :return: dict with lists of added, changed and removed scene ids
+        """
+        if self._stream_structure and ijson is not None:
+            return await self._refresh_streaming()
 
-        # get scenes
         response = await self.request(url=self.URL_SCENES)
         if "result" not in response:
             raise DSCommandFailedException("no result in server response")
         result = response["result"]
 
+        digest = hashlib.sha1()
+        revision = hashlib.sha1()
+        for key, zone in result.items():
+            self._hash_zone(digest=digest, key=key, zone=zone)
+            self._hash_structure(digest=revision, key=key, zone=zone)
+        fingerprint = digest.hexdigest()
+        if fingerprint == self._fingerprint:
+            return dict(added=[], changed=[], removed=[])
+
+        zones, named_scenes = self._parse_structure(result=result)
+        diff = self._apply_structure(zones=zones, named_scenes=named_scenes)
+        await self._save_structure(
+            fingerprint=fingerprint,
+            zones=zones,
+            named_scenes=named_scenes,
+            zone_ids=[zone["ZoneID"] for zone in result.values()],
+            revision=revision.hexdigest(),
+        )
+        return diff
+
+    async def _refresh_streaming(self) -> dict:
+        # parse the response zone by zone and add the scenes of each zone to
+        # the registry right away, peak memory depends on the biggest zone
+        # instead of the whole apartment
+        digest = hashlib.sha1()
+        revision = hashlib.sha1()
+        zones = []
+        named_scenes = []
+        zone_ids = []
+        known = set(self._scenes)
+        added = []
+        changed = []
+        async for key, zone in self.request_items(url=self.URL_SCENES):
+            self._hash_zone(digest=digest, key=key, zone=zone)
+            self._hash_structure(digest=revision, key=key, zone=zone)
+            zone_ids.append(zone["ZoneID"])
+            parsed = self._parse_zone(key=key, zone=zone)
+            if parsed is None:
+                continue
+            zone_id, zone_name, zone_scenes = parsed
+            zones.append((zone_id, zone_name))
+            named_scenes.extend(zone_scenes)
+            self._add_rows(
+                rows=self._iter_scene_rows(
+                    zones=[(zone_id, zone_name)], named_scenes=zone_scenes
+                ),
+                known=known,
+                added=added,
+                changed=changed,
+            )
+
+        diff = self._remove_unknown(zones=zones, known=known)
+        fingerprint = digest.hexdigest()
+        if fingerprint == self._fingerprint:
+            return dict(added=[], changed=[], removed=[])
+        await self._save_structure(
+            fingerprint=fingerprint,
+            zones=zones,
+            named_scenes=named_scenes,
+            zone_ids=zone_ids,
+            revision=revision.hexdigest(),
+        )
+        return dict(added=added, changed=changed, **diff)
+
+    @staticmethod
+    def _hash_zone(digest, key: str, zone: dict):
+        # hash zone by zone so full and streamed responses match
+        digest.update(json.dumps([key, zone], sort_keys=True).encode("utf-8"))
+
+    @classmethod
+    def _hash_structure(cls, digest, key: str, zone: dict):
+        # hash only what QUERY_STRUCTURE returns, full responses and the
+        # structure query give the same revision
+        structure = extract_result(
+            result={key: zone}, segments=parse_query(cls.QUERY_STRUCTURE)
+        )
+        digest.update(json.dumps([key, structure], sort_keys=True).encode("utf-8"))
+
+    async def get_structure_revision(self) -> str:
+        """
+        fetch the parts of the scene tree the scenes are built from, without
+        the current state of the groups
+
+        :return: hash of the structure, it changes when zones or named scenes
+            are added, renamed or removed
+        :raises: DSRequestException
+        :raises: DSCommandFailedException
+        """
+        response = await self.request(url=self.URL_STRUCTURE)
+        if "result" not in response:
+            raise DSCommandFailedException("no result in server response")
+        digest = hashlib.sha1()
+        for key, zone in response["result"].items():
+            self._hash_structure(digest=digest, key=key, zone=zone)
+        return digest.hexdigest()
+
+    async def _save_structure(
+        self,
+        fingerprint: str,
+        zones: list,
+        named_scenes: list,
+        zone_ids: list,
+        revision: str,
+    ):
+        self._fingerprint = fingerprint
+        self._zone_ids = set(zone_ids)
+        if self._cache is not None:
+            await self._cache.save(
+                fingerprint=fingerprint,
+                zones=zones,
+                scenes=named_scenes,
+                zone_ids=zone_ids,
+                revision=revision,
+            )
+
+    def _parse_structure(self, result: dict) -> tuple:
+        """
+        :param result: query2 result of URL_SCENES
+        :return: list of (zone_id, zone_name) and list of named scenes as
+            (zone_id, color, scene_id, scene_name)
+        """
+        zones = []
+        named_scenes = []
+        for key, zone in result.items():
+            parsed = self._parse_zone(key=key, zone=zone)
+            if parsed is None:
+                continue
+            zone_id, zone_name, zone_scenes = parsed
+            zones.append((zone_id, zone_name))
+            named_scenes.extend(zone_scenes)
+        return zones, named_scenes
+
+    def _parse_zone(self, key: str, zone: dict) -> Optional[tuple]:
+        """
+        :param key: key of the zone in the query2 result
+        :param zone: query2 result of one zone
+        :return: zone_id, zone_name and list of named scenes as
+            (zone_id, color, scene_id, scene_name), None for unnamed zones
+        """
         # set name for apartment zone
-        if "zone0" in result and "name" in result["zone0"]:
-            result["zone0"]["name"] = self._apartment_name
+        if key == "zone0" and "name" in zone:
+            zone["name"] = self._apartment_name
+
+        # skip unnamed zones
+        if not zone["name"]:
+            return None
 
-        # create scene objects
-        for zone in result.values():
-            # skip unnamed zones
-            if not zone["name"]:
+        zone_id = zone["ZoneID"]
+        named_scenes = []
+
+        # add area and custom named scenes
+        for zone_key, zone_value in zone.items():
+            # we're only interested in groups
+            if not str(zone_key).startswith("group"):
                 continue
 
-            zone_id = zone["ZoneID"]
-            zone_name = zone["name"]
+            # remember the color
+            color = zone_value["color"]
+
+            for group_key, group_value in zone_value.items():
+                # we're only interested in scenes
+                if not str(group_key).startswith("scene"):
+                    continue
+
+                named_scenes.append(
+                    (zone_id, color, group_value["scene"], group_value["name"])
+                )
+        return zone_id, zone["name"], named_scenes
 
-            # add generic zone scenes
+    @staticmethod
+    def _iter_scene_rows(zones: list, named_scenes: list):
+        """
+        yield (unique_id, zone_id, zone_name, color, scene_id, scene_name) for
+        the generic scenes of every zone and the named scenes
+        """
+        zone_names = dict(zones)
+        for zone_id, zone_name in zones:
             for scene_id, scene_name in SCENE_NAMES.items():
-                id = "{zone_id}_{scene_id}".format(zone_id=zone_id, scene_id=scene_id)
-                self._scenes[id] = DSScene(
-                    client=self,
-                    zone_id=zone_id,
-                    zone_name=zone_name,
-                    scene_id=scene_id,
-                    scene_name=scene_name,
+                yield (
+                    f"{zone_id}_{scene_id}",
+                    zone_id,
+                    zone_name,
+                    None,
+                    scene_id,
+                    scene_name,
                 )
+        for zone_id, color, scene_id, scene_name in named_scenes:
+            yield (
+                f"{zone_id}_{color}_{scene_id}",
+                zone_id,
+                zone_names[zone_id],
+                color,
+                scene_id,
+                scene_name,
+            )
 
-            # add area and custom named scenes
-            for zone_key, zone_value in zone.items():
-                # we're only interested in groups
-                if not str(zone_key).startswith("group"):
-                    continue
+    def _apply_structure(self, zones: list, named_scenes: list) -> dict:
+        added = []
+        changed = []
+        known = set(self._scenes)
+        self._add_rows(
+            rows=self._iter_scene_rows(zones=zones, named_scenes=named_scenes),
+            known=known,
+            added=added,
+            changed=changed,
+        )
+        return dict(added=added, changed=changed, **self._remove_unknown(zones, known))
+
+    def _add_rows(self, rows: Iterable, known: set, added: list, changed: list):
+        for row in rows:
+            known.discard(row[0])
+            status = self._scenes.add(*row)
+            if status == "added":
+                added.append(row[0])
+            elif status == "changed":
+                changed.append(row[0])
 
-                # remember the color
-                color = zone_value["color"]
-
-                for group_key, group_value in zone_value.items():
-                    # we're only interested in scenes
-                    if not str(group_key).startswith("scene"):
-                        continue
-
-                    scene_id = group_value["scene"]
-                    scene_name = group_value["name"]
-                    id = "{zone_id}_{color}_{scene_id}".format(
-                        zone_id=zone_id, color=color, scene_id=scene_id
-                    )
-
-                    self._scenes[id] = DSColorScene(
-                        client=self,
-                        zone_id=zone_id,
-                        zone_name=zone_name,
-                        scene_id=scene_id,
-                        scene_name=scene_name,
-                        color=color,
-                    )
-
-    def get_scenes(self):
+    def _remove_unknown(self, zones: list, known: set) -> dict:
+        for id in known:
+            self._scenes.remove(id)
+        self._zones = dict(zones)
+        return dict(removed=sorted(known))
+
+    def get_scenes(self) -> DSSceneRegistry:
         return self._scenes
+
+    def get_zones(self):
+        return self._zones
+
+    @staticmethod
+    def _get_scene_target(scene) -> tuple:
+        if isinstance(scene, tuple):
+            zone_id, color, scene_id = scene
+            return zone_id, color, scene_id
+        return scene.zone_id, getattr(scene, "color", None), scene.scene_id
+
+    @staticmethod
+    def _conflicts(a: tuple, b: tuple) -> bool:
+        """
+        :param a: (color, scene_id) of a scene
+        :param b: (color, scene_id) of another scene
+        :return: whether both scenes may apply to the same devices, generic
+            scenes (color None) apply to all groups of a zone
+        """
+        return a[0] is None or b[0] is None or a[0] == b[0]
+
+    async def call_scenes(self, scenes: Iterable, deadline: float = None) -> List:
+        """
+        call many scenes at once in batch order, a scene called in every
+        zone of the apartment, unnamed ones included, is sent as a single
+        apartment wide call unless the batch calls another scene of the same
+        group, all others are fanned out over the command stack
+
+        :param scenes: scene objects or (zone_id, color, scene_id) tuples,
+            color is None for generic scenes
+        :param deadline: time.monotonic() the scenes have to be called by,
+            later ones are dropped and fail with asyncio.TimeoutError
+        :return: result or exception per scene, in order
+        """
+        from pydigitalstrom.devices.scene import DSScene, DSColorScene
+
+        targets = [self._get_scene_target(scene) for scene in scenes]
+
+        # find scenes called in all zones of the apartment
+        zones_by_scene = collections.defaultdict(set)
+        for zone_id, color, scene_id in targets:
+            zones_by_scene[(color, scene_id)].add(zone_id)
+        # the apartment call also reaches zones without a name
+        all_zones = self._zone_ids - {0}
+        collapsed = set()
+        for key, zone_ids in zones_by_scene.items():
+            if not all_zones or not all_zones <= zone_ids:
+                continue
+            # other scenes of the same group have to keep their order
+            if any(
+                self._conflicts(key, other) for other in zones_by_scene if other != key
+            ):
+                continue
+            collapsed.add(key)
+
+        # enqueue in batch order, an apartment call takes the place of the
+        # first scene it replaces
+        apartment_calls = dict()
+        futures = []
+        for zone_id, color, scene_id in targets:
+            if (color, scene_id) in collapsed:
+                future = apartment_calls.get((color, scene_id))
+                if future is None:
+                    if color is None:
+                        url = self.URL_APARTMENT_SCENE.format(scene_id=scene_id)
+                    else:
+                        url = self.URL_APARTMENT_COLOR_SCENE.format(
+                            scene_id=scene_id, color=color
+                        )
+                    future = await self.stack.append(url=url, deadline=deadline)
+                    apartment_calls[(color, scene_id)] = future
+            elif color is None:
+                url = DSScene.URL_TURN_ON.format(zone_id=zone_id, scene_id=scene_id)
+                future = await self.stack.append(url=url, deadline=deadline)
+            else:
+                url = DSColorScene.URL_TURN_ON.format(
+                    zone_id=zone_id, color=color, scene_id=scene_id
+                )
+                future = await self.stack.append(url=url, deadline=deadline)
+            futures.append(future)
+
+        return await asyncio.gather(*futures, return_exceptions=True)
@@ -1,30 +1,521 @@
 import asyncio
+import collections
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 
 from pydigitalstrom.client import DSClient
+from pydigitalstrom.constants import (
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    SAFETY_SCENES,
+)
+from pydigitalstrom.journal import DSCommandJournal
+from pydigitalstrom.log import DSLog
+from pydigitalstrom.metrics import DSMetrics, get_url_template
+from pydigitalstrom.ratelimit import DSTokenBucket
+
+
+class DSCommand:
+    __slots__ = (
+        "url",
+        "target",
+        "scene_id",
+        "lane",
+        "waiters",
+        "enqueued",
+        "skip",
+        "queued",
+        "deadline",
+        "journal_id",
+        "idempotent",
+    )
+
+    def __init__(
+        self,
+        url: str,
+        target: Optional[Tuple] = None,
+        scene_id: Optional[int] = None,
+        lane: int = PRIORITY_NORMAL,
+        deadline: Optional[float] = None,
+        idempotent: bool = True,
+    ):
+        self.url = url
+        self.target = target
+        self.scene_id = scene_id
+        self.lane = lane
+        self.waiters = []
+        self.enqueued = time.monotonic()
+        self.skip = False
+        self.queued = False
+        self.deadline = deadline
+        self.journal_id = None
+        self.idempotent = idempotent
+
+    def extend_deadline(self, deadline: Optional[float]):
+        """
+        the command runs until the latest deadline of its callers, None for
+        callers without a deadline
+        """
+        if self.deadline is not None:
+            self.deadline = None if deadline is None else max(self.deadline, deadline)
+
+    def add_waiter(self) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        self.waiters.append(future)
+        return future
+
+    def resolve(self, result):
+        for future in self.waiters:
+            if not future.done():
+                future.set_result(result)
+
+    def fail(self, exception: BaseException):
+        for future in self.waiters:
+            if not future.done():
+                future.set_exception(exception)
+
+    def cancel(self):
+        for future in self.waiters:
+            future.cancel()
 
 
 class DSCommandStack:
-    def __init__(self, client: DSClient, delay: int = 500):
+    # share of the workers each lane gets while all lanes are backlogged,
+    # lower lanes keep a share to not starve
+    LANE_WEIGHTS = {PRIORITY_HIGH: 8, PRIORITY_NORMAL: 4, PRIORITY_LOW: 1}
+
+    def __init__(
+        self,
+        client: DSClient,
+        delay: int = 500,
+        concurrency: int = 1,
+        burst: int = 1,
+        coalesce_targets: bool = False,
+        priorities: Dict[int, int] = None,
+        journal: DSCommandJournal = None,
+    ):
+        """
+        :param client: the client to run the commands with
+        :param delay: minimum average delay between two commands in ms, the
+            DS server gets overloaded by too many requests
+        :param concurrency: maximum number of commands in flight
+        :param burst: number of commands that may be sent without delay after
+            the stack has been idle
+        :param coalesce_targets: only send the newest pending scene call per
+            zone and group, dimming steps are always sent
+        :param priorities: lane per scene id, safety scenes go to the
+            PRIORITY_HIGH lane by default
+        :param journal: persists queued commands, they are replayed on start
+            after a restart
+        """
         self._client = client
-        self._stack = list()
         self._task = None
         self._delay = delay
+        self._concurrency = max(1, concurrency)
+        self._bucket = DSTokenBucket(
+            rate=1000 / delay if delay else None, capacity=max(1, burst)
+        )
+        self._coalesce_targets = coalesce_targets
+        if priorities is None:
+            priorities = {scene_id: PRIORITY_HIGH for scene_id in SAFETY_SCENES}
+        self._priorities = priorities
+        self._journal = journal
 
-    async def append(self, url: str):
-        self._stack.append(url)
+        # one queue per lane, workers pick lanes in weighted round robin order
+        self._lanes = {lane: collections.deque() for lane in self.LANE_WEIGHTS}
+        self._schedule = self._build_schedule(self.LANE_WEIGHTS)
+        self._schedule_pos = 0
+        self._condition = None
+        self._unfinished = 0
+        self._finished = None
 
-    async def execute(self):
+        # newest pending command by url and by scene call target
+        self._pending = dict()
+        self._targets = dict()
+        # commands taken from the lanes by a worker and not done yet
+        self._active = set()
+
+        self.executed = 0
+        self.failed = 0
+        self.merged = 0
+        self.superseded = 0
+        self.discarded = 0
+        self.replayed = 0
+        self.max_wait = {lane: 0.0 for lane in self.LANE_WEIGHTS}
+
+    @staticmethod
+    def _build_schedule(weights: Dict[int, int]) -> list:
+        # interleave the lanes, e.g. 0 1 0 2 0 1 ... instead of 0 0 0 1 1 2
+        schedule = []
+        credits = dict(weights)
+        while any(credits.values()):
+            for lane in sorted(credits):
+                if credits[lane]:
+                    schedule.append(lane)
+                    credits[lane] -= 1
+        return schedule
+
+    def _get_condition(self) -> asyncio.Condition:
+        # create the synchronization primitives lazily to bind them to the
+        # running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+            self._finished = asyncio.Event()
+            self._finished.set()
+        return self._condition
+
+    def __len__(self):
+        return sum(
+            not command.skip for lane in self._lanes.values() for command in lane
+        )
+
+    def get_queue_depth(self, lane: int) -> int:
+        return len(self._lanes[lane])
+
+    @staticmethod
+    def parse(url: str) -> Tuple[Optional[Tuple], Optional[int]]:
+        """
+        get the zone and group a scene call applies to and the called scene
+
+        :param url: URL path of the command
+        :return: ((path, zone id, group id), scene id), both None for other
+            commands
+        """
+        parts = urlsplit(url)
+        if not parts.path.endswith("/callScene"):
+            return None, None
+        params = parse_qs(parts.query)
+        target = (
+            parts.path,
+            params.get("id", [None])[0],
+            params.get("groupID", [None])[0],
+        )
+        try:
+            scene_id = int(params["sceneNumber"][0])
+        except (KeyError, ValueError):
+            scene_id = None
+        return target, scene_id
+
+    @classmethod
+    def get_target(cls, url: str) -> Optional[Tuple]:
+        return cls.parse(url)[0]
+
+    async def append(
+        self, url: str, priority: int = None, deadline: float = None
+    ) -> asyncio.Future:
+        """
+        enqueue a command, it is merged with an identical pending command if
+        no other call for the same target was queued since
+
+        :param url: URL path to request
+        :param priority: lane to enqueue to, derived from the scene by default
+        :param deadline: time.monotonic() the command has to be done by, the
+            future fails with asyncio.TimeoutError when it passes
+        :return: future resolving to the server response or error, cancel it
+            to drop the command if no one else waits for it
+        """
+        return await self._enqueue(url=url, priority=priority, deadline=deadline)
+
+    async def _enqueue(
+        self,
+        url: str,
+        priority: int = None,
+        deadline: float = None,
+        journal_id: int = None,
+    ) -> asyncio.Future:
+        command = self._pending.get(url)
+        if command is not None and self._can_merge(command):
+            self.merged += 1
+            command.extend_deadline(deadline)
+            # the pending command has a journal record of its own
+            if journal_id is not None:
+                self._journal.acknowledge(journal_id)
+            return self._add_waiter(command, deadline=deadline)
+
+        target, scene_id = self.parse(url)
+        if priority is None:
+            priority = self._priorities.get(scene_id, PRIORITY_NORMAL)
+        command = DSCommand(
+            url=url,
+            target=target,
+            scene_id=scene_id,
+            lane=min(max(priority, PRIORITY_HIGH), PRIORITY_LOW),
+            deadline=deadline,
+            idempotent=self._client.retry_policy.is_idempotent(url),
+        )
+        if self._journal is not None:
+            if journal_id is None:
+                journal_id = self._journal.write(url=url, lane=command.lane)
+            command.journal_id = journal_id
+        future = self._add_waiter(command, deadline=deadline)
+        self._supersede(command)
+        self._pending[url] = command
+        await self._put(command)
+        return future
+
+    def _add_waiter(self, command: DSCommand, deadline: float = None) -> asyncio.Future:
+        future = command.add_waiter()
+        future.add_done_callback(self._log_failure)
+        future.add_done_callback(lambda _: self._discard(command))
+        if deadline is not None:
+            handle = asyncio.get_event_loop().call_later(
+                max(0, deadline - time.monotonic()), self._expire, future
+            )
+            future.add_done_callback(lambda _: handle.cancel())
+        return future
+
+    @staticmethod
+    def _expire(future: asyncio.Future):
+        if not future.done():
+            future.set_exception(asyncio.TimeoutError())
+
+    def _discard(self, command: DSCommand):
+        # drop a queued command as soon as no caller waits for it anymore
+        # instead of keeping it until a worker gets to it
+        if not command.queued or not self._obsolete(command):
+            return
+        command.queued = False
+        lane = self._lanes[command.lane]
+        lane.remove(command)
+        self._client.metrics.set(DSMetrics.QUEUE_DEPTH, len(lane), lane=command.lane)
+        self._forget(command)
+        self._acknowledge(command)
+        self.discarded += 1
+        self._task_done()
+
+    async def _put(self, command: DSCommand):
+        condition = self._get_condition()
+        lane = self._lanes[command.lane]
+        command.queued = True
+        lane.append(command)
+        self._client.metrics.set(DSMetrics.QUEUE_DEPTH, len(lane), lane=command.lane)
+        self._unfinished += 1
+        self._finished.clear()
+        async with condition:
+            condition.notify_all()
+
+    def _has_work(self, lanes) -> bool:
+        return any(self._lanes[lane] for lane in lanes)
+
+    def _pop(self, lanes) -> DSCommand:
+        # walk the schedule until we find a lane with pending commands
+        for _ in range(len(self._schedule)):
+            lane = self._schedule[self._schedule_pos]
+            self._schedule_pos = (self._schedule_pos + 1) % len(self._schedule)
+            if lane in lanes and self._lanes[lane]:
+                command = self._lanes[lane].popleft()
+                command.queued = False
+                self._client.metrics.set(
+                    DSMetrics.QUEUE_DEPTH, len(self._lanes[lane]), lane=lane
+                )
+                return command
+
+    def _can_merge(self, command: DSCommand) -> bool:
+        # merged callers are served at the place of the pending command, that
+        # is only the same if no other call for its target was queued since
+        # and sending it once has the same effect as sending it twice
+        if not command.idempotent:
+            return False
+        return command.target is None or self._targets.get(command.target) is command
+
+    def _supersede(self, command: DSCommand):
+        # a newer scene call makes pending calls for the same target obsolete,
+        # their callers get the result of the newer call
+        if command.target is None:
+            return
+        previous = self._targets.get(command.target)
+        self._targets[command.target] = command
+        if not self._coalesce_targets or previous is None:
+            return
+        # dimming steps are relative to the current value, they neither
+        # replace a scene nor are replaced by one
+        if not previous.idempotent or not command.idempotent:
+            return
+        # a safety scene or a call of a higher lane is never dropped for a
+        # call of a lower one
+        if previous.lane < command.lane or previous.scene_id in SAFETY_SCENES:
+            return
+        previous.skip = True
+        command.waiters.extend(previous.waiters)
+        command.extend_deadline(previous.deadline)
+        if self._pending.get(previous.url) is previous:
+            del self._pending[previous.url]
+        self._acknowledge(previous)
+        self.superseded += 1
+
+    def _acknowledge(self, command: DSCommand):
+        # the command was sent or dropped, it must not be replayed
+        if command.journal_id is not None:
+            self._journal.acknowledge(command.journal_id)
+            command.journal_id = None
+
+    def _forget(self, command: DSCommand):
+        if self._pending.get(command.url) is command:
+            del self._pending[command.url]
+        if self._targets.get(command.target) is command:
+            del self._targets[command.target]
+
+    def _take(self, command: DSCommand):
+        # the command is in flight, new calls have to be queued again
+        self._forget(command)
+        wait = time.monotonic() - command.enqueued
+        if wait > self.max_wait[command.lane]:
+            self.max_wait[command.lane] = wait
+        self._client.metrics.observe(
+            DSMetrics.COMMAND_WAIT,
+            wait,
+            lane=command.lane,
+            endpoint=get_url_template(command.url),
+        )
+
+    @staticmethod
+    def _obsolete(command: DSCommand) -> bool:
+        # skip superseded commands and those no caller is waiting for
+        return command.skip or all(f.done() for f in command.waiters)
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future):
+        # fetching the exception marks it as retrieved for unawaited commands
+        if not future.cancelled() and future.exception() is not None:
+            DSLog.logger.warning(f"DS command failed: {future.exception()!r}")
+
+    async def _run(self, command: DSCommand):
+        start = time.monotonic()
+        try:
+            result = await self._client.request(
+                url=command.url, deadline=command.deadline
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            self._acknowledge(command)
+            command.fail(e)
+        else:
+            self.executed += 1
+            self._acknowledge(command)
+            command.resolve(result)
+        finally:
+            self._client.metrics.observe(
+                DSMetrics.COMMAND_SERVICE,
+                time.monotonic() - start,
+                lane=command.lane,
+                endpoint=get_url_template(command.url),
+            )
+
+    def _task_done(self):
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._finished.set()
+
+    async def _worker(self, lanes):
+        condition = self._get_condition()
         while True:
-            # check for command to execute
-            if len(self._stack) > 0:
-                await self._client.request(url=self._stack.pop(0))
+            async with condition:
+                await condition.wait_for(lambda: self._has_work(lanes=lanes))
+                command = self._pop(lanes=lanes)
+            self._active.add(command)
+            try:
+                if self._obsolete(command):
+                    self._forget(command)
+                    self._acknowledge(command)
+                    continue
+                # high priority commands skip the rate limit, all others wait
+                # to not overload the DS server
+                if command.lane != PRIORITY_HIGH:
+                    await self._bucket.acquire()
+                    if self._obsolete(command):
+                        self._forget(command)
+                        self._acknowledge(command)
+                        continue
+                self._take(command)
+                await self._run(command=command)
+            finally:
+                self._active.discard(command)
+                self._task_done()
 
-            # sleep for x ms before next execution to not overload the DS server
-            await asyncio.sleep(self._delay / 1000)
+    async def execute(self):
+        """
+        run the workers until cancelled, they sleep until commands arrive
+
+        an extra worker is reserved for the high priority lane so safety
+        scenes never wait for commands in flight on the other lanes
+        """
+        workers = [asyncio.ensure_future(self._worker(lanes=(PRIORITY_HIGH,)))]
+        workers.extend(
+            asyncio.ensure_future(self._worker(lanes=tuple(self._lanes)))
+            for _ in range(self._concurrency)
+        )
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def join(self):
+        """
+        wait until all enqueued commands have been executed
+        """
+        self._get_condition()
+        await self._finished.wait()
+
+    async def replay(self):
+        """
+        queue the commands of the journal that were not sent before the last
+        stop or crash, their results are only logged
+        """
+        # commands queued before start are journaled already
+        queued = {
+            command.journal_id for lane in self._lanes.values() for command in lane
+        }
+        for record in await self._journal.load():
+            if record.id in queued:
+                continue
+            deadline = None
+            if self._journal.ttl is not None:
+                age = time.time() - record.timestamp
+                deadline = time.monotonic() + self._journal.ttl - age
+            await self._enqueue(
+                url=record.url,
+                priority=record.lane,
+                deadline=deadline,
+                journal_id=record.id,
+            )
+            self.replayed += 1
 
     async def start(self):
-        self.task = asyncio.Task(self.execute())
+        if self._journal is not None:
+            await self.replay()
+        self._task = asyncio.Task(self.execute())
 
     async def stop(self):
-        if self.task:
-            self.task.cancel()
+        """
+        cancel the workers and pending commands, journaled commands stay in
+        the journal to be replayed on the next start
+        """
+        # commands in flight or waiting for the rate limit are cancelled
+        # with their workers
+        active = list(self._active)
+        if self._task:
+            self._task.cancel()
+            # wait for the workers to let go of their commands
+            await asyncio.wait([self._task])
+            self._task = None
+        for command in active:
+            command.cancel()
+
+        # cancel pending commands, nobody is going to execute them
+        for lane in self._lanes.values():
+            while lane:
+                command = lane.popleft()
+                command.queued = False
+                command.cancel()
+                self._task_done()
+        self._pending.clear()
+        self._targets.clear()
+        if self._journal is not None:
+            await self._journal.close()
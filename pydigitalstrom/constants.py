@@ -1,5 +1,15 @@
 # -*- coding: UTF-8 -*-
 
+SCENE_DEC = 11
+SCENE_INC = 12
+SCENE_AREA_1_DEC = 42
+SCENE_AREA_1_INC = 43
+SCENE_AREA_2_DEC = 44
+SCENE_AREA_2_INC = 45
+SCENE_AREA_3_DEC = 46
+SCENE_AREA_3_INC = 47
+SCENE_AREA_4_DEC = 48
+SCENE_AREA_4_INC = 49
 SCENE_AUTO_STANDBY = 64
 SCENE_PANIC = 65
 SCENE_ENERGY_OVERLOAD = 66
@@ -47,3 +57,33 @@ SCENE_NAMES = {
     SCENE_HAIL: "HAIL",
     SCENE_NO_HAIL: "NO_HAIL",
 }
+
+# scenes that must not wait behind comfort scenes
+SAFETY_SCENES = (
+    SCENE_PANIC,
+    SCENE_FIRE,
+    SCENE_ALARM_1,
+    SCENE_ALARM_2,
+    SCENE_ALARM_3,
+    SCENE_ALARM_4,
+    SCENE_DOOR_BELL,
+)
+
+# scenes that dim or move relative to the current value, calling them twice
+# is not the same as calling them once
+STEP_SCENES = (
+    SCENE_DEC,
+    SCENE_INC,
+    SCENE_AREA_1_DEC,
+    SCENE_AREA_1_INC,
+    SCENE_AREA_2_DEC,
+    SCENE_AREA_2_INC,
+    SCENE_AREA_3_DEC,
+    SCENE_AREA_3_INC,
+    SCENE_AREA_4_DEC,
+    SCENE_AREA_4_INC,
+)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
@@ -2,6 +2,8 @@ from pydigitalstrom.client import DSClient
 
 
 class DSDevice(object):
+    __slots__ = ("_client", "_id", "_name")
+
     ID_FIELD = "id"
 
     def __init__(self, client: DSClient, device_id, device_name, *args, **kwargs):
@@ -22,5 +24,13 @@ class DSDevice(object):
     def unique_id(self):
         return self._id
 
-    async def request(self, url: str, **kwargs):
-        await self._client.stack.append(url=url.format(**kwargs))
+    async def request(self, url: str, deadline: float = None, **kwargs):
+        """
+        enqueue a command on the client command stack
+
+        :param deadline: time.monotonic() the command has to be done by
+        :return: future resolving to the server response
+        """
+        if kwargs:
+            url = url.format(**kwargs)
+        return await self._client.stack.append(url=url, deadline=deadline)
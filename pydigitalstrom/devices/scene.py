@@ -4,6 +4,8 @@ from pydigitalstrom.devices.base import DSDevice
 
 
 class DSScene(DSDevice):
+    __slots__ = ("zone_id", "zone_name", "scene_id", "scene_name", "_url")
+
     URL_TURN_ON = (
         "/json/zone/callScene?id={zone_id}&" "sceneNumber={scene_id}&force=true"
     )
@@ -16,31 +18,34 @@ class DSScene(DSDevice):
         scene_id,
         scene_name,
         *args,
-        **kwargs
+        **kwargs,
     ):
         self.zone_id = zone_id
         self.zone_name = zone_name
         self.scene_id = scene_id
         self.scene_name = scene_name
 
-        device_id = "{zone_id}_{scene_id}".format(
-            zone_id=self.zone_id, scene_id=self.scene_id
-        )
-        device_name = "{zone} / {name}".format(
-            zone=self.zone_name, name=self.scene_name
-        )
+        # the command never changes, build it once
+        self._url = self.URL_TURN_ON.format(zone_id=zone_id, scene_id=scene_id)
+
+        device_id = f"{zone_id}_{scene_id}"
+        device_name = f"{zone_name} / {scene_name}"
 
         super().__init__(
             client=client, device_id=device_id, device_name=device_name, *args, **kwargs
         )
 
-    async def turn_on(self):
-        await self.request(
-            url=self.URL_TURN_ON.format(zone_id=self.zone_id, scene_id=self.scene_id)
-        )
+    async def turn_on(self, deadline: float = None):
+        """
+        :param deadline: time.monotonic() the scene has to be called by
+        :return: future resolving to the server response
+        """
+        return await self.request(url=self._url, deadline=deadline)
 
 
 class DSColorScene(DSDevice):
+    __slots__ = ("zone_id", "zone_name", "scene_id", "scene_name", "color", "_url")
+
     URL_TURN_ON = (
         "/json/zone/callScene?id={zone_id}&"
         "sceneNumber={scene_id}&groupID={color}&force=true"
@@ -55,7 +60,7 @@ class DSColorScene(DSDevice):
         scene_name,
         color,
         *args,
-        **kwargs
+        **kwargs,
     ):
         self.zone_id = zone_id
         self.zone_name = zone_name
@@ -63,20 +68,21 @@ class DSColorScene(DSDevice):
         self.scene_name = scene_name
         self.color = color
 
-        device_id = "{zone_id}_{color}_{scene_id}".format(
-            zone_id=self.zone_id, color=self.color, scene_id=self.scene_id
-        )
-        device_name = "{zone} / {name}".format(
-            zone=self.zone_name, name=self.scene_name
+        # the command never changes, build it once
+        self._url = self.URL_TURN_ON.format(
+            zone_id=zone_id, color=color, scene_id=scene_id
         )
 
+        device_id = f"{zone_id}_{color}_{scene_id}"
+        device_name = f"{zone_name} / {scene_name}"
+
         super().__init__(
             client=client, device_id=device_id, device_name=device_name, *args, **kwargs
         )
 
-    async def turn_on(self):
-        await self.request(
-            url=self.URL_TURN_ON.format(
-                zone_id=self.zone_id, color=self.color, scene_id=self.scene_id
-            )
-        )
+    async def turn_on(self, deadline: float = None):
+        """
+        :param deadline: time.monotonic() the scene has to be called by
+        :return: future resolving to the server response
+        """
+        return await self.request(url=self._url, deadline=deadline)
@@ -0,0 +1,274 @@
+import asyncio
+import collections
+from typing import Callable, Hashable, Optional
+
+from pydigitalstrom.log import DSLog
+
+
+def get_event_key(event: dict) -> Hashable:
+    """
+    events for the same name, zone and group replace each other when coalesced
+    """
+    properties = event.get("properties") or dict()
+    return (event.get("name"), properties.get("zoneID"), properties.get("groupID"))
+
+
+def _get_id(event: dict, key: str):
+    # ids are strings in the event properties and integers in the source
+    value = (event.get("properties") or dict()).get(key)
+    if value is None:
+        value = (event.get("source") or dict()).get(key)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def get_event_route(event: dict) -> tuple:
+    """
+    :return: (event name, zone id, group id, scene id) of an event
+    """
+    return (
+        event.get("name"),
+        _get_id(event, "zoneID"),
+        _get_id(event, "groupID"),
+        _get_id(event, "sceneID"),
+    )
+
+
+class DSEventDispatcher:
+    """
+    hands events to callbacks from a bounded queue so slow callbacks never
+    block reading events from the server
+    """
+
+    OVERFLOW_DROP_OLDEST = "drop_oldest"
+    OVERFLOW_BLOCK = "block"
+    OVERFLOW_COALESCE = "coalesce"
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        workers: int = 1,
+        concurrent: bool = True,
+        callback_timeout: Optional[float] = None,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+        key: Callable[[dict], Hashable] = get_event_key,
+    ):
+        """
+        :param maxsize: maximum number of queued events
+        :param workers: number of events dispatched at once
+        :param concurrent: run the callbacks of an event concurrently instead
+            of one after another
+        :param callback_timeout: seconds a callback may take, None for no limit
+        :param overflow: what to do when the queue is full: drop the oldest
+            event, block the reader or replace a queued event of the same key
+        :param key: function returning the coalescing key of an event
+        """
+        if overflow not in (
+            self.OVERFLOW_DROP_OLDEST,
+            self.OVERFLOW_BLOCK,
+            self.OVERFLOW_COALESCE,
+        ):
+            raise ValueError(f"unknown overflow policy {overflow}")
+
+        self._maxsize = maxsize
+        self._workers = max(1, workers)
+        self._concurrent = concurrent
+        self._callback_timeout = callback_timeout
+        self._overflow = overflow
+        self._key = key
+
+        # callbacks by (event name, zone id, group id, scene id) filter, None
+        # matches everything, the masks tell which filter fields are in use
+        self._routes = dict()
+        self._masks = collections.Counter()
+        self._registrations = 0
+        # entries are [key, event], the event is replaced when coalescing
+        self._queue = collections.deque()
+        self._queued_keys = dict()
+        self._condition = None
+        self._tasks = []
+        self._active = 0
+
+        self.received = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def register(
+        self,
+        callback: callable,
+        event_name: str = None,
+        zone_id: int = None,
+        group: int = None,
+        scene_id: int = None,
+    ):
+        """
+        register a callback for the events matching all given filters
+
+        :param callback: coroutine function called with event=...
+        :param event_name: only events of this name
+        :param zone_id: only events for this zone
+        :param group: only events for this group (color)
+        :param scene_id: only events for this scene
+        """
+        route = (event_name, zone_id, group, scene_id)
+        self._registrations += 1
+        self._routes.setdefault(route, []).append((self._registrations, callback))
+        self._masks[tuple(value is not None for value in route)] += 1
+
+    def unregister(self, callback: callable):
+        """
+        remove a callback from all filters it was registered for
+        """
+        for route, callbacks in list(self._routes.items()):
+            remaining = [entry for entry in callbacks if entry[1] != callback]
+            removed = len(callbacks) - len(remaining)
+            if not removed:
+                continue
+            self._masks[tuple(value is not None for value in route)] -= removed
+            if remaining:
+                self._routes[route] = remaining
+            else:
+                del self._routes[route]
+        self._masks = +self._masks
+
+    def get_callbacks(self, event: dict) -> list:
+        """
+        get the callbacks matching an event in registration order, only one
+        lookup per combination of filter fields in use is needed
+        """
+        route = get_event_route(event)
+        matches = []
+        for mask in self._masks:
+            # events without a value can't match a filter on it
+            if any(used and value is None for value, used in zip(route, mask)):
+                continue
+            key = tuple(value if used else None for value, used in zip(route, mask))
+            matches.extend(self._routes.get(key, ()))
+        matches.sort(key=lambda entry: entry[0])
+        return [callback for _, callback in matches]
+
+    def _get_condition(self) -> asyncio.Condition:
+        # create the condition lazily to bind it to the running loop
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def put(self, event: dict):
+        """
+        enqueue an event, applies the overflow policy if the queue is full
+        """
+        condition = self._get_condition()
+        self.received += 1
+        async with condition:
+            if len(self._queue) >= self._maxsize:
+                if self._overflow == self.OVERFLOW_BLOCK:
+                    await condition.wait_for(lambda: len(self._queue) < self._maxsize)
+                elif self._overflow == self.OVERFLOW_COALESCE and self._coalesce(
+                    event=event
+                ):
+                    return
+                else:
+                    self._drop_oldest()
+
+            key = self._key(event)
+            entry = [key, event]
+            self._queue.append(entry)
+            self._queued_keys[key] = entry
+            self.max_depth = max(self.max_depth, len(self._queue))
+            condition.notify_all()
+
+    def _coalesce(self, event: dict) -> bool:
+        entry = self._queued_keys.get(self._key(event))
+        if entry is None:
+            return False
+        entry[1] = event
+        self.coalesced += 1
+        return True
+
+    def _drop_oldest(self):
+        key, event = entry = self._queue.popleft()
+        if self._queued_keys.get(key) is entry:
+            del self._queued_keys[key]
+        self.dropped += 1
+
+    async def _get(self) -> dict:
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: len(self._queue) > 0)
+            key, event = entry = self._queue.popleft()
+            if self._queued_keys.get(key) is entry:
+                del self._queued_keys[key]
+            self._active += 1
+            # wake up readers blocked on a full queue
+            condition.notify_all()
+        return event
+
+    async def _call(self, callback: callable, event: dict):
+        try:
+            await asyncio.wait_for(
+                callback(event=event), timeout=self._callback_timeout
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            DSLog.logger.warning(f"DS event callback {callback!r} timed out")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            DSLog.logger.warning(f"DS event callback {callback!r} failed: {e!r}")
+
+    async def dispatch(self, event: dict):
+        """
+        run the callbacks for an event
+        """
+        callbacks = self.get_callbacks(event=event)
+        if self._concurrent:
+            await asyncio.gather(
+                *[self._call(callback, event) for callback in callbacks]
+            )
+        else:
+            for callback in callbacks:
+                await self._call(callback, event)
+        self.dispatched += 1
+
+    async def _worker(self):
+        condition = self._get_condition()
+        while True:
+            event = await self._get()
+            try:
+                await self.dispatch(event=event)
+            finally:
+                async with condition:
+                    self._active -= 1
+                    condition.notify_all()
+
+    async def join(self):
+        """
+        wait until all queued events have been dispatched
+        """
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(
+                lambda: len(self._queue) == 0 and self._active == 0
+            )
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [
+                asyncio.ensure_future(self._worker()) for _ in range(self._workers)
+            ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
@@ -11,3 +11,11 @@ class DSRequestException(DSException):
 
 class DSCommandFailedException(DSException):
     pass
+
+
+class DSUnauthorizedException(DSRequestException, DSCommandFailedException):
+    pass
+
+
+class DSCircuitOpenException(DSRequestException):
+    pass
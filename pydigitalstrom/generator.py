@@ -0,0 +1,221 @@
+import json
+import random
+
+from pydigitalstrom.properties import parse_query
+
+
+# query of the scene structure the client loads on initialize
+QUERY_SCENES = "/apartment/zones/*(*)/groups/*(*)/scenes/*(*)"
+
+
+def query_tree(node: dict, path: str) -> dict:
+    """
+    evaluate a query2 expression like /apartment/zones/*(ZoneID,name) on a
+    property tree, segments with fields in parentheses add a level to the
+    result keyed by the node name, others just descend
+
+    :param node: tree node, dict with "properties" and "children"
+    :param path: query2 expression
+    :return: the query2 result
+    """
+    return _query_segments(node=node, segments=parse_query(path))
+
+
+def _query_segments(node: dict, segments: tuple) -> dict:
+    result = dict()
+    if not segments:
+        return result
+
+    name, fields = segments[0]
+    children = node["children"]
+    if name == "*":
+        matches = list(children.items())
+    elif name in children:
+        matches = [(name, children[name])]
+    else:
+        matches = []
+
+    for child_name, child in matches:
+        if fields is None:
+            result.update(_query_segments(node=child, segments=segments[1:]))
+            continue
+        entry = {
+            key: value
+            for key, value in child["properties"].items()
+            if "*" in fields or key in fields
+        }
+        entry.update(_query_segments(node=child, segments=segments[1:]))
+        result[child_name] = entry
+    return result
+
+
+def _node(children: dict = None, **properties) -> dict:
+    return dict(properties=properties, children=children or dict())
+
+
+class DSApartmentGenerator:
+    """
+    builds synthetic apartments of any size for the simulator and for
+    benchmarks, the same seed always gives the same apartment
+
+        generator = DSApartmentGenerator(zones=1000, groups=3, scenes=4)
+        payload = generator.get_payload()
+    """
+
+    # scene numbers of the named scenes in every group, most used first
+    SCENE_IDS = (5, 17, 18, 19, 0, 6, 7, 8, 9, 1, 2, 3, 4)
+    # group ids are the colors: light, shade, climate, audio, video,
+    # security, access, joker and single devices
+    COLORS = (1, 2, 3, 4, 5, 6, 7, 8, 9)
+    GROUP_NAMES = (
+        "broadcast",
+        "yellow",
+        "gray",
+        "blue",
+        "cyan",
+        "magenta",
+        "red",
+        "green",
+        "black",
+        "white",
+    )
+    ROOMS = (
+        "Living room",
+        "Kitchen",
+        "Bedroom",
+        "Bathroom",
+        "Hallway",
+        "Office",
+        "Kids room",
+        "Guest room",
+        "Dining room",
+        "Basement",
+        "Garage",
+        "Terrace",
+        "Wohnzimmer",
+        "Küche",
+        "Schlafzimmer",
+        "Büro",
+    )
+    SCENE_NAMES = (
+        "Bright",
+        "Reading",
+        "Dinner",
+        "TV",
+        "Cooking",
+        "Relax",
+        "Night light",
+        "Party",
+        "Cleaning",
+        "Morning",
+        "Gemütlich",
+        "Sonnenschutz",
+    )
+
+    def __init__(self, zones: int = 10, groups: int = 3, scenes: int = 4, seed=0):
+        """
+        :param zones: number of named zones besides the apartment zone 0
+        :param groups: number of groups (colors) per zone, up to 9
+        :param scenes: number of named scenes per group, up to 13
+        :param seed: seed of the names and last called scenes
+        """
+        self.zones = zones
+        self.groups = min(groups, len(self.COLORS))
+        self.scenes = min(scenes, len(self.SCENE_IDS))
+        self.seed = seed
+
+    @property
+    def scene_count(self) -> int:
+        """
+        :return: number of named scenes in the apartment
+        """
+        return self.zones * self.groups * self.scenes
+
+    def build_tree(self) -> dict:
+        """
+        :return: property tree of the apartment, nodes are dicts with
+            "properties" and "children"
+        """
+        rng = random.Random(self.seed)
+        zone_nodes = dict()
+        for zone_id in range(self.zones + 1):
+            group_nodes = dict()
+            # group 0 addresses all devices of a zone and has no named scenes
+            for color in (0,) + self.COLORS[: self.groups]:
+                scene_nodes = dict()
+                if zone_id and color:
+                    for scene_id in self.SCENE_IDS[: self.scenes]:
+                        scene_nodes[f"scene{scene_id}"] = _node(
+                            scene=scene_id, name=rng.choice(self.SCENE_NAMES)
+                        )
+                group_nodes[f"group{color}"] = _node(
+                    dict(scenes=_node(scene_nodes)) if scene_nodes else None,
+                    group=color,
+                    name=self.GROUP_NAMES[color],
+                    color=color,
+                    isValid=True,
+                    lastCalledScene=rng.choice(self.SCENE_IDS[: self.scenes] or (0,))
+                    if zone_id and color
+                    else 0,
+                )
+            name = f"{rng.choice(self.ROOMS)} {zone_id}" if zone_id else ""
+            zone_nodes[f"zone{zone_id}"] = _node(
+                dict(groups=_node(group_nodes)), ZoneID=zone_id, name=name
+            )
+        return _node(dict(apartment=_node(dict(zones=_node(zone_nodes)))))
+
+    def get_events(
+        self,
+        count: int,
+        names=("callScene", "zoneSensorValue", "stateChange", "deviceSensorValue"),
+    ) -> list:
+        """
+        :param count: number of events
+        :param names: event names, used in turn
+        :return: events for random zones, groups and scenes of the apartment
+            as the server sends them on the websocket
+        """
+        rng = random.Random(self.seed)
+        colors = self.COLORS[: self.groups] or (0,)
+        scene_ids = self.SCENE_IDS[: self.scenes] or (0,)
+        events = []
+        for i in range(count):
+            zone_id = rng.randint(1, self.zones) if self.zones else 0
+            color = rng.choice(colors)
+            events.append(
+                dict(
+                    name=names[i % len(names)],
+                    properties=dict(
+                        zoneID=str(zone_id),
+                        groupID=str(color),
+                        sceneID=str(rng.choice(scene_ids)),
+                        originToken="",
+                        originDSUID="%034X" % rng.getrandbits(136),
+                        callOrigin="2",
+                    ),
+                    source=dict(
+                        set=f".zone({zone_id}).group({color})",
+                        groupID=color,
+                        zoneID=zone_id,
+                        isApartment=zone_id == 0,
+                        isGroup=True,
+                        isDevice=False,
+                    ),
+                )
+            )
+        return events
+
+    def get_result(self, query: str = QUERY_SCENES) -> dict:
+        """
+        :param query: query2 expression
+        :return: the query2 result the server would send
+        """
+        return query_tree(node=self.build_tree(), path=query)
+
+    def get_payload(self, query: str = QUERY_SCENES) -> bytes:
+        """
+        :param query: query2 expression
+        :return: the encoded query2 response
+        """
+        data = dict(ok=True, result=self.get_result(query=query))
+        return json.dumps(data).encode("utf-8")
@@ -0,0 +1,233 @@
+import asyncio
+import mmap
+import os
+import tempfile
+import time
+from typing import List, NamedTuple, Optional
+
+from pydigitalstrom.log import DSLog
+
+
+class DSJournalRecord(NamedTuple):
+    id: int
+    timestamp: float
+    lane: int
+    url: str
+
+
+class DSCommandJournal:
+    """
+    append-only journal of queued commands so they survive a restart, one
+    line per record:
+
+        A <id> <unix time> <lane> <url>
+        K <id>
+
+    A lines are written when a command is queued, K lines when it was sent,
+    failed or dropped. Writes are buffered and flushed with a single fsync
+    per batch, commands queued within flush_interval before a crash may be
+    lost. Commands in flight when the process dies are replayed, they are
+    sent at least once.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: Optional[float] = 300,
+        flush_interval: float = 0.05,
+        compact_after: int = 1000,
+    ):
+        """
+        :param path: file to keep the journal in
+        :param ttl: seconds after which a queued command is too old to be
+            replayed, None to replay all of them
+        :param flush_interval: seconds to collect records before writing them
+            with one fsync
+        :param compact_after: number of acknowledged commands after which the
+            journal is rewritten with only the pending ones
+        """
+        self.path = path
+        self.ttl = ttl
+        self._flush_interval = flush_interval
+        self._compact_after = compact_after
+
+        # id -> A line of the commands not acknowledged yet
+        self._live = dict()
+        # commands may be queued before the journal is loaded, ids start at
+        # the time in microseconds to not collide with the ones of earlier runs
+        self._next_id = int(time.time() * 1e6)
+        self._acknowledged = 0
+        self._buffer = bytearray()
+        self._file = None
+        self._flush_task = None
+        self._lock = None
+
+        self.written = 0
+        self.flushes = 0
+        self.compactions = 0
+
+    def __len__(self):
+        return len(self._live)
+
+    def _get_lock(self) -> asyncio.Lock:
+        # create the lock lazily to bind it to the running loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def write(self, url: str, lane: int) -> int:
+        """
+        record a queued command, it is written with the next flush
+
+        :param url: URL path of the command
+        :param lane: lane the command is queued in
+        :return: id to acknowledge the command with
+        """
+        id = self._next_id
+        self._next_id += 1
+        line = f"A {id} {time.time():.3f} {lane} {url}\n".encode("utf-8")
+        self._live[id] = line
+        self._append(line)
+        self.written += 1
+        return id
+
+    def acknowledge(self, id: int):
+        """
+        mark a command as done, it is not replayed anymore
+        """
+        if self._live.pop(id, None) is None:
+            return
+        self._acknowledged += 1
+        self._append(b"K %d\n" % id)
+
+    def _append(self, line: bytes):
+        self._buffer += line
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._flush_interval)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self, compact: bool = False):
+        """
+        write the buffered records to disk, rewrite the journal instead if
+        enough commands were acknowledged
+
+        :param compact: rewrite the journal in any case
+        """
+        async with self._get_lock():
+            compact = compact or self._acknowledged >= self._compact_after
+            if not self._buffer and not compact:
+                return
+            # take the records and the pending commands at the same point, a
+            # compacted journal contains everything buffered so far
+            data, self._buffer = bytes(self._buffer), bytearray()
+            live = None
+            if compact:
+                live = list(self._live.values())
+                self._acknowledged = 0
+                self.compactions += 1
+            self.flushes += 1
+            await asyncio.get_event_loop().run_in_executor(None, self._sync, data, live)
+
+    def _sync(self, data: bytes, live: Optional[List[bytes]]):
+        if live is not None:
+            self._rewrite(live)
+            return
+        if self._file is None:
+            self._file = open(self.path, "ab")
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rewrite(self, lines: List[bytes]):
+        # write to a temp file first to never leave a truncated journal behind
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".dsjournal")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, "ab")
+
+    def _read(self) -> List[DSJournalRecord]:
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+
+        records = dict()
+        with f:
+            if not os.fstat(f.fileno()).st_size:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for line in iter(data.readline, b""):
+                    # a torn write at the end of the file is ignored
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        if line.startswith(b"A "):
+                            _, id, timestamp, lane, url = line[:-1].split(b" ", 4)
+                            records[int(id)] = DSJournalRecord(
+                                id=int(id),
+                                timestamp=float(timestamp),
+                                lane=int(lane),
+                                url=url.decode("utf-8"),
+                            )
+                        elif line.startswith(b"K "):
+                            records.pop(int(line[2:-1]), None)
+                    except ValueError:
+                        DSLog.logger.warning(f"DS journal record unreadable: {line!r}")
+        return sorted(records.values())
+
+    async def load(self) -> List[DSJournalRecord]:
+        """
+        read the commands that were queued but not acknowledged, commands
+        older than the ttl are dropped
+
+        :return: records of the commands to replay, oldest first
+        """
+        await self.flush()
+        async with self._get_lock():
+            records = await asyncio.get_event_loop().run_in_executor(None, self._read)
+        now = time.time()
+        replay = []
+        for record in records:
+            self._next_id = max(self._next_id, record.id + 1)
+            if self.ttl is not None and now - record.timestamp > self.ttl:
+                self._live.pop(record.id, None)
+                continue
+            self._live[record.id] = (
+                f"A {record.id} {record.timestamp:.3f} {record.lane} "
+                f"{record.url}\n".encode("utf-8")
+            )
+            replay.append(record)
+        if len(records) > len(replay):
+            DSLog.logger.info(
+                f"DS journal dropped {len(records) - len(replay)} expired commands"
+            )
+        # start over with only the commands to replay
+        await self.flush(compact=True)
+        return replay
+
+    async def close(self):
+        """
+        write the buffered records and close the file
+        """
+        # a flush in progress holds the lock until its write is done
+        await self.flush()
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
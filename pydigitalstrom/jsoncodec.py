@@ -0,0 +1,50 @@
+import json
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+
+class DSJsonCodec:
+    """
+    decodes server responses from raw bytes with the fastest json library
+    installed, orjson or ujson, falling back to the standard library
+    """
+
+    BACKENDS = ("orjson", "ujson", "json")
+
+    # all backends raise subclasses of ValueError on invalid input
+    DecodeError = ValueError
+
+    def __init__(self, backend: str = None):
+        """
+        :param backend: "orjson", "ujson" or "json", the fastest installed one
+            by default
+        """
+        if backend is None:
+            backend = next(name for name in self.BACKENDS if self.available(name))
+        elif not self.available(backend):
+            raise ValueError(f"json backend {backend} is not installed")
+        self.backend = backend
+        self.loads = self._get_loads(backend)
+
+    @staticmethod
+    def available(backend: str) -> bool:
+        return dict(orjson=orjson, ujson=ujson, json=json).get(backend) is not None
+
+    @staticmethod
+    def _get_loads(backend: str) -> Callable[[bytes], Any]:
+        if backend == "orjson":
+            return orjson.loads
+        if backend == "ujson":
+            return ujson.loads
+        if backend == "json":
+            return json.loads
+        raise ValueError(f"unknown json backend {backend}")
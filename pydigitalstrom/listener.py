@@ -0,0 +1,189 @@
+import aiohttp
+import asyncio
+from typing import Iterable
+
+from pydigitalstrom.backoff import DSBackoff
+from pydigitalstrom.client import DSClient
+from pydigitalstrom.dispatcher import DSEventDispatcher
+from pydigitalstrom.exceptions import DSException
+from pydigitalstrom.log import DSLog
+from pydigitalstrom.metrics import DSMetrics
+
+
+class DSBaseEventListener:
+    """
+    callback registration shared by the websocket and the long-poll listener
+    """
+
+    def __init__(
+        self,
+        client: DSClient,
+        event_name: str = None,
+        event_names: Iterable[str] = (),
+        dispatcher: DSEventDispatcher = None,
+    ):
+        """
+        :param client: the client to connect with
+        :param event_name: name of the event to forward to the callbacks
+        :param event_names: more names of events to forward to the callbacks
+        :param dispatcher: queue and workers running the callbacks
+        """
+        self._client = client
+        self._event_names = set(event_names)
+        if event_name is not None:
+            self._event_names.add(event_name)
+        self._dispatcher = dispatcher or DSEventDispatcher()
+
+    @property
+    def dispatcher(self) -> DSEventDispatcher:
+        return self._dispatcher
+
+    def register(
+        self,
+        callback: callable,
+        event_name: str = None,
+        zone_id: int = None,
+        group: int = None,
+        scene_id: int = None,
+    ):
+        """
+        register a callback for the subscribed events matching all given
+        filters, registering for an event name subscribes to it
+        """
+        if event_name is not None:
+            self._event_names.add(event_name)
+        self._dispatcher.register(
+            callback=callback,
+            event_name=event_name,
+            zone_id=zone_id,
+            group=group,
+            scene_id=scene_id,
+        )
+
+    def unregister(self, callback: callable):
+        self._dispatcher.unregister(callback=callback)
+
+
+class DSEventListener(DSBaseEventListener):
+    """
+    long-poll listener for servers or proxies that block websockets, one poll
+    request is in flight at all times and returns the events in batches
+    """
+
+    def __init__(
+        self,
+        client: DSClient,
+        event_id: int,
+        event_name: str = None,
+        timeout: float = 30,
+        loop: asyncio.AbstractEventLoop = None,
+        event_names: Iterable[str] = (),
+        dispatcher: DSEventDispatcher = None,
+        backoff: DSBackoff = None,
+    ):
+        """
+        :param client: the client to poll with
+        :param event_id: subscription id, unique per client
+        :param event_name: name of the event to subscribe to
+        :param timeout: seconds the server holds a poll request without events
+        :param loop: asyncio loop to poll in
+        :param event_names: more names of events to subscribe to
+        :param dispatcher: queue and workers running the callbacks
+        :param backoff: delays after failed polls, 1 to 60 seconds by default
+        """
+        super().__init__(
+            client=client,
+            event_name=event_name,
+            event_names=event_names,
+            dispatcher=dispatcher,
+        )
+        self._event_id = event_id
+        self._timeout = timeout
+        self.loop = loop
+        self._backoff = backoff or DSBackoff(base=1, maximum=60)
+
+        self._task = None
+        self._subscribed = set()
+        self._subscribed_token = None
+        self.polls = 0
+        self.resubscribes = 0
+
+    async def _subscribe(self):
+        # subscriptions belong to a session, after the token changed they're gone
+        token = self._client.token_manager.token
+        if self._subscribed and token != self._subscribed_token:
+            self._subscribed.clear()
+            self.resubscribes += 1
+
+        for name in sorted(self._event_names - self._subscribed):
+            await self._client.request(
+                url=self._client.URL_EVENT_SUBSCRIBE.format(
+                    name=name, id=self._event_id
+                )
+            )
+            self._subscribed.add(name)
+        self._subscribed_token = self._client.token_manager.token
+
+    async def _unsubscribe(self):
+        for name in sorted(self._subscribed):
+            await self._client.request(
+                url=self._client.URL_EVENT_UNSUBSCRIBE.format(
+                    name=name, id=self._event_id
+                )
+            )
+        self._subscribed.clear()
+
+    async def poll(self):
+        """
+        run one poll request and queue the received events
+        """
+        await self._subscribe()
+        url = self._client.URL_EVENT_POLL.format(
+            id=self._event_id, timeout=int(self._timeout * 1000)
+        )
+        # the server holds the poll open up to the timeout, don't give up before
+        timeout = self._client.get_timeout(url=url)
+        if timeout.sock_read is not None and timeout.sock_read <= self._timeout:
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=timeout.sock_connect,
+                sock_read=self._timeout + 30,
+            )
+        response = await self._client.request(url=url, timeout=timeout)
+        self.polls += 1
+        for event in response.get("result", dict()).get("events", []):
+            self._client.metrics.increment(DSMetrics.EVENTS, event=event.get("name"))
+            if event.get("name") in self._event_names:
+                await self._dispatcher.put(event=event)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except DSException as e:
+                # most likely the session expired, subscribe again
+                DSLog.logger.warning(f"DS event poll failed: {e!r}")
+                self._subscribed.clear()
+                await asyncio.sleep(self._backoff.next_delay())
+            else:
+                self._backoff.reset()
+
+    async def start(self):
+        """
+        start polling in the background
+        """
+        await self._dispatcher.start()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self._dispatcher.stop()
+        try:
+            await self._unsubscribe()
+        except DSException as e:
+            DSLog.logger.warning(f"DS event unsubscribe failed: {e!r}")
@@ -0,0 +1,506 @@
+import array
+import asyncio
+import bisect
+import itertools
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+from pydigitalstrom.exceptions import DSCommandFailedException, DSException
+from pydigitalstrom.log import DSLog
+
+AGGREGATIONS = ("mean", "min", "max", "sum", "first", "last", "count")
+
+
+def _check_aggregation(how: str):
+    if how not in AGGREGATIONS:
+        raise ValueError(f"unknown aggregation {how}")
+
+
+def aggregate(values: Sequence[float], how: str = "mean") -> Optional[float]:
+    """
+    :param values: samples, an array.array, numpy array or list
+    :param how: one of AGGREGATIONS
+    :return: the aggregated value, None if there are no samples
+    """
+    _check_aggregation(how)
+    if how == "count":
+        return len(values)
+    if not len(values):
+        return None
+    if how == "first":
+        return float(values[0])
+    if how == "last":
+        return float(values[-1])
+    if numpy is not None:
+        values = numpy.asarray(values)
+        return float(getattr(numpy, how)(values))
+    if how == "mean":
+        return sum(values) / len(values)
+    return float(dict(min=min, max=max, sum=sum)[how](values))
+
+
+def downsample(
+    timestamps: Sequence[float],
+    values: Sequence[float],
+    interval: float,
+    how: str = "mean",
+) -> Tuple:
+    """
+    aggregate samples into buckets of interval seconds, aligned to multiples
+    of the interval
+
+    :param timestamps: ascending timestamps of the samples
+    :param values: the samples
+    :param interval: seconds per bucket
+    :param how: one of AGGREGATIONS
+    :return: timestamps of the buckets and aggregated values, numpy arrays if
+        numpy is installed, array.array otherwise
+    """
+    _check_aggregation(how)
+    if numpy is not None:
+        return _downsample_numpy(timestamps, values, interval, how)
+
+    buckets = array.array("d")
+    result = array.array("d")
+    samples = zip(timestamps, values)
+    for bucket, group in itertools.groupby(samples, key=lambda s: s[0] // interval):
+        group = [value for _, value in group]
+        buckets.append(bucket * interval)
+        result.append(aggregate(group, how=how))
+    return buckets, result
+
+
+def _downsample_numpy(timestamps, values, interval: float, how: str) -> Tuple:
+    timestamps = numpy.asarray(timestamps, dtype=numpy.float64)
+    values = numpy.asarray(values, dtype=numpy.float64)
+    if not len(timestamps):
+        return timestamps, values
+
+    buckets = numpy.floor_divide(timestamps, interval)
+    # timestamps are sorted, a bucket starts wherever the bucket number changes
+    starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(buckets)) + 1))
+    counts = numpy.diff(numpy.append(starts, len(values)))
+    if how == "mean":
+        result = numpy.add.reduceat(values, starts) / counts
+    elif how == "sum":
+        result = numpy.add.reduceat(values, starts)
+    elif how == "min":
+        result = numpy.minimum.reduceat(values, starts)
+    elif how == "max":
+        result = numpy.maximum.reduceat(values, starts)
+    elif how == "first":
+        result = values[starts]
+    elif how == "last":
+        result = values[starts + counts - 1]
+    else:
+        result = counts.astype(numpy.float64)
+    return buckets[starts] * interval, result
+
+
+class DSRingBuffer:
+    """
+    fixed number of (timestamp, value) samples in two array.array columns,
+    16 bytes per sample with the default typecodes, the oldest samples are
+    overwritten once it is full
+    """
+
+    def __init__(self, capacity: int, typecode: str = "d"):
+        """
+        :param capacity: maximum number of samples
+        :param typecode: array typecode of the values, "f" halves the memory
+        """
+        if capacity < 1:
+            raise ValueError("capacity has to be positive")
+        self.capacity = capacity
+        self.timestamps = array.array("d", bytes(8 * capacity))
+        self.values = array.array(typecode, bytes(self._itemsize(typecode) * capacity))
+        self._start = 0
+        self._size = 0
+
+    @staticmethod
+    def _itemsize(typecode: str) -> int:
+        return array.array(typecode).itemsize
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_timestamp(self) -> Optional[float]:
+        if not self._size:
+            return None
+        return self.timestamps[(self._start + self._size - 1) % self.capacity]
+
+    def append(self, timestamp: float, value: float):
+        """
+        add a sample, timestamps have to be ascending
+        """
+        end = (self._start + self._size) % self.capacity
+        self.timestamps[end] = timestamp
+        self.values[end] = value
+        if self._size < self.capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self.capacity
+
+    def extend(self, samples: Iterable[Tuple[float, float]]):
+        for timestamp, value in samples:
+            self.append(timestamp, value)
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+    def _ordered(self, column: array.array) -> array.array:
+        start = self._start
+        end = start + self._size
+        if end <= self.capacity:
+            return column[start:end]
+        return column[start:] + column[: end - self.capacity]
+
+    def get_samples(self) -> Tuple[array.array, array.array]:
+        """
+        :return: copies of the timestamps and values, oldest first
+        """
+        return self._ordered(self.timestamps), self._ordered(self.values)
+
+    def as_numpy(self) -> Tuple:
+        """
+        :return: timestamps and values as numpy arrays, oldest first, views of
+            the buffer until it wraps around, copies after
+        """
+        if numpy is None:
+            raise DSException("numpy views require numpy")
+        timestamps = numpy.frombuffer(self.timestamps, dtype=numpy.float64)
+        values = numpy.frombuffer(self.values, dtype=self.values.typecode)
+        start = self._start
+        end = start + self._size
+        if end <= self.capacity:
+            return timestamps[start:end], values[start:end]
+        index = numpy.concatenate(
+            (numpy.arange(start, self.capacity), numpy.arange(end - self.capacity))
+        )
+        return timestamps[index], values[index]
+
+    def window(self, start: float = None, end: float = None) -> Tuple:
+        """
+        :param start: first timestamp to include, None for the oldest
+        :param end: timestamp to stop before, None for the newest
+        :return: timestamps and values within the window, numpy arrays if
+            numpy is installed, array.array otherwise
+        """
+        if numpy is not None:
+            timestamps, values = self.as_numpy()
+            first = 0 if start is None else numpy.searchsorted(timestamps, start)
+            last = len(timestamps)
+            if end is not None:
+                last = numpy.searchsorted(timestamps, end)
+            return timestamps[first:last], values[first:last]
+
+        timestamps, values = self.get_samples()
+        first = 0 if start is None else bisect.bisect_left(timestamps, start)
+        last = len(timestamps) if end is None else bisect.bisect_left(timestamps, end)
+        return timestamps[first:last], values[first:last]
+
+
+class DSMeteringPoller:
+    """
+    polls the latest values of all meters on one schedule and keeps them in
+    ring buffers per meter and type, samples of one poll share the timestamp
+    of its tick so the series line up
+
+        poller = DSMeteringPoller(client=client, interval=1, capacity=86400)
+        await poller.start()
+        ...
+        timestamps, watts = poller.get_total(start=time.time() - 3600)
+    """
+
+    URL_LATEST = "/json/metering/getLatest?from={meters}&type={type}"
+    URL_VALUES = (
+        "/json/metering/getValues?dsuid={meter}&type={type}&"
+        "resolution={resolution}&valueCount={count}"
+    )
+
+    TYPE_CONSUMPTION = "consumption"
+    TYPE_ENERGY = "energy"
+
+    def __init__(
+        self,
+        client,
+        interval: float = 1,
+        types: Iterable[str] = (TYPE_CONSUMPTION,),
+        meters: str = ".meters(all)",
+        capacity: int = 86400,
+        typecode: str = "d",
+        clock=time.time,
+    ):
+        """
+        :param client: the client to poll with
+        :param interval: seconds between polls, ticks are aligned to
+            multiples of it
+        :param types: metering types to poll
+        :param meters: meter set to poll, all meters of the apartment by
+            default
+        :param capacity: samples kept per meter and type
+        :param typecode: array typecode of the values
+        :param clock: wall clock, the server uses unix timestamps
+        """
+        self._client = client
+        self._interval = interval
+        self._types = tuple(types)
+        self._meters = meters
+        self._capacity = capacity
+        self._typecode = typecode
+        self._clock = clock
+
+        # (meter, type) -> DSRingBuffer
+        self._series = dict()
+        self._task = None
+
+        self.polls = 0
+        self.failures = 0
+        self.backfilled = 0
+
+    def get_meters(self) -> List[str]:
+        """
+        :return: dSUIDs of the meters seen so far
+        """
+        return sorted({meter for meter, _ in self._series})
+
+    def get_series(self, meter: str, type: str = TYPE_CONSUMPTION) -> DSRingBuffer:
+        """
+        :param meter: dSUID of the meter
+        :param type: metering type
+        :return: the samples of the meter
+        """
+        key = (meter, type)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = DSRingBuffer(
+                capacity=self._capacity, typecode=self._typecode
+            )
+        return series
+
+    def _get_tick(self, timestamp: float) -> float:
+        return timestamp - timestamp % self._interval
+
+    def _store(self, series: DSRingBuffer, timestamp: float, value: float) -> bool:
+        # late answers of a previous tick or backfilled values never go back
+        last = series.last_timestamp
+        if last is not None and timestamp <= last:
+            return False
+        series.append(timestamp, value)
+        return True
+
+    async def poll(self, timestamp: float = None):
+        """
+        fetch the latest value of all meters for every type concurrently and
+        store them with the timestamp of the tick, missed ticks are filled
+        with getValues
+
+        :param timestamp: time of the tick, now by default
+        """
+        tick = self._get_tick(self._clock() if timestamp is None else timestamp)
+        self.polls += 1
+        latest = list(
+            itertools.chain.from_iterable(
+                await asyncio.gather(*[self._get_latest(type) for type in self._types])
+            )
+        )
+
+        gaps = []
+        for meter, type, value in latest:
+            last = self.get_series(meter=meter, type=type).last_timestamp
+            if last is not None and tick - last > self._interval:
+                gaps.append((meter, type, last))
+        await asyncio.gather(
+            *[
+                self._fill(meter=meter, type=type, after=last, before=tick)
+                for meter, type, last in gaps
+            ]
+        )
+
+        for meter, type, value in latest:
+            self._store(self.get_series(meter=meter, type=type), tick, value)
+
+    async def _get_latest(self, type: str) -> List[Tuple[str, str, float]]:
+        try:
+            response = await self._client.request(
+                url=self.URL_LATEST.format(meters=self._meters, type=type)
+            )
+            if "result" not in response or "values" not in response["result"]:
+                raise DSCommandFailedException("no values in server response")
+        except DSException as e:
+            self.failures += 1
+            DSLog.logger.warning(f"DS metering poll of {type} failed: {e!r}")
+            return []
+        # older servers call the meter dsid
+        return [
+            (item.get("dSUID") or item.get("dsid"), type, float(item["value"]))
+            for item in response["result"]["values"]
+        ]
+
+    async def backfill(self, count: int = None):
+        """
+        fetch the stored history of every known meter and type concurrently,
+        useful after start to not begin with empty series
+
+        :param count: number of values per meter, the capacity by default
+        """
+        count = min(count or self._capacity, self._capacity)
+        await asyncio.gather(
+            *[
+                self._fill(meter=meter, type=type, count=count)
+                for meter, type in list(self._series)
+            ]
+        )
+
+    async def _fill(
+        self,
+        meter: str,
+        type: str,
+        after: float = None,
+        before: float = None,
+        count: int = None,
+    ):
+        if count is None:
+            count = min(int((before - after) // self._interval), self._capacity)
+        try:
+            response = await self._client.request(
+                url=self.URL_VALUES.format(
+                    meter=meter,
+                    type=type,
+                    resolution=int(max(1, self._interval)),
+                    count=count,
+                )
+            )
+            if "result" not in response or "values" not in response["result"]:
+                raise DSCommandFailedException("no values in server response")
+        except DSException as e:
+            self.failures += 1
+            DSLog.logger.warning(f"DS metering history of {meter} failed: {e!r}")
+            return
+
+        series = self.get_series(meter=meter, type=type)
+        samples = sorted(response["result"]["values"])
+        if series.last_timestamp is None or after is not None:
+            for timestamp, value in samples:
+                tick = self._get_tick(timestamp)
+                if before is not None and tick >= before:
+                    break
+                if self._store(series, tick, float(value)):
+                    self.backfilled += 1
+            return
+
+        # older history in front of polled samples, rebuild the buffer
+        known = list(zip(*series.get_samples()))
+        series.clear()
+        for timestamp, value in samples:
+            tick = self._get_tick(timestamp)
+            if tick < known[0][0] and self._store(series, tick, float(value)):
+                self.backfilled += 1
+        series.extend(known)
+
+    def get_total(
+        self, type: str = TYPE_CONSUMPTION, start: float = None, end: float = None
+    ) -> Tuple:
+        """
+        sum the series of all meters per timestamp, e.g. for the consumption
+        of the apartment
+
+        :param type: metering type
+        :param start: first timestamp to include
+        :param end: timestamp to stop before
+        :return: timestamps and summed values, numpy arrays if numpy is
+            installed, array.array otherwise
+        """
+        windows = [
+            series.window(start=start, end=end)
+            for (meter, series_type), series in self._series.items()
+            if series_type == type
+        ]
+        if numpy is not None:
+            if not windows:
+                return numpy.empty(0), numpy.empty(0)
+            timestamps = numpy.concatenate([t for t, _ in windows])
+            values = numpy.concatenate([v for _, v in windows]).astype(numpy.float64)
+            ticks, inverse = numpy.unique(timestamps, return_inverse=True)
+            return ticks, numpy.bincount(inverse, weights=values)
+
+        totals = dict()
+        for timestamps, values in windows:
+            for timestamp, value in zip(timestamps, values):
+                totals[timestamp] = totals.get(timestamp, 0.0) + value
+        ticks = sorted(totals)
+        return array.array("d", ticks), array.array("d", [totals[t] for t in ticks])
+
+    def downsample(
+        self,
+        meter: str = None,
+        type: str = TYPE_CONSUMPTION,
+        interval: float = 60,
+        how: str = "mean",
+        start: float = None,
+        end: float = None,
+    ) -> Tuple:
+        """
+        :param meter: dSUID of the meter, None for the total of all meters
+        :param type: metering type
+        :param interval: seconds per bucket
+        :param how: one of AGGREGATIONS
+        :param start: first timestamp to include
+        :param end: timestamp to stop before
+        :return: timestamps of the buckets and aggregated values
+        """
+        if meter is None:
+            timestamps, values = self.get_total(type=type, start=start, end=end)
+        else:
+            series = self.get_series(meter=meter, type=type)
+            timestamps, values = series.window(start=start, end=end)
+        return downsample(timestamps, values, interval=interval, how=how)
+
+    def get_stats(self) -> Dict:
+        """
+        :return: number of series, samples and bytes used by the buffers
+        """
+        samples = sum(len(series) for series in self._series.values())
+        size = sum(
+            (series.timestamps.itemsize + series.values.itemsize) * series.capacity
+            for series in self._series.values()
+        )
+        return dict(series=len(self._series), samples=samples, bytes=size)
+
+    async def _run(self):
+        while True:
+            # sleep until the next multiple of the interval
+            now = self._clock()
+            await asyncio.sleep(self._interval - now % self._interval)
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except DSException as e:
+                DSLog.logger.warning(f"DS metering poll failed: {e!r}")
+
+    async def start(self, backfill: bool = True):
+        """
+        poll once, fetch the history of the meters found and keep polling
+        until stop() is called
+
+        :param backfill: fetch the stored history of the meters first
+        """
+        if self._task is not None:
+            return
+        await self.poll()
+        if backfill:
+            await self.backfill()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
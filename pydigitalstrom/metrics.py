@@ -0,0 +1,302 @@
+import bisect
+import contextlib
+from typing import Dict, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+
+def get_url_template(url: str) -> str:
+    """
+    get the endpoint of a request without the query, ids and scene numbers
+    would make every zone and scene a metric of its own
+
+    :param url: URL path of the request
+    :return: URL path without query
+    """
+    return urlsplit(url).path
+
+
+class DSMetrics:
+    """
+    instrumentation interface, the base class discards everything, subclass
+    it or use one of the exporters below to collect the measurements
+    """
+
+    # seconds between sending a request and parsing the response, labeled
+    # with endpoint and error class
+    REQUEST_DURATION = "request_duration"
+    # failed requests, labeled with endpoint and error class
+    REQUEST_ERRORS = "request_errors"
+    # repeated requests, labeled with endpoint and reason, unauthorized if the
+    # server dropped the session or the class of the connection error
+    REQUEST_RETRIES = "request_retries"
+    # session tokens fetched
+    TOKEN_REFRESHES = "token_refreshes"
+    # seconds a command waited in the command stack and was in flight,
+    # labeled with lane and endpoint
+    COMMAND_WAIT = "command_wait"
+    COMMAND_SERVICE = "command_service"
+    # pending commands per lane
+    QUEUE_DEPTH = "queue_depth"
+    # events received from the server and frames skipped undecoded, by name
+    EVENTS = "events"
+    EVENTS_SKIPPED = "events_skipped"
+    # property tree queries answered from the cache or the server, labeled
+    # with result hit or miss
+    PROPERTY_READS = "property_reads"
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        record a duration or size in a histogram
+
+        :param name: name of the histogram
+        :param value: the measurement
+        :param labels: labels of the measurement
+        """
+
+    def increment(self, name: str, value: float = 1, **labels):
+        """
+        increase a counter
+
+        :param name: name of the counter
+        :param value: amount to add
+        :param labels: labels of the counter
+        """
+
+    def set(self, name: str, value: float, **labels):
+        """
+        set a gauge to the current value
+
+        :param name: name of the gauge
+        :param value: the current value
+        :param labels: labels of the gauge
+        """
+
+    def span(self, name: str, **labels):
+        """
+        trace an operation, used as context manager
+
+        :param name: name of the operation
+        :param labels: attributes of the span
+        """
+        return contextlib.nullcontext()
+
+
+class DSHistogram:
+    # 1 ms to about 66 seconds
+    DEFAULT_BUCKETS = tuple(0.001 * 2**i for i in range(17))
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        """
+        :param buckets: upper bounds of the buckets, ascending
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        estimate a quantile by interpolating within its bucket
+
+        :param q: quantile between 0 and 1
+        :return: the estimated value, None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else self.min
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def as_dict(self) -> Dict:
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            min=self.min,
+            max=self.max,
+            p50=self.quantile(0.5),
+            p99=self.quantile(0.99),
+        )
+
+
+class DSMemoryMetrics(DSMetrics):
+    """
+    keeps histograms, counters and gauges in memory, e.g. to log them
+    periodically
+    """
+
+    def __init__(self, buckets: Sequence[float] = DSHistogram.DEFAULT_BUCKETS):
+        """
+        :param buckets: upper bounds of the histogram buckets
+        """
+        self._buckets = buckets
+        self.histograms = dict()
+        self.counters = dict()
+        self.gauges = dict()
+
+    @staticmethod
+    def _get_key(labels: dict) -> Tuple:
+        return tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        histograms = self.histograms.setdefault(name, dict())
+        key = self._get_key(labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = DSHistogram(buckets=self._buckets)
+        histogram.observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        counters = self.counters.setdefault(name, dict())
+        key = self._get_key(labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self.gauges.setdefault(name, dict())[self._get_key(labels)] = value
+
+    def get_histogram(self, name: str, **labels) -> Optional[DSHistogram]:
+        return self.histograms.get(name, dict()).get(self._get_key(labels))
+
+    def get_counter(self, name: str, **labels) -> float:
+        """
+        :return: the counter with exactly these labels, or the sum over all
+            labels if none are given
+        """
+        counters = self.counters.get(name, dict())
+        if not labels:
+            return sum(counters.values())
+        return counters.get(self._get_key(labels), 0)
+
+    def get_gauge(self, name: str, **labels) -> Optional[float]:
+        return self.gauges.get(name, dict()).get(self._get_key(labels))
+
+    def snapshot(self) -> Dict:
+        """
+        :return: all metrics as plain dicts, labels joined to strings
+        """
+
+        def format_key(key):
+            return ",".join(f"{label}={value}" for label, value in key)
+
+        return dict(
+            histograms={
+                name: {format_key(k): h.as_dict() for k, h in values.items()}
+                for name, values in self.histograms.items()
+            },
+            counters={
+                name: {format_key(k): v for k, v in values.items()}
+                for name, values in self.counters.items()
+            },
+            gauges={
+                name: {format_key(k): v for k, v in values.items()}
+                for name, values in self.gauges.items()
+            },
+        )
+
+
+class DSPrometheusMetrics(DSMetrics):
+    """
+    exports the metrics with prometheus_client, requires the optional
+    prometheus_client package
+    """
+
+    def __init__(self, registry=None, namespace: str = "pydigitalstrom"):
+        """
+        :param registry: prometheus registry, the global one by default
+        :param namespace: prefix of the metric names
+        """
+        import prometheus_client
+
+        self._prometheus = prometheus_client
+        self._registry = registry or prometheus_client.REGISTRY
+        self._namespace = namespace
+        self._metrics = dict()
+
+    def _get_metric(self, kind, name: str, labels: dict):
+        # labels have to be declared up front, the first call defines them
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = kind(
+                name,
+                name.replace("_", " "),
+                labelnames=sorted(labels),
+                namespace=self._namespace,
+                registry=self._registry,
+            )
+        return metric.labels(**labels) if labels else metric
+
+    def observe(self, name: str, value: float, **labels):
+        self._get_metric(self._prometheus.Histogram, name, labels).observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        self._get_metric(self._prometheus.Counter, name, labels).inc(value)
+
+    def set(self, name: str, value: float, **labels):
+        self._get_metric(self._prometheus.Gauge, name, labels).set(value)
+
+
+class DSOpenTelemetryMetrics(DSMetrics):
+    """
+    exports the metrics and spans with opentelemetry, requires the optional
+    opentelemetry-api package
+    """
+
+    def __init__(self, meter=None, tracer=None, prefix: str = "pydigitalstrom."):
+        """
+        :param meter: opentelemetry meter, the global one by default
+        :param tracer: opentelemetry tracer, the global one by default
+        :param prefix: prefix of the metric names
+        """
+        from opentelemetry import metrics, trace
+
+        self._meter = meter or metrics.get_meter("pydigitalstrom")
+        self._tracer = tracer or trace.get_tracer("pydigitalstrom")
+        self._prefix = prefix
+        self._instruments = dict()
+        self._gauges = dict()
+
+    def _get_instrument(self, create, name: str):
+        instrument = self._instruments.get(name)
+        if instrument is None:
+            instrument = self._instruments[name] = create(self._prefix + name)
+        return instrument
+
+    def observe(self, name: str, value: float, **labels):
+        histogram = self._get_instrument(self._meter.create_histogram, name)
+        histogram.record(value, attributes=labels)
+
+    def increment(self, name: str, value: float = 1, **labels):
+        counter = self._get_instrument(self._meter.create_counter, name)
+        counter.add(value, attributes=labels)
+
+    def set(self, name: str, value: float, **labels):
+        # up down counters are the gauges of the synchronous api
+        counter = self._get_instrument(self._meter.create_up_down_counter, name)
+        key = (name, tuple(sorted(labels.items())))
+        counter.add(value - self._gauges.get(key, 0), attributes=labels)
+        self._gauges[key] = value
+
+    def span(self, name: str, **labels):
+        return self._tracer.start_as_current_span(name, attributes=labels)
@@ -0,0 +1,212 @@
+import socket
+import time
+from typing import Dict, Optional
+
+import aiohttp
+import asyncio
+
+from pydigitalstrom.client import DSClient
+from pydigitalstrom.log import DSLog
+
+
+class DSClientPool:
+    """
+    manages the clients of many digitalSTROM servers in one event loop, all
+    clients share a single connector with per host connection limits
+    """
+
+    STATE_NEW = "new"
+    STATE_INITIALIZING = "initializing"
+    STATE_READY = "ready"
+    STATE_FAILED = "failed"
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 4,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        init_concurrency: int = 10,
+        loop: asyncio.AbstractEventLoop = None,
+    ):
+        """
+        :param limit: maximum number of connections of all clients
+        :param limit_per_host: maximum number of connections to one server
+        :param keepalive_timeout: seconds to keep idle connections open
+        :param dns_cache_ttl: seconds to cache dns lookups
+        :param init_concurrency: number of clients initialized at once
+        :param loop: asyncio loop to run the clients in
+        """
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+        self._init_concurrency = init_concurrency
+        self.loop = loop
+
+        self._session = None
+        self._clients = dict()
+        self._states = dict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def __contains__(self, name: str):
+        return name in self._clients
+
+    def get(self, name: str) -> DSClient:
+        return self._clients[name]
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        :return: the session shared by all clients
+        """
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    family=socket.AF_INET,
+                    ssl=False,
+                    limit=self._limit,
+                    limit_per_host=self._limit_per_host,
+                    keepalive_timeout=self._keepalive_timeout,
+                    use_dns_cache=self._dns_cache_ttl > 0,
+                    ttl_dns_cache=self._dns_cache_ttl or None,
+                    loop=self.loop,
+                ),
+                loop=self.loop,
+            )
+        return self._session
+
+    async def add(
+        self,
+        name: str,
+        host: str,
+        port: int,
+        apptoken: str,
+        apartment_name: str,
+        **kwargs,
+    ) -> DSClient:
+        """
+        add a client for a digitalSTROM server
+
+        :param name: unique name of the client in the pool
+        :param kwargs: kwargs to be forwarded to DSClient
+        :return: the new client
+        """
+        if name in self._clients:
+            raise ValueError(f"client {name} already exists")
+
+        client = DSClient(
+            host=host,
+            port=port,
+            apptoken=apptoken,
+            apartment_name=apartment_name,
+            loop=self.loop,
+            session=await self.get_session(),
+            **kwargs,
+        )
+        self._clients[name] = client
+        self._states[name] = dict(state=self.STATE_NEW, error=None, updated=None)
+        return client
+
+    async def remove(self, name: str):
+        """
+        remove a client and stop its command stack
+        """
+        client = self._clients.pop(name)
+        del self._states[name]
+        await client.close()
+
+    def _set_state(self, name: str, state: str, error: Exception = None):
+        self._states[name] = dict(state=state, error=error, updated=time.time())
+
+    async def _initialize_client(self, name: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            client = self._clients[name]
+            self._set_state(name=name, state=self.STATE_INITIALIZING)
+            try:
+                await client.initialize()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                DSLog.logger.warning(f"DS client {name} failed to initialize: {e!r}")
+                self._set_state(name=name, state=self.STATE_FAILED, error=e)
+            else:
+                self._set_state(name=name, state=self.STATE_READY)
+
+    async def initialize(self, names: list = None):
+        """
+        initialize the clients concurrently, at most init_concurrency at once,
+        failures are recorded in the health state instead of being raised
+
+        :param names: clients to initialize, all by default
+        """
+        semaphore = asyncio.Semaphore(self._init_concurrency)
+        await asyncio.gather(
+            *[
+                self._initialize_client(name=name, semaphore=semaphore)
+                for name in (self._clients if names is None else names)
+            ]
+        )
+
+    async def start(self):
+        """
+        start the command stacks of all clients
+        """
+        for client in self._clients.values():
+            await client.stack.start()
+
+    async def stop(self):
+        """
+        stop the command stacks of all clients
+        """
+        for client in self._clients.values():
+            await client.stack.stop()
+
+    def health(self, name: Optional[str] = None) -> Dict:
+        """
+        get the health state of one client or of the whole pool
+
+        :param name: client to get the state of, the whole pool by default
+        :return: dict with state, last error, command stack counters and
+            circuit breaker state
+        """
+        if name is not None:
+            client = self._clients[name]
+            return dict(
+                self._states[name],
+                queued=len(client.stack),
+                executed=client.stack.executed,
+                failed=client.stack.failed,
+                circuit=client.circuit_breaker.state,
+            )
+
+        clients = {name: self.health(name=name) for name in self._clients}
+        states = dict()
+        for client in clients.values():
+            states[client["state"]] = states.get(client["state"], 0) + 1
+        return dict(
+            clients=clients,
+            states=states,
+            queued=sum(client["queued"] for client in clients.values()),
+            healthy=states.get(self.STATE_FAILED, 0) == 0,
+        )
+
+    async def close(self):
+        """
+        close all clients and the shared session
+        """
+        for name in list(self._clients):
+            await self.remove(name=name)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,348 @@
+import asyncio
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydigitalstrom.dispatcher import get_event_route
+from pydigitalstrom.exceptions import DSCommandFailedException
+from pydigitalstrom.metrics import DSMetrics
+
+_SEGMENT = re.compile(r"^([^(]+)(?:\(([^)]*)\))?$")
+
+
+def parse_query(path: str) -> Tuple:
+    """
+    split a query2 expression into its segments
+
+    :param path: query2 expression like /apartment/zones/*(ZoneID,name)
+    :return: tuple of (name, fields) per segment, fields is a tuple of the
+        selected properties or None for segments that just descend
+    """
+    segments = []
+    for segment in path.strip().split("/"):
+        if not segment:
+            continue
+        match = _SEGMENT.match(segment.strip())
+        if match is None:
+            raise ValueError(f"invalid query2 segment {segment!r}")
+        name, fields = match.groups()
+        if fields is not None:
+            fields = tuple(
+                dict.fromkeys(f.strip() for f in fields.split(",") if f.strip())
+            )
+        segments.append((name.strip(), fields))
+    return tuple(segments)
+
+
+def format_query(segments: Iterable) -> str:
+    """
+    :param segments: segments as returned by parse_query
+    :return: the query2 expression
+    """
+    return "".join(
+        f"/{name}" if fields is None else f"/{name}({','.join(fields)})"
+        for name, fields in segments
+    )
+
+
+def _can_merge(a: Tuple, b: Tuple) -> bool:
+    # the shorter query has to follow the same nodes and add result levels
+    # at the same segments, wildcards and single nodes are not mixed
+    for (name_a, fields_a), (name_b, fields_b) in zip(a, b):
+        if name_a != name_b or (fields_a is None) != (fields_b is None):
+            return False
+    return True
+
+
+def _merge(a: Tuple, b: Tuple) -> Tuple:
+    merged = []
+    for i in range(max(len(a), len(b))):
+        if i >= len(a) or i >= len(b):
+            merged.append(a[i] if i < len(a) else b[i])
+            continue
+        name, fields = a[i]
+        if fields is not None:
+            fields = tuple(dict.fromkeys(fields + b[i][1]))
+        merged.append((name, fields))
+    return tuple(merged)
+
+
+def merge_queries(queries: Iterable[Tuple]) -> List[Tuple[Tuple, List[Tuple]]]:
+    """
+    combine queries into as few query2 expressions as possible
+
+    :param queries: segments as returned by parse_query
+    :return: list of (merged segments, queries answered by it)
+    """
+    groups = []
+    for query in queries:
+        for group in groups:
+            if _can_merge(group[0], query):
+                group[0] = _merge(group[0], query)
+                group[1].append(query)
+                break
+        else:
+            groups.append([query, [query]])
+    return [(merged, members) for merged, members in groups]
+
+
+def extract_result(result: dict, segments: Tuple) -> dict:
+    """
+    cut the result of a merged query down to what one of its queries would
+    have returned, property values are scalars and result levels are dicts
+
+    :param result: query2 result of the merged query
+    :param segments: segments of the query to extract
+    :return: the query2 result of the query
+    """
+    if not segments:
+        return dict()
+    fields = segments[0][1]
+    if fields is None:
+        return extract_result(result=result, segments=segments[1:])
+
+    extracted = dict()
+    everything = "*" in fields
+    for key, entry in result.items():
+        if not isinstance(entry, dict):
+            continue
+        item = {
+            name: value
+            for name, value in entry.items()
+            if not isinstance(value, dict) and (everything or name in fields)
+        }
+        item.update(extract_result(result=entry, segments=segments[1:]))
+        extracted[key] = item
+    return extracted
+
+
+class DSPropertyReader:
+    """
+    reads the property tree of the server, queries requested at the same time
+    are combined into one query2 request and results are cached per query
+    until they expire or a related event arrives
+
+        zones, scenes = await asyncio.gather(
+            client.properties.get("/apartment/zones/*(ZoneID,name)"),
+            client.properties.get(
+                "/apartment/zones/*(ZoneID)/groups/*(group,lastCalledScene)"
+            ),
+        )
+    """
+
+    URL_QUERY = "/json/property/query2?query={query}"
+
+    # events and the parts of the tree they change, None for everything
+    INVALIDATIONS = {
+        "callScene": ("/apartment/zones",),
+        "undoScene": ("/apartment/zones",),
+        "zoneSensorValue": ("/apartment/zones",),
+        "deviceSensorValue": ("/apartment/zones", "/apartment/dSMeters"),
+        "stateChange": ("/usr/states", "/usr/addon-states"),
+        "ModelReady": None,
+        "DeviceEvent": None,
+    }
+
+    def __init__(
+        self,
+        client,
+        ttl: float = 5,
+        ttls: Dict[str, float] = None,
+        window: float = 0,
+        invalidations: Dict[str, Optional[Tuple[str, ...]]] = None,
+        clock=time.monotonic,
+    ):
+        """
+        :param client: the client to query with
+        :param ttl: seconds a result is reused by default
+        :param ttls: seconds a result is reused by path prefix, e.g. longer
+            for names than for sensor values, the longest prefix wins
+        :param window: seconds to wait for more queries to combine, 0 only
+            combines the queries of the same loop iteration
+        :param invalidations: path prefixes dropped from the cache per event
+            name, merged with INVALIDATIONS
+        :param clock: time source
+        """
+        self._client = client
+        self._ttl = ttl
+        self._ttls = sorted(
+            ((parse_query(path), value) for path, value in (ttls or dict()).items()),
+            key=lambda item: len(item[0]),
+            reverse=True,
+        )
+        self._window = window
+        self._invalidations = dict(self.INVALIDATIONS, **(invalidations or dict()))
+        self._clock = clock
+
+        # segments -> (result, time fetched)
+        self._cache = dict()
+        self._inflight = dict()
+        self._pending = []
+        self._flush_task = None
+        # results fetched across an invalidation are handed out, not cached
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+        self.invalidated = 0
+
+    def get_ttl(self, segments: Tuple) -> float:
+        """
+        :param segments: segments as returned by parse_query
+        :return: seconds a result of the query is reused
+        """
+        for prefix, ttl in self._ttls:
+            if _is_prefix(prefix=prefix, segments=segments):
+                return ttl
+        return self._ttl
+
+    async def get(self, path: str, ttl: float = None) -> dict:
+        """
+        query the property tree, the result is shared and must not be changed
+
+        :param path: query2 expression like /apartment/zones/*(ZoneID,name)
+        :param ttl: seconds a cached result may be old, 0 to always fetch it
+        :return: the query2 result
+        :raises: DSRequestException
+        :raises: DSCommandFailedException
+        """
+        segments = parse_query(path)
+        if ttl is None:
+            ttl = self.get_ttl(segments=segments)
+
+        cached = self._cache.get(segments)
+        if cached is not None and self._clock() - cached[1] < ttl:
+            self.hits += 1
+            self._client.metrics.increment(DSMetrics.PROPERTY_READS, result="hit")
+            return cached[0]
+
+        self.misses += 1
+        self._client.metrics.increment(DSMetrics.PROPERTY_READS, result="miss")
+        future = self._inflight.get(segments)
+        if future is None:
+            future = self._inflight[segments] = asyncio.get_event_loop().create_future()
+            self._pending.append(segments)
+            if self._flush_task is None:
+                self._flush_task = asyncio.ensure_future(self._flush())
+        # a cancelled caller must not cancel the query of the others
+        return await asyncio.shield(future)
+
+    async def get_many(self, paths: Iterable[str], ttl: float = None) -> List[dict]:
+        """
+        query several paths of the property tree with as few requests as
+        possible
+
+        :param paths: query2 expressions
+        :param ttl: seconds a cached result may be old, 0 to always fetch it
+        :return: the query2 results, in order
+        """
+        return list(await asyncio.gather(*[self.get(path, ttl=ttl) for path in paths]))
+
+    async def _flush(self):
+        await asyncio.sleep(self._window)
+        self._flush_task = None
+        pending, self._pending = self._pending, []
+        await asyncio.gather(
+            *[
+                self._query(merged=merged, members=members)
+                for merged, members in merge_queries(pending)
+            ]
+        )
+
+    async def _query(self, merged: Tuple, members: List[Tuple]):
+        generation = self._generation
+        self.queries += 1
+        try:
+            response = await self._client.request(
+                url=self.URL_QUERY.format(query=format_query(merged))
+            )
+            if "result" not in response:
+                raise DSCommandFailedException("no result in server response")
+        except asyncio.CancelledError:
+            self._fail(members=members)
+            raise
+        except Exception as e:
+            self._fail(members=members, exception=e)
+            return
+
+        fetched = self._clock()
+        for segments in members:
+            result = extract_result(result=response["result"], segments=segments)
+            if generation == self._generation:
+                self._cache[segments] = (result, fetched)
+            future = self._inflight.pop(segments)
+            if not future.done():
+                future.set_result(result)
+
+    def _fail(self, members: List[Tuple], exception: Exception = None):
+        for segments in members:
+            future = self._inflight.pop(segments, None)
+            if future is None or future.done():
+                continue
+            if exception is None:
+                future.cancel()
+            else:
+                future.set_exception(exception)
+
+    def invalidate(self, path: str = None, zone_id: int = None):
+        """
+        drop cached results
+
+        :param path: prefix of the queries to drop, all of them by default
+        :param zone_id: keep queries of other single zones
+        """
+        prefix = parse_query(path) if path is not None else ()
+        self._generation += 1
+        for segments in list(self._cache):
+            if not _is_prefix(prefix=prefix, segments=segments):
+                continue
+            if zone_id is not None and not _may_contain_zone(segments, zone_id):
+                continue
+            del self._cache[segments]
+            self.invalidated += 1
+
+    def attach(self, listener):
+        """
+        drop cached results when a websocket or long-poll listener receives
+        events that change them
+        """
+        for event_name in self._invalidations:
+            listener.register(callback=self._on_event, event_name=event_name)
+
+    async def _on_event(self, event: dict):
+        name, zone_id, _, _ = get_event_route(event)
+        if name not in self._invalidations:
+            return
+        prefixes = self._invalidations[name]
+        if prefixes is None:
+            self.invalidate()
+            return
+        # zone 0 is the whole apartment
+        for prefix in prefixes:
+            self.invalidate(path=prefix, zone_id=zone_id or None)
+
+    async def stop(self):
+        """
+        cancel queries that were not sent yet
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._fail(members=self._pending)
+        self._pending = []
+
+
+def _is_prefix(prefix: Tuple, segments: Tuple) -> bool:
+    # compare node names only, the selected fields don't matter
+    if len(prefix) > len(segments):
+        return False
+    return all(a[0] == b[0] for a, b in zip(prefix, segments))
+
+
+def _may_contain_zone(segments: Tuple, zone_id: int) -> bool:
+    # queries of a single other zone are not affected by events of this one
+    names = [name for name, _ in segments]
+    if len(names) < 3 or names[:2] != ["apartment", "zones"]:
+        return True
+    return names[2] in ("*", f"zone{zone_id}")
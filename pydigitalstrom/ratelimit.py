@@ -0,0 +1,64 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class DSTokenBucket:
+    """
+    token bucket rate limiter, allows bursts of up to capacity requests and
+    refills rate tokens per second
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float],
+        capacity: float = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param rate: tokens per second, None disables the limit
+        :param capacity: maximum number of tokens in the bucket
+        :param clock: monotonic clock to measure refills
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._lock = None
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """
+        take a token if one is available without waiting
+
+        :return: True if a token was taken
+        """
+        if not self.rate:
+            return True
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """
+        wait until a token is available and take it, waiters are served in order
+        """
+        if not self.rate:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
@@ -0,0 +1,144 @@
+import collections
+from collections.abc import Mapping
+
+
+class DSSceneRegistry(Mapping):
+    """
+    read-only dict of scene id to scene object, scenes are stored as compact
+    rows and the scene objects are created on first access
+
+    secondary indexes allow fast lookups by zone, color, scene id and name
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+        # unique_id -> (zone_id, zone_name, color, scene_id, scene_name)
+        self._rows = dict()
+        self._objects = dict()
+
+        self._indexes = dict(
+            zone_id=collections.defaultdict(set),
+            color=collections.defaultdict(set),
+            scene_id=collections.defaultdict(set),
+            name=collections.defaultdict(set),
+        )
+
+    def __getitem__(self, unique_id: str):
+        scene = self._objects.get(unique_id)
+        if scene is None:
+            scene = self._materialize(unique_id, self._rows[unique_id])
+            self._objects[unique_id] = scene
+        return scene
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, unique_id):
+        return unique_id in self._rows
+
+    def _materialize(self, unique_id: str, row: tuple):
+        from pydigitalstrom.devices.scene import DSScene, DSColorScene
+
+        zone_id, zone_name, color, scene_id, scene_name = row
+        if color is None:
+            return DSScene(
+                client=self._client,
+                zone_id=zone_id,
+                zone_name=zone_name,
+                scene_id=scene_id,
+                scene_name=scene_name,
+            )
+        return DSColorScene(
+            client=self._client,
+            zone_id=zone_id,
+            zone_name=zone_name,
+            scene_id=scene_id,
+            scene_name=scene_name,
+            color=color,
+        )
+
+    def _index_keys(self, row: tuple) -> tuple:
+        zone_id, zone_name, color, scene_id, scene_name = row
+        return (
+            ("zone_id", zone_id),
+            ("color", color),
+            ("scene_id", scene_id),
+            ("name", scene_name),
+        )
+
+    def add(self, unique_id: str, zone_id, zone_name, color, scene_id, scene_name):
+        """
+        add or update a scene
+
+        :return: "added", "changed" or None if the scene is unchanged
+        """
+        row = (zone_id, zone_name, color, scene_id, scene_name)
+        previous = self._rows.get(unique_id)
+        if previous == row:
+            return None
+        if previous is not None:
+            self.remove(unique_id)
+
+        self._rows[unique_id] = row
+        for index, key in self._index_keys(row):
+            self._indexes[index][key].add(unique_id)
+        return "added" if previous is None else "changed"
+
+    def remove(self, unique_id: str):
+        row = self._rows.pop(unique_id)
+        self._objects.pop(unique_id, None)
+        for index, key in self._index_keys(row):
+            ids = self._indexes[index][key]
+            ids.discard(unique_id)
+            if not ids:
+                del self._indexes[index][key]
+
+    def get_row(self, unique_id: str) -> tuple:
+        """
+        :return: (zone_id, zone_name, color, scene_id, scene_name)
+        """
+        return self._rows[unique_id]
+
+    def find(self, zone_id=None, color=None, scene_id=None, name=None) -> list:
+        """
+        get all scenes matching the given filters, color None matches all
+        scenes, use find_generic() for scenes without color
+
+        :return: list of scene objects
+        """
+        filters = dict(zone_id=zone_id, color=color, scene_id=scene_id, name=name)
+        sets = [
+            self._indexes[index].get(key, set())
+            for index, key in filters.items()
+            if key is not None
+        ]
+        if not sets:
+            return list(self.values())
+        ids = set.intersection(*sorted(sets, key=len))
+        return [self[unique_id] for unique_id in ids]
+
+    def find_generic(self, zone_id=None, scene_id=None) -> list:
+        """
+        get generic zone scenes, the ones without a color
+        """
+        ids = self._indexes["color"].get(None, set())
+        for index, key in (("zone_id", zone_id), ("scene_id", scene_id)):
+            if key is not None:
+                ids = ids & self._indexes[index].get(key, set())
+        return [self[unique_id] for unique_id in ids]
+
+    def by_zone(self, zone_id) -> list:
+        return self.find(zone_id=zone_id)
+
+    def by_color(self, color) -> list:
+        return self.find(color=color)
+
+    def by_scene_id(self, scene_id) -> list:
+        return self.find(scene_id=scene_id)
+
+    def by_name(self, name: str) -> list:
+        return self.find(name=name)
@@ -1,47 +1,355 @@
-import json
-
 import aiohttp
 import asyncio
+import contextlib
 import socket
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
 
-from pydigitalstrom.exceptions import DSCommandFailedException, DSRequestException
+from pydigitalstrom.exceptions import (
+    DSCircuitOpenException,
+    DSCommandFailedException,
+    DSException,
+    DSRequestException,
+    DSUnauthorizedException,
+)
+from pydigitalstrom.jsoncodec import DSJsonCodec
+from pydigitalstrom.metrics import DSMetrics, get_url_template
+from pydigitalstrom.retry import DSCircuitBreaker, DSRetryPolicy
 
 
 class DSRequestHandler:
-    def __init__(self, host: str, port: str, loop: asyncio.AbstractEventLoop = None):
+    # server messages that indicate a missing or expired session token
+    UNAUTHORIZED_MESSAGES = ("not logged in", "authentication failed")
+
+    # scene calls return right away, the structure of big apartments takes a
+    # while and event polls are held open by the server until events arrive
+    TIMEOUT_COMMAND = "command"
+    TIMEOUT_QUERY = "query"
+    TIMEOUT_EVENT = "event"
+    TIMEOUT_DEFAULT = "default"
+    TIMEOUTS = {
+        TIMEOUT_COMMAND: aiohttp.ClientTimeout(total=10, sock_connect=5),
+        TIMEOUT_QUERY: aiohttp.ClientTimeout(total=60, sock_connect=5, sock_read=30),
+        TIMEOUT_EVENT: aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=300),
+        TIMEOUT_DEFAULT: aiohttp.ClientTimeout(total=30, sock_connect=5),
+    }
+
+    def __init__(
+        self,
+        host: str,
+        port: str,
+        loop: asyncio.AbstractEventLoop = None,
+        pool_size: int = 10,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+        session: aiohttp.ClientSession = None,
+        codec: DSJsonCodec = None,
+        metrics: DSMetrics = None,
+        retry_policy: DSRetryPolicy = None,
+        circuit_breaker: DSCircuitBreaker = None,
+        timeouts: Dict[str, aiohttp.ClientTimeout] = None,
+        scheme: str = "https",
+    ):
         self.host = host
         self.port = port
         self.loop = loop
+        # plain http is only meant for local test servers
+        self.scheme = scheme
+
+        self._pool_size = pool_size
+        self._keepalive_timeout = keepalive_timeout
+        self._dns_cache_ttl = dns_cache_ttl
+
+        # a session passed in is shared with other handlers and not closed
+        self._session = session
+        self._owns_session = session is None
+
+        self.codec = codec or DSJsonCodec()
+        self.metrics = metrics or DSMetrics()
+        # one circuit per handler, i.e. per server
+        self.retry_policy = retry_policy or DSRetryPolicy()
+        self.circuit_breaker = circuit_breaker or DSCircuitBreaker()
+        self.timeouts = dict(self.TIMEOUTS, **(timeouts or dict()))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def get_timeout_kind(self, url: str) -> str:
+        """
+        :param url: URL path of the request
+        :return: key of the timeouts to use for the request
+        """
+        path = url.split("?", 1)[0]
+        if path.endswith(("/callScene", "/undoScene")):
+            return self.TIMEOUT_COMMAND
+        if path.startswith("/json/property/"):
+            return self.TIMEOUT_QUERY
+        if path == "/json/event/get":
+            return self.TIMEOUT_EVENT
+        return self.TIMEOUT_DEFAULT
+
+    def get_timeout(
+        self, url: str, deadline: Optional[float] = None
+    ) -> aiohttp.ClientTimeout:
+        """
+        :param url: URL path of the request
+        :param deadline: time.monotonic() the request has to be done by
+        :return: the timeouts of the request, shortened to the deadline
+        """
+        timeout = self.timeouts[self.get_timeout_kind(url)]
+        if deadline is None:
+            return timeout
+        # aiohttp treats a total of 0 as no timeout at all
+        remaining = max(0.001, deadline - time.monotonic())
+        return aiohttp.ClientTimeout(
+            total=remaining if timeout.total is None else min(timeout.total, remaining),
+            connect=timeout.connect,
+            sock_read=timeout.sock_read,
+            sock_connect=timeout.sock_connect,
+        )
 
-    async def raw_request(self, url: str, **kwargs) -> str:
+    async def raw_request(
+        self, url: str, deadline: Optional[float] = None, **kwargs
+    ) -> str:
         """
-        run a raw request against the digitalstrom server
+        run a raw request against the digitalstrom server, failures of the
+        server are retried according to the retry policy
 
         :param url: URL path to request
+        :param deadline: time.monotonic() the request has to be done by,
+            retries stop when it passes
         :param kwargs: kwargs to be forwarded to aiohttp.get
         :return: json response
         :raises: DSRequestException
         :raises: DSCommandFailedException
+        :raises: DSUnauthorizedException
+        :raises: DSCircuitOpenException
         """
-        url = f"https://{self.host}:{self.port}{url}"
-
-        # disable ssl verification for most servers miss valid certificates
-        async with await self.get_aiohttp_session() as session:
+        backoff = None
+        attempt = 1
+        while True:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DSRequestException("deadline exceeded")
+            request_kwargs = dict(kwargs)
+            request_kwargs.setdefault(
+                "timeout", self.get_timeout(url=url, deadline=deadline)
+            )
             try:
-                async with session.get(url=url, **kwargs) as response:
-                    # check for server errors
-                    if not response.status == 200:
-                        raise DSRequestException(response.text)
-
-                    try:
-                        data = await response.json()
-                    except json.decoder.JSONDecodeError:
-                        raise DSRequestException("failed to json decode response")
-                    if "ok" not in data or not data["ok"]:
-                        raise DSCommandFailedException()
-                    return data
-            except aiohttp.ClientError:
-                raise DSRequestException("request failed")
+                return await self._raw_request(url=url, **request_kwargs)
+            except DSCircuitOpenException:
+                raise
+            except DSRequestException as e:
+                if attempt >= self.retry_policy.attempts:
+                    raise
+                if not self.retry_policy.is_retryable(exception=e, url=url):
+                    raise
+                backoff = backoff or self.retry_policy.get_backoff()
+                delay = backoff.next_delay()
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                self.metrics.increment(
+                    DSMetrics.REQUEST_RETRIES,
+                    endpoint=get_url_template(url),
+                    reason=type(e.__cause__).__name__,
+                )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _raw_request(self, url: str, **kwargs) -> str:
+        endpoint = get_url_template(url)
+        url = f"{self.scheme}://{self.host}:{self.port}{url}"
+
+        session = await self.get_session()
+        with self._track_request(endpoint=endpoint):
+            async with session.get(url=url, **kwargs) as response:
+                self._check_status(response=response)
+
+                try:
+                    data = self.codec.loads(await response.read())
+                except self.codec.DecodeError:
+                    raise DSRequestException("failed to json decode response")
+                self._check_ok(
+                    ok="ok" in data and data["ok"], message=data.get("message", "")
+                )
+                return data
+
+    async def raw_request_items(
+        self, url: str, prefix: str = "result", **kwargs
+    ) -> AsyncIterator[Tuple[str, object]]:
+        """
+        run a raw request against the digitalstrom server and parse the
+        response while it is received, only one item of the object at prefix
+        is held in memory at a time, requires ijson
+
+        the request is not retried, items may have been handed out already
+
+        :param url: URL path to request
+        :param prefix: key of the object to yield the items of
+        :param kwargs: kwargs to be forwarded to aiohttp.get
+        :return: async iterator of (key, value) of the object at prefix
+        :raises: DSRequestException
+        :raises: DSCommandFailedException
+        :raises: DSUnauthorizedException
+        :raises: DSCircuitOpenException
+        """
+        if ijson is None:
+            raise DSException("streaming responses requires ijson")
+        kwargs.setdefault("timeout", self.get_timeout(url))
+        endpoint = get_url_template(url)
+        url = f"{self.scheme}://{self.host}:{self.port}{url}"
+
+        session = await self.get_session()
+        # the duration includes the time the caller spends on the items
+        with self._track_request(endpoint=endpoint):
+            async with session.get(url=url, **kwargs) as response:
+                self._check_status(response=response)
+
+                ok = False
+                message = ""
+                found = False
+                key = builder = None
+                depth = 0
+                try:
+                    async for path, event, value in ijson.parse_async(
+                        response.content, use_float=True
+                    ):
+                        if builder is not None:
+                            builder.event(event, value)
+                            if event in ("start_map", "start_array"):
+                                depth += 1
+                            elif event in ("end_map", "end_array"):
+                                depth -= 1
+                            if depth == 0:
+                                yield key, builder.value
+                                builder = None
+                        elif path == prefix:
+                            if event == "start_map":
+                                found = True
+                            elif event == "map_key":
+                                key = value
+                                builder = ijson.ObjectBuilder()
+                        elif path == "ok":
+                            ok = value
+                        elif path == "message" and event == "string":
+                            message = value
+                except ijson.JSONError:
+                    raise DSRequestException("failed to json decode response")
+                self._check_ok(ok=ok, message=message)
+                if not found:
+                    raise DSCommandFailedException(f"no {prefix} in server response")
+
+    @contextlib.contextmanager
+    def _track_request(self, endpoint: str):
+        # fail fast while the server is unhealthy, convert connection errors
+        # and record the outcome
+        if not self.circuit_breaker.allow():
+            raise DSCircuitOpenException(
+                f"too many failed requests, retry in "
+                f"{self.circuit_breaker.retry_after():.0f} seconds"
+            )
+
+        start = time.monotonic()
+        error = None
+        cancelled = False
+        try:
+            with self.metrics.span("request", endpoint=endpoint):
+                yield
+        except aiohttp.ClientError as e:
+            error = DSRequestException("request failed")
+            raise error from e
+        except asyncio.TimeoutError as e:
+            error = DSRequestException("request timed out")
+            raise error from e
+        except DSException as e:
+            error = e
+            raise
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._observe_request(endpoint=endpoint, start=start, error=error)
+            if cancelled:
+                self.circuit_breaker.release()
+            elif error is not None and self.retry_policy.is_server_failure(error):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+    def _observe_request(self, endpoint: str, start: float, error: Exception):
+        error_class = type(error).__name__ if error is not None else ""
+        self.metrics.observe(
+            DSMetrics.REQUEST_DURATION,
+            time.monotonic() - start,
+            endpoint=endpoint,
+            error=error_class,
+        )
+        if error is not None:
+            self.metrics.increment(
+                DSMetrics.REQUEST_ERRORS, endpoint=endpoint, error=error_class
+            )
+
+    @staticmethod
+    def _check_status(response: aiohttp.ClientResponse):
+        # check for server errors
+        if response.status in (401, 403):
+            raise DSUnauthorizedException(response.reason)
+        if not response.status == 200:
+            # keep the status as cause to tell server failures from others
+            raise DSRequestException(
+                f"{response.status} {response.reason}"
+            ) from aiohttp.ClientResponseError(
+                response.request_info,
+                response.history,
+                status=response.status,
+                message=response.reason,
+            )
+
+    def _check_ok(self, ok: bool, message: str):
+        if not ok:
+            message = str(message)
+            if any(m in message.lower() for m in self.UNAUTHORIZED_MESSAGES):
+                raise DSUnauthorizedException(message)
+            raise DSCommandFailedException(message)
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """
+        get the long-lived pooled session, it is created on first use and kept
+        until close() is called to reuse connections to the server
+
+        :return the pooled aiohttp client session
+        """
+        if not self._owns_session:
+            return self._session
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self.get_connector(), loop=self.loop
+            )
+        return self._session
+
+    def get_connector(self) -> aiohttp.TCPConnector:
+        """
+        turn off ssl verification since most digitalstrom servers use
+        self-signed certificates, keep connections alive and cache dns lookups
+
+        :return the initialized aiohttp connector
+        """
+        return aiohttp.TCPConnector(
+            family=socket.AF_INET,
+            ssl=False,
+            limit=self._pool_size,
+            keepalive_timeout=self._keepalive_timeout,
+            use_dns_cache=self._dns_cache_ttl > 0,
+            ttl_dns_cache=self._dns_cache_ttl or None,
+            loop=self.loop,
+        )
 
     async def get_aiohttp_session(self, cookies: dict = None) -> aiohttp.ClientSession:
         """
@@ -56,3 +364,11 @@ class DSRequestHandler:
             cookies=cookies,
             loop=self.loop,
         )
+
+    async def close(self):
+        """
+        close the pooled session and all of its connections
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
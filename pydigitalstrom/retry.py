@@ -0,0 +1,182 @@
+import asyncio
+import time
+from typing import Callable
+from urllib.parse import parse_qs, urlsplit
+
+import aiohttp
+
+from pydigitalstrom.backoff import DSBackoff
+from pydigitalstrom.constants import STEP_SCENES
+
+
+class DSRetryPolicy:
+    """
+    decides which failed requests are repeated, only failures of the server
+    or the connection are, and only for requests that can safely run twice
+    """
+
+    # event polls consume the events they return
+    NON_IDEMPOTENT_PATHS = ("/json/event/get",)
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base: float = 0.2,
+        maximum: float = 5,
+        factor: float = 2,
+        jitter: float = 0.5,
+        retry_non_idempotent: bool = False,
+    ):
+        """
+        :param attempts: maximum number of attempts per request, 1 to not retry
+        :param base: delay before the first retry in seconds
+        :param maximum: upper bound of the delay in seconds
+        :param factor: growth of the delay per attempt
+        :param jitter: share of the delay that is randomized, 0 to 1
+        :param retry_non_idempotent: also retry requests that may have been
+            executed by the server already, e.g. dimming steps
+        """
+        self.attempts = max(1, attempts)
+        self._base = base
+        self._maximum = maximum
+        self._factor = factor
+        self._jitter = jitter
+        self._retry_non_idempotent = retry_non_idempotent
+
+    def get_backoff(self) -> DSBackoff:
+        return DSBackoff(
+            base=self._base,
+            maximum=self._maximum,
+            factor=self._factor,
+            jitter=self._jitter,
+        )
+
+    def is_idempotent(self, url: str) -> bool:
+        """
+        :param url: URL path of the request
+        :return: whether running the request twice has the same effect as once
+        """
+        parts = urlsplit(url)
+        if parts.path in self.NON_IDEMPOTENT_PATHS:
+            return False
+        if parts.path.endswith("/undoScene"):
+            return False
+        if parts.path.endswith("/callScene"):
+            scene = parse_qs(parts.query).get("sceneNumber", [None])[0]
+            return scene is None or not scene.isdigit() or int(scene) not in STEP_SCENES
+        return True
+
+    @staticmethod
+    def is_server_failure(exception: BaseException) -> bool:
+        """
+        :param exception: the DSRequestException a request failed with
+        :return: whether the server or the connection failed, rejected or
+            unknown commands are no server failures
+        """
+        cause = exception.__cause__
+        if isinstance(cause, aiohttp.ClientResponseError):
+            return cause.status >= 500 or cause.status == 429
+        return isinstance(
+            cause,
+            (
+                asyncio.TimeoutError,
+                aiohttp.ClientConnectionError,
+                aiohttp.ClientPayloadError,
+            ),
+        )
+
+    def is_retryable(self, exception: BaseException, url: str) -> bool:
+        """
+        :param exception: the DSRequestException a request failed with
+        :param url: URL path of the request
+        :return: whether the request should be repeated
+        """
+        if not self.is_server_failure(exception):
+            return False
+        # the request never reached the server if the connection failed
+        if isinstance(exception.__cause__, aiohttp.ClientConnectorError):
+            return True
+        return self._retry_non_idempotent or self.is_idempotent(url)
+
+
+class DSCircuitBreaker:
+    """
+    fails requests to a server fast after repeated failures instead of
+    piling more requests on it, after a while a single probe request is let
+    through and closes the circuit again if it succeeds
+    """
+
+    STATE_CLOSED = "closed"
+    STATE_OPEN = "open"
+    STATE_HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param failure_threshold: consecutive failures that open the circuit
+        :param reset_timeout: seconds until a probe request is let through
+        :param clock: monotonic clock
+        """
+        self._failure_threshold = max(1, failure_threshold)
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+
+        self._open = False
+        self._opened = 0
+        self._probing = False
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if not self._open:
+            return self.STATE_CLOSED
+        if self._clock() - self._opened >= self._reset_timeout:
+            return self.STATE_HALF_OPEN
+        return self.STATE_OPEN
+
+    def retry_after(self) -> float:
+        """
+        :return: seconds until the next probe request is let through
+        """
+        if not self._open:
+            return 0
+        return max(0, self._opened + self._reset_timeout - self._clock())
+
+    def allow(self) -> bool:
+        """
+        :return: whether a request may be sent, counts the rejections
+        """
+        state = self.state
+        if state == self.STATE_CLOSED:
+            return True
+        if state == self.STATE_HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._open = False
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self._failure_threshold:
+            if not self._open or self._probing:
+                self.opened += 1
+            self._open = True
+            self._opened = self._clock()
+        self._probing = False
+
+    def release(self):
+        """
+        the probe request was cancelled, let the next request probe
+        """
+        self._probing = False
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+from pydigitalstrom.log import DSLog
+
+
+class DSSessionTokenManager:
+    """
+    keeps the session token of a DSClient, only one refresh will run at a time
+    while all other callers wait for its result
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], Awaitable[str]],
+        lifetime: float = 60,
+        refresh_margin: float = 10,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param fetch: coroutine function returning a fresh session token
+        :param lifetime: seconds a token stays valid after its last use
+        :param refresh_margin: seconds before expiry to refresh in the background
+        :param clock: monotonic clock to measure token age
+        """
+        self._fetch = fetch
+        self._lifetime = lifetime
+        self._refresh_margin = refresh_margin
+        self._clock = clock
+
+        self._token = None
+        self._expires = 0
+        self._refresh_future = None
+
+        self.refreshes = 0
+        self.hits = 0
+        self.waits = 0
+
+    @property
+    def token(self) -> Optional[str]:
+        return self._token
+
+    def is_valid(self) -> bool:
+        return self._token is not None and self._clock() < self._expires
+
+    async def get_token(self) -> str:
+        """
+        get a valid session token, refresh if it is expired or about to expire
+
+        :return: session token
+        """
+        if not self.is_valid():
+            return await self.refresh()
+
+        self.hits += 1
+        if self._expires - self._clock() < self._refresh_margin:
+            self._refresh_in_background()
+        return self._token
+
+    def touch(self):
+        """
+        the server extends the token lifetime on every successful request
+        """
+        if self._token is not None:
+            self._expires = self._clock() + self._lifetime
+
+    def invalidate(self, token: str = None):
+        """
+        drop the current token, a token of an outdated refresh is ignored
+
+        :param token: the token the server rejected
+        """
+        if token is None or token == self._token:
+            self._token = None
+            self._expires = 0
+
+    async def refresh(self) -> str:
+        """
+        fetch a new token, concurrent callers share a single request
+
+        :return: session token
+        """
+        if self._refresh_future is None:
+            self._refresh_future = asyncio.ensure_future(self._do_refresh())
+        else:
+            self.waits += 1
+        return await asyncio.shield(self._refresh_future)
+
+    def _refresh_in_background(self):
+        if self._refresh_future is not None:
+            return
+        self._refresh_future = asyncio.ensure_future(self._do_refresh())
+        self._refresh_future.add_done_callback(self._log_background_failure)
+
+    @staticmethod
+    def _log_background_failure(future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            DSLog.logger.warning(
+                f"DS session token refresh failed: {future.exception()!r}"
+            )
+
+    async def _do_refresh(self) -> str:
+        try:
+            token = await self._fetch()
+            self.refreshes += 1
+            self._token = token
+            self._expires = self._clock() + self._lifetime
+            return token
+        finally:
+            self._refresh_future = None
+
+    async def close(self):
+        """
+        cancel a pending refresh
+        """
+        if self._refresh_future is not None:
+            self._refresh_future.cancel()
+            self._refresh_future = None
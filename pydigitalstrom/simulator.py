@@ -0,0 +1,308 @@
+import asyncio
+import json
+import random
+import secrets
+from typing import Dict, Optional
+
+from aiohttp import web, WSMsgType
+
+from pydigitalstrom.generator import DSApartmentGenerator, query_tree
+
+
+class DSSimulator:
+    """
+    fake digitalSTROM server for tests and benchmarks, serves the endpoints
+    used by this library over plain http with configurable latency, error
+    rate and apartment size
+
+        async with DSSimulator(zones=50) as simulator:
+            client = simulator.get_client()
+            await client.initialize()
+    """
+
+    def __init__(
+        self,
+        zones: int = 10,
+        groups: int = 3,
+        scenes: int = 4,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        keepalive_interval: float = 30,
+        apptoken: str = "apptoken",
+        username: str = "dssadmin",
+        password: str = "dssadmin",
+        seed: int = 0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        :param zones: number of named zones besides the apartment zone 0
+        :param groups: number of groups (colors) per zone
+        :param scenes: number of named scenes per group, up to 13
+        :param latency: seconds every request takes at least
+        :param jitter: seconds randomly added to the latency
+        :param error_rate: share of requests answered with status 500
+        :param keepalive_interval: seconds between websocket keepalive events
+        :param apptoken: application token that is accepted at login
+        :param username: user for temporary tokens
+        :param password: password for temporary tokens
+        :param seed: seed of the apartment, random latency and errors
+        :param host: address to listen on
+        :param port: port to listen on, a free one by default
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.keepalive_interval = keepalive_interval
+        self.username = username
+        self.password = password
+        self.host = host
+        self.port = port
+        self._random = random.Random(seed)
+
+        self.generator = DSApartmentGenerator(
+            zones=zones, groups=groups, scenes=scenes, seed=seed
+        )
+        self.tree = self.generator.build_tree()
+        self._apptokens = {apptoken: True}
+        self._tokens = set()
+        self._subscriptions = dict()
+        self._websockets = set()
+        self._runner = None
+
+        self.requests = 0
+        self.errors = 0
+        self.scene_calls = 0
+        self.events = 0
+
+    def get_client(self, apptoken: str = None, **kwargs):
+        """
+        :param apptoken: application token, the accepted one by default
+        :param kwargs: kwargs to be forwarded to DSClient
+        :return: a client connected to the simulator
+        """
+        from pydigitalstrom.client import DSClient
+
+        return DSClient(
+            host=self.host,
+            port=self.port,
+            apptoken=apptoken or next(iter(self._apptokens)),
+            apartment_name="Apartment",
+            scheme="http",
+            **kwargs,
+        )
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/json/system/loginApplication", self._login_application)
+        app.router.add_get(
+            "/json/system/requestApplicationToken", self._request_application_token
+        )
+        app.router.add_get("/json/system/login", self._login)
+        app.router.add_get("/json/system/enableToken", self._enable_token)
+        app.router.add_get("/json/property/query2", self._query2)
+        app.router.add_get("/json/zone/callScene", self._call_scene)
+        app.router.add_get("/json/zone/undoScene", self._call_scene)
+        app.router.add_get("/json/apartment/callScene", self._call_scene)
+        app.router.add_get("/json/apartment/undoScene", self._call_scene)
+        app.router.add_get("/json/event/subscribe", self._subscribe)
+        app.router.add_get("/json/event/unsubscribe", self._unsubscribe)
+        app.router.add_get("/json/event/get", self._get_events)
+        app.router.add_get("/websocket", self._websocket)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host=self.host, port=self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self):
+        for ws in list(self._websockets):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def _ok(result: dict = None) -> web.Response:
+        data = dict(ok=True)
+        if result is not None:
+            data["result"] = result
+        return web.json_response(data)
+
+    @staticmethod
+    def _failed(message: str) -> web.Response:
+        return web.json_response(dict(ok=False, message=message))
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.requests += 1
+        delay = self.latency + self._random.random() * self.jitter
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500, text="simulated failure")
+        if request.path in (
+            "/json/system/loginApplication",
+            "/json/system/requestApplicationToken",
+            "/json/system/login",
+            "/json/system/enableToken",
+        ):
+            return await handler(request)
+
+        token = request.query.get("token") or request.cookies.get("token")
+        if token not in self._tokens:
+            return self._failed("not logged in")
+        return await handler(request)
+
+    def expire_tokens(self):
+        """
+        drop all session tokens like a restarted server does
+        """
+        self._tokens.clear()
+
+    async def _login_application(self, request: web.Request) -> web.Response:
+        if not self._apptokens.get(request.query.get("loginToken")):
+            return self._failed("Application-Authentication failed")
+        token = secrets.token_hex(32)
+        self._tokens.add(token)
+        return self._ok(dict(token=token))
+
+    async def _request_application_token(self, request: web.Request):
+        apptoken = secrets.token_hex(32)
+        self._apptokens[apptoken] = False
+        return self._ok(dict(applicationToken=apptoken))
+
+    async def _login(self, request: web.Request) -> web.Response:
+        if (request.query.get("user"), request.query.get("password")) != (
+            self.username,
+            self.password,
+        ):
+            return self._failed("Authentication failed")
+        token = secrets.token_hex(32)
+        self._tokens.add(token)
+        return self._ok(dict(token=token))
+
+    async def _enable_token(self, request: web.Request) -> web.Response:
+        apptoken = request.query.get("applicationToken")
+        if request.query.get("token") not in self._tokens:
+            return self._failed("not logged in")
+        if apptoken not in self._apptokens:
+            return self._failed("Application token not found")
+        self._apptokens[apptoken] = True
+        return self._ok()
+
+    async def _query2(self, request: web.Request) -> web.Response:
+        query = request.query.get("query")
+        if not query:
+            return self._failed("missing parameter 'query'")
+        return self._ok(query_tree(node=self.tree, path=query))
+
+    def _get_group(self, zone_id: int, group: int) -> Optional[dict]:
+        zones = self.tree["children"]["apartment"]["children"]["zones"]
+        zone = zones["children"].get(f"zone{zone_id}")
+        if zone is None:
+            return None
+        return zone["children"]["groups"]["children"].get(f"group{group}")
+
+    async def _call_scene(self, request: web.Request) -> web.Response:
+        try:
+            scene_id = int(request.query["sceneNumber"])
+            zone_id = int(request.query.get("id", 0))
+            group = int(request.query.get("groupID", 0))
+        except (KeyError, ValueError):
+            return self._failed("invalid parameters")
+        if self._get_group(zone_id=zone_id, group=group) is None:
+            return self._failed("Could not find zone or group")
+
+        name = "undoScene" if request.path.endswith("/undoScene") else "callScene"
+        if name == "callScene":
+            self.scene_calls += 1
+            node = self._get_group(zone_id=zone_id, group=group)
+            node["properties"]["lastCalledScene"] = scene_id
+        self.emit(
+            dict(
+                name=name,
+                properties=dict(
+                    zoneID=str(zone_id), groupID=str(group), sceneID=str(scene_id)
+                ),
+                source=dict(
+                    set=f".zone({zone_id}).group({group})",
+                    groupID=group,
+                    zoneID=zone_id,
+                    isApartment=zone_id == 0,
+                    isGroup=True,
+                    isDevice=False,
+                ),
+            )
+        )
+        return self._ok()
+
+    def emit(self, event: Dict):
+        """
+        send an event to all subscriptions and websockets
+        """
+        self.events += 1
+        for names, queue in self._subscriptions.values():
+            if event["name"] in names:
+                queue.put_nowait(event)
+        data = json.dumps(event)
+        for ws in self._websockets:
+            asyncio.ensure_future(ws.send_str(data))
+
+    async def _subscribe(self, request: web.Request) -> web.Response:
+        subscription = request.query.get("subscriptionID")
+        if subscription not in self._subscriptions:
+            self._subscriptions[subscription] = (set(), asyncio.Queue())
+        self._subscriptions[subscription][0].add(request.query.get("name"))
+        return self._ok()
+
+    async def _unsubscribe(self, request: web.Request) -> web.Response:
+        subscription = self._subscriptions.get(request.query.get("subscriptionID"))
+        if subscription is not None:
+            subscription[0].discard(request.query.get("name"))
+        return self._ok()
+
+    async def _get_events(self, request: web.Request) -> web.Response:
+        subscription = self._subscriptions.get(request.query.get("subscriptionID"))
+        if subscription is None:
+            return self._failed("invalid subscription")
+        queue = subscription[1]
+        timeout = int(request.query.get("timeout", 0)) / 1000
+        events = []
+        try:
+            events.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+        except asyncio.TimeoutError:
+            pass
+        while not queue.empty():
+            events.append(queue.get_nowait())
+        return self._ok(dict(events=events))
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._websockets.add(ws)
+
+        async def keepalive():
+            while True:
+                await asyncio.sleep(self.keepalive_interval)
+                await ws.send_str(json.dumps(dict(name="keepWebserviceAlive")))
+
+        task = asyncio.ensure_future(keepalive())
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            task.cancel()
+            self._websockets.discard(ws)
+        return ws
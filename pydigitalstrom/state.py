@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import time
+from typing import Optional, Tuple
+
+from pydigitalstrom.dispatcher import get_event_route
+from pydigitalstrom.exceptions import DSCommandFailedException, DSException
+from pydigitalstrom.log import DSLog
+
+
+class DSStateCache:
+    """
+    last called scene per zone and group, kept up to date from callScene and
+    undoScene events so reads never hit the server
+    """
+
+    URL_LAST_CALLED_SCENES = (
+        "/json/property/query2?query=/apartment/zones/*(ZoneID)/"
+        "groups/*(group,lastCalledScene)"
+    )
+
+    def __init__(self, client, history: int = 4, reconcile_interval: float = None):
+        """
+        :param client: the client to reconcile with
+        :param history: number of previous scenes kept per zone and group to
+            apply undoScene events
+        :param reconcile_interval: seconds between queries of the last called
+            scenes from the server, None to only rely on events
+        """
+        self._client = client
+        self._history = history
+        self._reconcile_interval = reconcile_interval
+
+        # (zone_id, group) -> (scene_id, timestamp)
+        self._states = dict()
+        self._previous = dict()
+        self._callbacks = []
+        self._task = None
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, zone_id: int, group: int = 0) -> Optional[int]:
+        """
+        :return: the last called scene of the zone and group or None
+        """
+        state = self._states.get((zone_id, group))
+        return None if state is None else state[0]
+
+    def get_state(self, zone_id: int, group: int = 0) -> Optional[Tuple[int, float]]:
+        """
+        :return: (scene_id, timestamp of the call) or None
+        """
+        return self._states.get((zone_id, group))
+
+    def get_states(self) -> dict:
+        return dict(self._states)
+
+    def register(self, callback: callable):
+        """
+        :param callback: coroutine function called with zone_id, group,
+            scene_id and previous whenever a scene changes
+        """
+        self._callbacks.append(callback)
+
+    def attach(self, listener):
+        """
+        keep the cache up to date from the events of a websocket or long-poll
+        listener
+        """
+        listener.register(callback=self._on_event, event_name="callScene")
+        listener.register(callback=self._on_event, event_name="undoScene")
+
+    async def set(
+        self, zone_id: int, group: int, scene_id: int, timestamp: float = None
+    ):
+        """
+        store a called scene and notify the callbacks if it changed
+        """
+        key = (zone_id, group)
+        state = self._states.get(key)
+        previous = None if state is None else state[0]
+        self._states[key] = (scene_id, timestamp or time.time())
+        if previous == scene_id:
+            return
+
+        if previous is not None:
+            self._previous.setdefault(
+                key, collections.deque(maxlen=self._history)
+            ).append(previous)
+        await self._notify(
+            zone_id=zone_id, group=group, scene_id=scene_id, previous=previous
+        )
+
+    async def undo(self, zone_id: int, group: int, scene_id: int = None):
+        """
+        revert to the previously called scene
+
+        :param scene_id: the undone scene, ignored if it's not the current one
+        """
+        key = (zone_id, group)
+        state = self._states.get(key)
+        if state is None or (scene_id is not None and state[0] != scene_id):
+            return
+        history = self._previous.get(key)
+        if not history:
+            del self._states[key]
+            await self._notify(
+                zone_id=zone_id, group=group, scene_id=None, previous=state[0]
+            )
+            return
+
+        self._states[key] = (history.pop(), time.time())
+        await self._notify(
+            zone_id=zone_id,
+            group=group,
+            scene_id=self._states[key][0],
+            previous=state[0],
+        )
+
+    async def _notify(self, **kwargs):
+        for callback in self._callbacks:
+            try:
+                await callback(**kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                DSLog.logger.warning(f"DS state callback {callback!r} failed: {e!r}")
+
+    async def _on_event(self, event: dict):
+        name, zone_id, group, scene_id = get_event_route(event)
+        if zone_id is None:
+            return
+        group = group or 0
+        if name == "callScene" and scene_id is not None:
+            await self.set(zone_id=zone_id, group=group, scene_id=scene_id)
+        elif name == "undoScene":
+            await self.undo(zone_id=zone_id, group=group, scene_id=scene_id)
+
+    async def reconcile(self):
+        """
+        query the last called scenes from the server and correct the cache
+        """
+        response = await self._client.request(url=self.URL_LAST_CALLED_SCENES)
+        if "result" not in response:
+            raise DSCommandFailedException("no result in server response")
+
+        for zone in response["result"].values():
+            zone_id = zone.get("ZoneID")
+            for key, group in zone.items():
+                if not str(key).startswith("group") or not isinstance(group, dict):
+                    continue
+                scene_id = group.get("lastCalledScene")
+                if scene_id is None:
+                    continue
+                state = self._states.get((zone_id, group["group"]))
+                if state is None or state[0] != scene_id:
+                    await self.set(
+                        zone_id=zone_id, group=group["group"], scene_id=scene_id
+                    )
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except asyncio.CancelledError:
+                raise
+            except DSException as e:
+                DSLog.logger.warning(f"DS state reconciliation failed: {e!r}")
+            await asyncio.sleep(self._reconcile_interval)
+
+    async def start(self):
+        """
+        start the scheduled reconciliation if an interval is configured
+        """
+        if self._reconcile_interval and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
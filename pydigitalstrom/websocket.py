@@ -1,53 +1,191 @@
 import aiohttp
 import asyncio
-import json
 import time
+from typing import Iterable
 
+from pydigitalstrom.backoff import DSBackoff
 from pydigitalstrom.client import DSClient
+from pydigitalstrom.dispatcher import DSEventDispatcher
+from pydigitalstrom.listener import DSBaseEventListener
 from pydigitalstrom.log import DSLog
+from pydigitalstrom.metrics import DSMetrics
 
 
-class DSWebsocketEventListener:
-    def __init__(self, client: DSClient, event_name: str):
-        self._client = client
-        self._event_name = event_name
-        self._callbacks = []
+class DSWebsocketEventListener(DSBaseEventListener):
+    STATE_CONNECTING = "connecting"
+    STATE_CONNECTED = "connected"
+    STATE_DISCONNECTED = "disconnected"
+    STATE_STOPPED = "stopped"
+
+    def __init__(
+        self,
+        client: DSClient,
+        event_name: str = None,
+        keepalive_timeout: float = 90,
+        backoff: DSBackoff = None,
+        dispatcher: DSEventDispatcher = None,
+        event_names: Iterable[str] = (),
+        prefilter: bool = True,
+    ):
+        """
+        :param client: the client to connect with
+        :param event_name: name of the event to forward to the callbacks
+        :param keepalive_timeout: seconds without keepWebserviceAlive event
+            after which the connection is considered dead, None to disable
+        :param backoff: reconnect delays, 1 to 60 seconds by default
+        :param dispatcher: queue and workers running the callbacks
+        :param event_names: more names of events to forward to the callbacks
+        :param prefilter: skip decoding frames that can't contain a subscribed
+            event
+        """
+        super().__init__(
+            client=client,
+            event_name=event_name,
+            event_names=event_names,
+            dispatcher=dispatcher,
+        )
+        self._keepalive_timeout = keepalive_timeout
+        self._prefilter = prefilter
+        self._needles = ()
+        self._needle_count = None
+        self._backoff = backoff or DSBackoff(base=1, maximum=60)
+        self._state_callbacks = []
 
         self._ws = None
         self._last_keepalive = None
+        self._stop_event = None
+        self.state = self.STATE_STOPPED
+        self.reconnects = 0
+        self.skipped = 0
+
+    def register_state_callback(self, callback: callable):
+        """
+        :param callback: coroutine function called with state=... on every
+            connection state transition
+        """
+        self._state_callbacks.append(callback)
 
-    def register(self, callback: callable):
-        self._callbacks.append(callback)
+    async def _set_state(self, state: str):
+        if state == self.state:
+            return
+        DSLog.logger.debug(f"DS websocket {self.state} -> {state}")
+        self.state = state
+        for callback in self._state_callbacks:
+            await callback(state=state)
 
     async def _get_cookie(self):
         return dict(token=await self._client.get_session_token())
 
     async def start(self):
-        session = await self._client.get_aiohttp_session(
-            cookies=await self._get_cookie()
+        """
+        listen for events until stop() is called, the connection is
+        re-established with a fresh session token whenever it drops
+        """
+        self._stop_event = asyncio.Event()
+        await self._dispatcher.start()
+        while not self._stop_event.is_set():
+            await self._set_state(self.STATE_CONNECTING)
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                DSLog.logger.warning(f"DS websocket connection failed: {e!r}")
+
+            if self._stop_event.is_set():
+                break
+            await self._set_state(self.STATE_DISCONNECTED)
+
+            # wait before reconnecting, unless we're stopped meanwhile
+            try:
+                await asyncio.wait_for(
+                    self._stop_event.wait(), timeout=self._backoff.next_delay()
+                )
+            except asyncio.TimeoutError:
+                self.reconnects += 1
+        await self._set_state(self.STATE_STOPPED)
+
+    def _get_receive_timeout(self):
+        if self._keepalive_timeout is None:
+            return None
+        return max(0, self._last_keepalive + self._keepalive_timeout - time.monotonic())
+
+    async def _listen(self):
+        cookie = await self._get_cookie()
+        session = await self._client.get_session()
+        scheme = "wss" if self._client.scheme == "https" else "ws"
+        url = f"{scheme}://{self._client.host}:{self._client.port}/websocket"
+        self._ws = ws = await session.ws_connect(
+            url=url,
+            headers={
+                "Cookie": "; ".join(f"{key}={value}" for key, value in cookie.items())
+            },
         )
-        url = f"wss://{self._client.host}:{self._client.port}/websocket"
-        self._ws = session.ws_connect(url=url)
-        async with self._ws as ws:
-            async for msg in ws:
+        try:
+            self._last_keepalive = time.monotonic()
+            await self._set_state(self.STATE_CONNECTED)
+            while True:
+                try:
+                    msg = await ws.receive(timeout=self._get_receive_timeout())
+                except asyncio.TimeoutError:
+                    DSLog.logger.warning("DS websocket keepalive timed out")
+                    return
+
                 if msg.type == aiohttp.WSMsgType.TEXT:
-                    await self._handle_event(event=json.loads(msg.data))
+                    # the connection is working, start over with short delays
+                    self._backoff.reset()
+                    if self._is_wanted(data=msg.data):
+                        await self._handle_event(
+                            event=self._client.codec.loads(msg.data)
+                        )
+                    else:
+                        self.skipped += 1
+                        self._client.metrics.increment(DSMetrics.EVENTS_SKIPPED)
+                elif msg.type in (
+                    aiohttp.WSMsgType.CLOSE,
+                    aiohttp.WSMsgType.CLOSING,
+                    aiohttp.WSMsgType.CLOSED,
+                    aiohttp.WSMsgType.ERROR,
+                ):
+                    return
                 else:
-                    DSLog.logger.warn(f"DS websocket got unknown command: {msg}")
+                    DSLog.logger.warning(f"DS websocket got unknown command: {msg}")
+        finally:
+            self._ws = None
+            await ws.close()
+
+    def _is_wanted(self, data: str) -> bool:
+        # a substring search is much cheaper than decoding frames of events
+        # nobody subscribed to
+        if not self._prefilter:
+            return True
+        # names are only ever added, rebuild the quoted names when one was
+        if self._needle_count != len(self._event_names):
+            self._needle_count = len(self._event_names)
+            self._needles = tuple(
+                f'"{name}"' for name in {"keepWebserviceAlive", *self._event_names}
+            )
+        for needle in self._needles:
+            if needle in data:
+                return True
+        return False
 
     async def stop(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
         if self._ws is not None:
             await self._ws.close()
             self._ws = None
+        await self._dispatcher.stop()
 
     async def _handle_event(self, event: dict):
         if "name" not in event:
             return
 
+        self._client.metrics.increment(DSMetrics.EVENTS, event=event["name"])
         if event["name"] == "keepWebserviceAlive":
-            self._last_keepalive = time.time() * 1000.0
+            self._last_keepalive = time.monotonic()
 
-        # subscribed event
-        if event["name"] == self._event_name:
-            for callback in self._callbacks:
-                await callback(event=event)
+        # subscribed event, the callbacks run outside of the read loop
+        if event["name"] in self._event_names:
+            await self._dispatcher.put(event=event)
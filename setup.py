@@ -40,6 +40,13 @@ setup(
     long_description_content_type="text/markdown",
     packages=find_packages(),
     install_requires=requirements(),
+    extras_require={
+        "fast": ["orjson"],
+        "stream": ["ijson"],
+        "prometheus": ["prometheus_client"],
+        "opentelemetry": ["opentelemetry-api"],
+        "numpy": ["numpy"],
+    },
     keywords=["digitalstrom", "dss", "ds"],
     python_requires=">=3.7.6",
     classifiers=[
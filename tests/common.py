@@ -10,8 +10,37 @@ TEST_APARTMENT = "Apartment"
 
 
 def get_testclient(
-    host=TEST_HOST, port=TEST_PORT, apptoken=TEST_TOKEN, apartment_name=TEST_APARTMENT
+    host=TEST_HOST,
+    port=TEST_PORT,
+    apptoken=TEST_TOKEN,
+    apartment_name=TEST_APARTMENT,
+    **kwargs,
 ):
     return DSClient(
-        host=host, port=port, apptoken=apptoken, apartment_name=apartment_name
+        host=host, port=port, apptoken=apptoken, apartment_name=apartment_name, **kwargs
     )
+
+
+TEST_SCENES = dict(
+    ok=True,
+    result=dict(
+        zone0=dict(ZoneID=0, name="", group0=dict(group=0, color=0)),
+        zone1=dict(
+            ZoneID=1,
+            name="Kitchen",
+            group1=dict(
+                group=1,
+                color=1,
+                scene0=dict(scene=5, name="Bright"),
+                scene1=dict(scene=17, name="Dinner"),
+            ),
+            group2=dict(group=2, color=2),
+        ),
+        zone2=dict(
+            ZoneID=2,
+            name="Living",
+            group1=dict(group=1, color=1, scene0=dict(scene=5, name="Reading")),
+        ),
+        zone3=dict(ZoneID=3, name=""),
+    ),
+)
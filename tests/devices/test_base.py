@@ -27,7 +27,7 @@ class TestDevice(aiounittest.AsyncTestCase):
         ) as mock_stack_append:
             device = DSDevice(client=get_testclient(), device_id=5, device_name="test")
             await device.request(url="abc.de")
-            mock_stack_append.assert_called_with(url="abc.de")
+            mock_stack_append.assert_called_with(url="abc.de", deadline=None)
 
     async def test_request_plain(self):
         with patch(
@@ -36,7 +36,7 @@ class TestDevice(aiounittest.AsyncTestCase):
         ) as mock_stack_append:
             device = DSDevice(client=get_testclient(), device_id=5, device_name="test")
             await device.request(url="abc.de")
-            mock_stack_append.assert_called_with(url="abc.de")
+            mock_stack_append.assert_called_with(url="abc.de", deadline=None)
 
     async def test_request_with_data(self):
         with patch(
@@ -45,4 +45,4 @@ class TestDevice(aiounittest.AsyncTestCase):
         ) as mock_stack_append:
             device = DSDevice(client=get_testclient(), device_id=5, device_name="test")
             await device.request(url="abc.de?{x}", x="hello")
-            mock_stack_append.assert_called_with(url="abc.de?hello")
+            mock_stack_append.assert_called_with(url="abc.de?hello", deadline=None)
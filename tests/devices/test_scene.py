@@ -20,6 +20,7 @@ class TestScene(aiounittest.AsyncTestCase):
         self.assertEqual(device.scene_id, 2)
         self.assertEqual(device.scene_name, "scene")
         self.assertEqual(device.unique_id, "1_2")
+        self.assertFalse(hasattr(device, "__dict__"))
 
     async def test_turn_on(self):
         with patch(
@@ -36,6 +37,12 @@ class TestScene(aiounittest.AsyncTestCase):
             await device.turn_on()
             mock_stack_append.assert_called_with(
                 url="/json/zone/callScene?id=1&sceneNumber=2&force=true",
+                deadline=None,
+            )
+            await device.turn_on(deadline=5)
+            mock_stack_append.assert_called_with(
+                url="/json/zone/callScene?id=1&sceneNumber=2&force=true",
+                deadline=5,
             )
 
 
@@ -55,6 +62,7 @@ class TestColorScene(aiounittest.AsyncTestCase):
         self.assertEqual(device.scene_name, "scene")
         self.assertEqual(device.color, 1)
         self.assertEqual(device.unique_id, "1_1_2")
+        self.assertFalse(hasattr(device, "__dict__"))
 
     async def test_turn_on(self):
         with patch(
@@ -72,4 +80,5 @@ class TestColorScene(aiounittest.AsyncTestCase):
             await device.turn_on()
             mock_stack_append.assert_called_with(
                 url="/json/zone/callScene?id=1&sceneNumber=2&groupID=1&" "force=true",
+                deadline=None,
             )
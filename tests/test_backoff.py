@@ -0,0 +1,18 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from pydigitalstrom.backoff import DSBackoff
+
+
+class TestBackoff(unittest.TestCase):
+    def test_exponential(self):
+        backoff = DSBackoff(base=1, maximum=10, factor=2, jitter=0)
+        self.assertEqual([backoff.next_delay() for _ in range(6)], [1, 2, 4, 8, 10, 10])
+        backoff.reset()
+        self.assertEqual(backoff.next_delay(), 1)
+
+    def test_jitter(self):
+        backoff = DSBackoff(base=4, maximum=10, factor=2, jitter=0.5)
+        for _ in range(50):
+            backoff.reset()
+            self.assertTrue(2 <= backoff.next_delay() <= 4)
@@ -0,0 +1,53 @@
+# -*- coding: UTF-8 -*-
+import json
+import os
+import tempfile
+import time
+
+import aiounittest
+
+from pydigitalstrom.cache import DSStructureCache
+
+
+class TestStructureCache(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "structure.json")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    async def test_roundtrip(self):
+        cache = DSStructureCache(path=self.path)
+        await cache.save(
+            fingerprint="abc",
+            zones=[(1, "Kitchen")],
+            scenes=[(1, 1, 5, "Bright")],
+            zone_ids=[0, 1, 2],
+            revision="def",
+        )
+        data = await cache.load()
+        self.assertEqual(data["fingerprint"], "abc")
+        self.assertEqual(data["zones"], [[1, "Kitchen"]])
+        self.assertEqual(data["scenes"], [[1, 1, 5, "Bright"]])
+        self.assertEqual(data["zone_ids"], [0, 1, 2])
+        self.assertEqual(data["revision"], "def")
+
+    async def test_missing(self):
+        self.assertIsNone(await DSStructureCache(path=self.path).load())
+
+    async def test_expired(self):
+        cache = DSStructureCache(path=self.path, max_age=60)
+        await cache.save(fingerprint="abc", zones=[], scenes=[])
+        with open(self.path) as f:
+            data = json.load(f)
+        data["updated"] = time.time() - 61
+        with open(self.path, "w") as f:
+            json.dump(data, f)
+        self.assertIsNone(await cache.load())
+        self.assertIsNotNone(await DSStructureCache(path=self.path).load())
+
+    async def test_corrupt(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        self.assertIsNone(await DSStructureCache(path=self.path).load())
@@ -13,8 +13,8 @@ class TestClientAuth(aiounittest.AsyncTestCase):
         self.assertEqual(client._apptoken, TEST_TOKEN)
         self.assertEqual(client._apartment_name, TEST_APARTMENT)
 
-        self.assertIsNone(client._last_request)
-        self.assertIsNone(client._session_token)
+        self.assertIsNone(client.token_manager.token)
+        self.assertFalse(client.token_manager.is_valid())
         self.assertEqual(client._scenes, dict())
 
     async def test_get_session_token(self):
@@ -1,8 +1,313 @@
 # -*- coding: UTF-8 -*-
+import copy
+import os
+import tempfile
+import unittest
+
 import aiounittest
+from aioresponses import aioresponses
+from unittest.mock import patch
+
+from pydigitalstrom.cache import DSStructureCache
+from pydigitalstrom.constants import SCENE_NAMES
+from pydigitalstrom.devices.scene import DSScene, DSColorScene
+from pydigitalstrom.exceptions import DSUnauthorizedException
+from pydigitalstrom.requesthandler import ijson
+from tests.common import get_testclient, TEST_SCENES
+
+
+async def echo(url, **kwargs):
+    return url
+
+
+async def get_scenes(url, **kwargs):
+    return copy.deepcopy(TEST_SCENES)
 
 
 class TestClientDevicehandling(aiounittest.AsyncTestCase):
-    """
-    TODO: implement tests for DSClient device handling functions
-    """
+    async def get_initialized_client(self, **kwargs):
+        client = get_testclient(stack_delay=0, **kwargs)
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await client.initialize()
+        return client
+
+    async def test_initialize(self):
+        client = await self.get_initialized_client()
+        scenes = client.get_scenes()
+        # generic scenes for the named zones plus three named color scenes
+        self.assertEqual(len(scenes), 3 * len(SCENE_NAMES) + 3)
+        self.assertIsInstance(scenes["1_71"], DSScene)
+        self.assertEqual(scenes["0_71"].zone_name, "Apartment")
+        self.assertIsInstance(scenes["1_1_17"], DSColorScene)
+        self.assertEqual(scenes["1_1_17"].name, "Kitchen / Dinner")
+        self.assertNotIn("3_71", scenes)
+        self.assertEqual(
+            client.get_zones(), {0: "Apartment", 1: "Kitchen", 2: "Living"}
+        )
+
+    async def test_call_scenes_apartment_wide(self):
+        client = await self.get_initialized_client()
+        scenes = client.get_scenes()
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            await client.stack.start()
+            results = await client.call_scenes(
+                [(1, 2, 0), scenes["1_1_5"], scenes["2_1_5"], (3, 1, 5)]
+            )
+            await client.stack.stop()
+
+        apartment = "/json/apartment/callScene?sceneNumber=5&groupID=1&force=true"
+        zone = "/json/zone/callScene?id=1&sceneNumber=0&groupID=2&force=true"
+        self.assertEqual(results, [zone, apartment, apartment, apartment])
+        # sent in batch order
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list], [zone, apartment]
+        )
+
+    async def test_call_scenes_same_group_keeps_order(self):
+        client = await self.get_initialized_client()
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            await client.stack.start()
+            await client.call_scenes(
+                [(2, None, 5), (1, None, 0), (1, None, 5), (3, None, 5)]
+            )
+            await client.stack.stop()
+
+        # zone 1 ends in scene 5 as called last, not in the apartment wide one
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list],
+            [
+                "/json/zone/callScene?id=2&sceneNumber=5&force=true",
+                "/json/zone/callScene?id=1&sceneNumber=0&force=true",
+                "/json/zone/callScene?id=1&sceneNumber=5&force=true",
+                "/json/zone/callScene?id=3&sceneNumber=5&force=true",
+            ],
+        )
+
+    async def test_call_scenes_unnamed_zone(self):
+        client = await self.get_initialized_client()
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            await client.stack.start()
+            # zone 3 has no name but an apartment call would reach it too
+            results = await client.call_scenes([(1, None, 67), (2, None, 67)])
+            await client.stack.stop()
+
+        self.assertEqual(
+            results,
+            [
+                "/json/zone/callScene?id=1&sceneNumber=67&force=true",
+                "/json/zone/callScene?id=2&sceneNumber=67&force=true",
+            ],
+        )
+        self.assertEqual(mock_request.call_count, 2)
+
+    async def test_call_scenes_fan_out(self):
+        client = await self.get_initialized_client(stack_concurrency=4)
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            await client.stack.start()
+            results = await client.call_scenes([(1, 1, 5), (2, None, 0), (1, 1, 5)])
+            await client.stack.stop()
+
+        self.assertEqual(
+            results,
+            [
+                "/json/zone/callScene?id=1&sceneNumber=5&groupID=1&force=true",
+                "/json/zone/callScene?id=2&sceneNumber=0&force=true",
+                "/json/zone/callScene?id=1&sceneNumber=5&groupID=1&force=true",
+            ],
+        )
+        self.assertEqual(mock_request.call_count, 2)
+
+    async def test_call_scenes_returns_errors(self):
+        client = await self.get_initialized_client()
+
+        async def request(url, **kwargs):
+            raise ValueError(url)
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            results = await client.call_scenes([(1, None, 5)])
+            await client.stack.stop()
+        self.assertIsInstance(results[0], ValueError)
+
+
+class TestClientRefresh(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = DSStructureCache(
+            path=os.path.join(self.tmpdir.name, "structure.json")
+        )
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    async def test_refresh_diff(self):
+        client = get_testclient()
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await client.initialize()
+        kitchen = client.get_scenes()["1_71"]
+
+        changed = copy.deepcopy(TEST_SCENES)
+        changed["result"]["zone1"]["group1"]["scene1"]["name"] = "Supper"
+        del changed["result"]["zone2"]
+        changed["result"]["zone3"]["name"] = "Bath"
+
+        async def request(url, **kwargs):
+            return copy.deepcopy(changed)
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            diff = await client.refresh()
+
+        scenes = client.get_scenes()
+        self.assertEqual(diff["changed"], ["1_1_17"])
+        self.assertIn("3_71", diff["added"])
+        self.assertIn("2_71", diff["removed"])
+        self.assertIn("2_1_5", diff["removed"])
+        self.assertEqual(scenes["1_1_17"].name, "Kitchen / Supper")
+        self.assertNotIn("2_71", scenes)
+        # unchanged scenes keep their objects
+        self.assertIs(scenes["1_71"], kitchen)
+
+    async def test_refresh_unchanged(self):
+        client = get_testclient()
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await client.initialize()
+            diff = await client.refresh()
+        self.assertEqual(diff, dict(added=[], changed=[], removed=[]))
+
+    async def test_warm_start_skips_fetch(self):
+        client = get_testclient(cache=self.cache)
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await client.initialize()
+        scenes = client.get_scenes()
+
+        client = get_testclient(cache=self.cache)
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=get_scenes
+        ) as mock_request:
+            await client.initialize()
+        # only the structure revision is fetched
+        mock_request.assert_called_once_with(url=client.URL_STRUCTURE)
+        self.assertEqual(set(client.get_scenes()), set(scenes))
+        self.assertEqual(client.get_scenes()["1_1_17"].name, "Kitchen / Dinner")
+        self.assertEqual(client.get_zones()[0], "Apartment")
+        self.assertEqual(client._zone_ids, {0, 1, 2, 3})
+
+        # the server still has the same structure
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            diff = await client.refresh()
+        self.assertEqual(diff, dict(added=[], changed=[], removed=[]))
+
+    async def test_warm_start_ignores_state(self):
+        client = get_testclient(cache=self.cache)
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await client.initialize()
+
+        called = copy.deepcopy(TEST_SCENES)
+        called["result"]["zone1"]["group1"]["lastCalledScene"] = 17
+
+        async def request(url, **kwargs):
+            return copy.deepcopy(called)
+
+        client = get_testclient(cache=self.cache)
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=request
+        ) as mock_request:
+            await client.initialize()
+        mock_request.assert_called_once_with(url=client.URL_STRUCTURE)
+
+    async def test_warm_start_fetches_changed_structure(self):
+        client = get_testclient(cache=self.cache)
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await client.initialize()
+
+        changed = copy.deepcopy(TEST_SCENES)
+        changed["result"]["zone3"]["name"] = "Bath"
+
+        async def request(url, **kwargs):
+            return copy.deepcopy(changed)
+
+        client = get_testclient(cache=self.cache)
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=request
+        ) as mock_request:
+            await client.initialize()
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list],
+            [client.URL_STRUCTURE, client.URL_SCENES],
+        )
+        self.assertEqual(client.get_zones()[3], "Bath")
+
+        # the new structure is cached
+        client = get_testclient(cache=self.cache)
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=request
+        ) as mock_request:
+            await client.initialize()
+        mock_request.assert_called_once_with(url=client.URL_STRUCTURE)
+
+
+@unittest.skipIf(ijson is None, "ijson is not installed")
+class TestClientStreamStructure(aiounittest.AsyncTestCase):
+    async def get_token(self):
+        return "token"
+
+    async def refresh(self, client, *payloads):
+        client.token_manager._fetch = self.get_token
+        with aioresponses() as mock_get:
+            for payload in payloads:
+                mock_get.get(
+                    url="https://dss.local:8080" + client.URL_SCENES + "&token=token",
+                    payload=payload,
+                )
+            return await client.refresh()
+
+    async def test_stream_matches_full_load(self):
+        full = get_testclient()
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=get_scenes):
+            await full.initialize()
+
+        client = get_testclient(stream_structure=True)
+        diff = await self.refresh(client, TEST_SCENES)
+        self.assertEqual(sorted(diff["added"]), sorted(full.get_scenes()))
+        self.assertEqual(set(client.get_scenes()), set(full.get_scenes()))
+        self.assertEqual(client.get_scenes().get_row("1_1_17")[4], "Dinner")
+        self.assertEqual(client.get_zones(), full.get_zones())
+        self.assertEqual(client._zone_ids, full._zone_ids)
+        self.assertEqual(client._fingerprint, full._fingerprint)
+
+        diff = await self.refresh(client, TEST_SCENES)
+        self.assertEqual(diff, dict(added=[], changed=[], removed=[]))
+        await client.close()
+        await full.close()
+
+    async def test_stream_retry_on_expired_token(self):
+        client = get_testclient(stream_structure=True)
+        diff = await self.refresh(
+            client, dict(ok=False, message="not logged in"), TEST_SCENES
+        )
+        self.assertIn("1_1_17", diff["added"])
+        self.assertEqual(client.token_manager.refreshes, 2)
+
+        with self.assertRaises(DSUnauthorizedException):
+            await self.refresh(
+                client,
+                dict(ok=False, message="not logged in"),
+                dict(ok=False, message="not logged in"),
+            )
+        await client.close()
+
+    async def test_stream_without_ijson(self):
+        client = get_testclient(stream_structure=True)
+        with patch("pydigitalstrom.client.ijson", None), patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=get_scenes
+        ):
+            await client.initialize()
+        self.assertIn("1_1_17", client.get_scenes())
@@ -1,8 +1,17 @@
 # -*- coding: UTF-8 -*-
+import asyncio
+import unittest
+
 import aiounittest
 from aioresponses import aioresponses
+from unittest.mock import patch
 
-from pydigitalstrom.exceptions import DSCommandFailedException, DSRequestException
+from pydigitalstrom.exceptions import (
+    DSCommandFailedException,
+    DSRequestException,
+    DSUnauthorizedException,
+)
+from pydigitalstrom.requesthandler import ijson
 from tests.common import get_testclient
 
 
@@ -58,9 +67,113 @@ class TestClientRawRequest(aiounittest.AsyncTestCase):
                 await client.raw_request(url="/json/hello")
 
 
+@unittest.skipIf(ijson is None, "ijson is not installed")
+class TestClientRawRequestItems(aiounittest.AsyncTestCase):
+    async def get_items(self, client, **kwargs):
+        with aioresponses() as mock_get:
+            mock_get.get(url="https://dss.local:8080/json/hello", **kwargs)
+            return [item async for item in client.raw_request_items(url="/json/hello")]
+
+    async def test_raw_request_items(self):
+        client = get_testclient()
+        items = await self.get_items(
+            client,
+            payload=dict(
+                ok=True,
+                result=dict(
+                    zone1=dict(ZoneID=1, group1=dict(color=1, scenes=[5, 17])),
+                    zone2=dict(ZoneID=2, value=1.5),
+                    count=2,
+                ),
+            ),
+        )
+        self.assertEqual(
+            items,
+            [
+                ("zone1", dict(ZoneID=1, group1=dict(color=1, scenes=[5, 17]))),
+                ("zone2", dict(ZoneID=2, value=1.5)),
+                ("count", 2),
+            ],
+        )
+        await client.close()
+
+    async def test_raw_request_items_errors(self):
+        client = get_testclient()
+        with self.assertRaises(DSUnauthorizedException):
+            await self.get_items(
+                client, payload=dict(ok=False, message="Not logged in")
+            )
+        with self.assertRaises(DSCommandFailedException):
+            await self.get_items(client, payload=dict(ok=True))
+        with self.assertRaises(DSRequestException):
+            await self.get_items(client, body=b'{"ok": true, "result": {"zone')
+        with self.assertRaises(DSRequestException):
+            await self.get_items(client, status=500)
+        await client.close()
+
+
 class TestClientRequest(aiounittest.AsyncTestCase):
-    """
-    TODO: implement tests for DSClient.request
-    """
+    async def test_request_single_token_refresh(self):
+        client = get_testclient()
+        calls = []
+
+        async def get_session_token():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "session"
+
+        async def raw_request(url, **kwargs):
+            return dict(ok=True, token=kwargs["params"]["token"])
+
+        client.token_manager._fetch = get_session_token
+        with patch(
+            "pydigitalstrom.client.DSClient.raw_request", side_effect=raw_request
+        ):
+            results = await asyncio.gather(
+                *[client.request(url="/json/hello") for _ in range(10)]
+            )
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r["token"] for r in results], ["session"] * 10)
+        self.assertEqual(client.token_manager.refreshes, 1)
+
+    async def test_request_retry_on_expired_token(self):
+        client = get_testclient()
+        tokens = iter(["old", "new"])
+
+        async def get_session_token():
+            return next(tokens)
+
+        async def raw_request(url, **kwargs):
+            if kwargs["params"]["token"] == "old":
+                raise DSUnauthorizedException("not logged in")
+            return dict(ok=True, token=kwargs["params"]["token"])
+
+        client.token_manager._fetch = get_session_token
+        with patch(
+            "pydigitalstrom.client.DSClient.raw_request", side_effect=raw_request
+        ) as mock_raw_request:
+            result = await client.request(url="/json/hello")
+
+        self.assertEqual(result["token"], "new")
+        self.assertEqual(mock_raw_request.call_count, 2)
+        self.assertEqual(client.token_manager.refreshes, 2)
+
+    async def test_request_unauthorized_message(self):
+        client = get_testclient()
+        with aioresponses() as mock_get:
+            mock_get.get(
+                url="https://dss.local:8080/json/hello",
+                payload=dict(ok=False, message="Not logged in"),
+            )
+            with self.assertRaises(DSUnauthorizedException):
+                await client.raw_request(url="/json/hello")
+        await client.close()
 
-    pass
+    async def test_request_unauthorized_status(self):
+        client = get_testclient()
+        with aioresponses() as mock_get:
+            mock_get.get(url="https://dss.local:8080/json/hello", status=403)
+            with self.assertRaises(DSRequestException):
+                await client.raw_request(url="/json/hello")
+        await client.close()
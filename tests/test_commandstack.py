@@ -0,0 +1,456 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import time
+
+import aiounittest
+from unittest.mock import patch
+
+from pydigitalstrom.constants import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from pydigitalstrom.exceptions import DSCommandFailedException
+from tests.common import get_testclient
+
+
+async def echo(url, **kwargs):
+    return url
+
+
+class TestCommandStack(aiounittest.AsyncTestCase):
+    async def test_append_resolves_result(self):
+        client = get_testclient(stack_delay=0)
+
+        async def request(url, **kwargs):
+            return dict(ok=True, url=url)
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            future = await client.stack.append(url="/json/hello")
+            self.assertEqual(await future, dict(ok=True, url="/json/hello"))
+            await client.stack.stop()
+        self.assertEqual(client.stack.executed, 1)
+
+    async def test_append_resolves_error(self):
+        client = get_testclient(stack_delay=0)
+
+        async def request(url, **kwargs):
+            raise DSCommandFailedException()
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            future = await client.stack.append(url="/json/hello")
+            with self.assertRaises(DSCommandFailedException):
+                await future
+            await client.stack.stop()
+        self.assertEqual(client.stack.failed, 1)
+
+    async def test_order_and_concurrency(self):
+        client = get_testclient(stack_delay=0, stack_concurrency=4)
+        running = []
+        peak = []
+
+        async def request(url, **kwargs):
+            running.append(url)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(url)
+            return url
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            futures = [await client.stack.append(url=str(i)) for i in range(12)]
+            results = await asyncio.gather(*futures)
+            await client.stack.stop()
+        self.assertEqual(results, [str(i) for i in range(12)])
+        self.assertEqual(max(peak), 4)
+
+    async def test_rate_limit(self):
+        client = get_testclient(stack_delay=20, stack_burst=2)
+
+        async def request(url, **kwargs):
+            return url
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            started = asyncio.get_event_loop().time()
+            futures = [await client.stack.append(url=str(i)) for i in range(5)]
+            await asyncio.gather(*futures)
+            elapsed = asyncio.get_event_loop().time() - started
+            await client.stack.stop()
+        # two commands go out immediately, three wait 20ms each
+        self.assertGreaterEqual(elapsed, 0.055)
+
+    async def test_idle_stack_does_not_poll(self):
+        client = get_testclient(stack_delay=1)
+        with patch("pydigitalstrom.client.DSClient.request") as mock_request:
+            await client.stack.start()
+            await asyncio.sleep(0.02)
+            await client.stack.stop()
+        mock_request.assert_not_called()
+
+    async def test_stop_cancels_pending(self):
+        client = get_testclient()
+        future = await client.stack.append(url="/json/hello")
+        await client.stack.stop()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(len(client.stack), 0)
+
+    async def test_stop_cancels_in_flight(self):
+        client = get_testclient(stack_delay=0)
+        started = asyncio.Event()
+
+        async def request(url, **kwargs):
+            started.set()
+            await asyncio.sleep(1)
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            future = await client.stack.append(url="/json/hello")
+            await started.wait()
+            await client.stack.stop()
+        self.assertTrue(future.cancelled())
+        self.assertEqual(client.stack._active, set())
+
+    async def test_stop_cancels_rate_limited(self):
+        client = get_testclient(stack_delay=1000)
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=echo):
+            await client.stack.start()
+            first = await client.stack.append(url="/json/first")
+            await first
+            second = await client.stack.append(url="/json/second")
+            # the worker waits for the rate limit with the command taken
+            await asyncio.sleep(0.01)
+            self.assertEqual(client.stack.get_queue_depth(PRIORITY_NORMAL), 0)
+            await client.stack.stop()
+        self.assertTrue(second.cancelled())
+
+
+class TestCommandStackDeadlines(aiounittest.AsyncTestCase):
+    async def test_cancelled_caller_removes_command(self):
+        client = get_testclient(stack_delay=0)
+        future = await client.stack.append(url="/json/hello")
+        other = await client.stack.append(url="/json/other")
+        future.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(len(client.stack), 1)
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_NORMAL), 1)
+        self.assertEqual(client.stack.discarded, 1)
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            await client.stack.start()
+            self.assertEqual(await other, "/json/other")
+            await client.stack.join()
+            await client.stack.stop()
+        mock_request.assert_called_once_with(url="/json/other", deadline=None)
+
+    async def test_merged_caller_keeps_command(self):
+        client = get_testclient(stack_delay=0)
+        first = await client.stack.append(url="/json/hello")
+        second = await client.stack.append(url="/json/hello")
+        first.cancel()
+        await asyncio.sleep(0)
+        self.assertEqual(len(client.stack), 1)
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=echo):
+            await client.stack.start()
+            self.assertEqual(await second, "/json/hello")
+            await client.stack.stop()
+
+    async def test_deadline_expires_queued_command(self):
+        client = get_testclient(stack_delay=0)
+        future = await client.stack.append(
+            url="/json/hello", deadline=time.monotonic() + 0.01
+        )
+        with self.assertRaises(asyncio.TimeoutError):
+            await future
+        await asyncio.sleep(0)
+        self.assertEqual(len(client.stack), 0)
+        await client.stack.join()
+
+    async def test_deadline_passed_to_request(self):
+        client = get_testclient(stack_delay=0)
+        deadline = time.monotonic() + 10
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            first = await client.stack.append(url="/json/hello", deadline=deadline)
+            second = await client.stack.append(url="/json/hello", deadline=deadline + 1)
+            await client.stack.start()
+            await asyncio.gather(first, second)
+            await client.stack.stop()
+        # the command runs until the latest deadline of its callers
+        mock_request.assert_called_once_with(url="/json/hello", deadline=deadline + 1)
+
+    async def test_cancelled_while_rate_limited_not_merged(self):
+        client = get_testclient(stack_delay=50)
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request", side_effect=echo
+        ) as mock_request:
+            await client.stack.start()
+            # use up the burst token
+            await (await client.stack.append(url="/json/first"))
+            future = await client.stack.append(url="/json/hello")
+            await asyncio.sleep(0.01)
+            # the worker waits for the rate limit with the command taken
+            self.assertEqual(client.stack.get_queue_depth(PRIORITY_NORMAL), 0)
+            future.cancel()
+            # the worker skips the cancelled command
+            await asyncio.sleep(0.06)
+
+            again = await client.stack.append(url="/json/hello")
+            self.assertEqual(await asyncio.wait_for(again, timeout=1), "/json/hello")
+            await client.stack.stop()
+        self.assertEqual(client.stack.merged, 0)
+        self.assertEqual(mock_request.call_count, 2)
+
+
+class TestCommandStackCoalescing(aiounittest.AsyncTestCase):
+    async def test_identical_urls_merged(self):
+        client = get_testclient(stack_delay=0)
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            first = await client.stack.append(url="/json/zone/callScene?id=1")
+            second = await client.stack.append(url="/json/zone/callScene?id=1")
+            self.assertEqual(len(client.stack), 1)
+            await client.stack.start()
+            self.assertEqual(await first, "/json/zone/callScene?id=1")
+            self.assertEqual(await second, "/json/zone/callScene?id=1")
+            await client.stack.stop()
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(client.stack.merged, 1)
+
+    async def test_in_flight_url_not_merged(self):
+        client = get_testclient(stack_delay=0)
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            await client.stack.start()
+            await (await client.stack.append(url="/json/hello"))
+            await (await client.stack.append(url="/json/hello"))
+            await client.stack.stop()
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(client.stack.merged, 0)
+
+    async def test_last_write_wins(self):
+        client = get_testclient(stack_delay=0, stack_coalesce=True)
+        standby = "/json/zone/callScene?id=1&sceneNumber=67&groupID=1&force=true"
+        present = "/json/zone/callScene?id=1&sceneNumber=71&groupID=1&force=true"
+        other = "/json/zone/callScene?id=2&sceneNumber=67&groupID=1&force=true"
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            first = await client.stack.append(url=standby)
+            await client.stack.append(url=other)
+            second = await client.stack.append(url=present)
+            await client.stack.start()
+            self.assertEqual(await first, present)
+            self.assertEqual(await second, present)
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list], [other, present]
+        )
+        self.assertEqual(client.stack.superseded, 1)
+
+    async def test_safety_scene_not_superseded(self):
+        client = get_testclient(stack_delay=0, stack_coalesce=True)
+        panic = "/json/zone/callScene?id=1&sceneNumber=65&force=true"
+        fire = "/json/zone/callScene?id=1&sceneNumber=76&force=true"
+        standby = "/json/zone/callScene?id=1&sceneNumber=67&force=true"
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            alarm = await client.stack.append(url=panic)
+            await client.stack.append(url=fire)
+            await client.stack.append(url=standby)
+            await client.stack.start()
+            self.assertEqual(await alarm, panic)
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list],
+            [panic, fire, standby],
+        )
+        self.assertEqual(client.stack.superseded, 0)
+
+    async def test_higher_lane_not_superseded(self):
+        client = get_testclient(stack_delay=0, stack_coalesce=True)
+        first = "/json/zone/callScene?id=1&sceneNumber=5&force=true"
+        second = "/json/zone/callScene?id=1&sceneNumber=0&force=true"
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            urgent = await client.stack.append(url=first, priority=PRIORITY_HIGH)
+            await client.stack.append(url=second, priority=PRIORITY_LOW)
+            await client.stack.start()
+            self.assertEqual(await urgent, first)
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(client.stack.superseded, 0)
+
+    async def test_last_write_wins_disabled(self):
+        client = get_testclient(stack_delay=0)
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=1")
+            await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=2")
+            await client.stack.start()
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(mock_request.call_count, 2)
+
+    async def test_not_merged_across_other_calls(self):
+        client = get_testclient(stack_delay=0)
+        standby = "/json/zone/callScene?id=1&sceneNumber=67&force=true"
+        present = "/json/zone/callScene?id=1&sceneNumber=71&force=true"
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            await client.stack.append(url=standby)
+            await client.stack.append(url=present)
+            last = await client.stack.append(url=standby)
+            await client.stack.append(url=standby)
+            await client.stack.start()
+            self.assertEqual(await last, standby)
+            await client.stack.join()
+            await client.stack.stop()
+        # the zone ends in the scene called last
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list],
+            [standby, present, standby],
+        )
+        self.assertEqual(client.stack.merged, 1)
+
+    async def test_steps_not_merged(self):
+        client = get_testclient(stack_delay=0, stack_coalesce=True)
+        inc = "/json/zone/callScene?id=1&sceneNumber=12&groupID=1&force=true"
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            for _ in range(3):
+                await client.stack.append(url=inc)
+            self.assertEqual(len(client.stack), 3)
+            await client.stack.start()
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(mock_request.call_count, 3)
+        self.assertEqual(client.stack.merged, 0)
+        self.assertEqual(client.stack.superseded, 0)
+
+    async def test_steps_neither_supersede_nor_superseded(self):
+        client = get_testclient(stack_delay=0, stack_coalesce=True)
+        preset = "/json/zone/callScene?id=1&sceneNumber=5&groupID=1&force=true"
+        inc = "/json/zone/callScene?id=1&sceneNumber=12&groupID=1&force=true"
+        dec = "/json/zone/callScene?id=1&sceneNumber=11&groupID=1&force=true"
+        off = "/json/zone/callScene?id=1&sceneNumber=0&groupID=1&force=true"
+
+        with patch(
+            "pydigitalstrom.client.DSClient.request",
+            side_effect=echo,
+        ) as mock_request:
+            for url in (preset, inc, dec, off):
+                await client.stack.append(url=url)
+            await client.stack.start()
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(
+            [c.kwargs["url"] for c in mock_request.call_args_list],
+            [preset, inc, dec, off],
+        )
+        self.assertEqual(client.stack.superseded, 0)
+
+    def test_get_target(self):
+        self.assertEqual(
+            get_testclient().stack.get_target(
+                "/json/zone/callScene?id=3&sceneNumber=5&groupID=1&force=true"
+            ),
+            ("/json/zone/callScene", "3", "1"),
+        )
+        self.assertIsNone(get_testclient().stack.get_target("/json/zone/undoScene"))
+
+
+class TestCommandStackPriorities(aiounittest.AsyncTestCase):
+    async def test_safety_scene_overtakes_backlog(self):
+        client = get_testclient(stack_delay=10)
+        executed = []
+
+        async def request(url, **kwargs):
+            executed.append(url)
+            await asyncio.sleep(0.001)
+            return url
+
+        comfort = "/json/zone/callScene?id={}&sceneNumber=5&force=true"
+        panic = "/json/zone/callScene?id=0&sceneNumber=65&force=true"
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            for zone_id in range(1, 51):
+                await client.stack.append(url=comfort.format(zone_id))
+            await client.stack.start()
+            await asyncio.sleep(0.03)
+            alarm = await client.stack.append(url=panic)
+            await asyncio.wait_for(alarm, timeout=0.05)
+            await client.stack.stop()
+
+        # the alarm skips the rate limited backlog
+        self.assertLess(executed.index(panic), 10)
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_HIGH), 0)
+        self.assertLess(client.stack.max_wait[PRIORITY_HIGH], 0.05)
+
+    async def test_custom_priorities(self):
+        client = get_testclient(stack_delay=0, stack_priorities={5: PRIORITY_HIGH})
+        await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=65")
+        await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=5")
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_HIGH), 1)
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_NORMAL), 1)
+        await client.stack.stop()
+
+    async def test_explicit_priority(self):
+        client = get_testclient()
+        await client.stack.append(url="/json/hello", priority=PRIORITY_LOW)
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_LOW), 1)
+        await client.stack.stop()
+
+    async def test_lower_lanes_do_not_starve(self):
+        client = get_testclient(stack_delay=0)
+        executed = []
+
+        async def request(url, **kwargs):
+            executed.append(url)
+            await asyncio.sleep(0)
+            return url
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            for i in range(40):
+                await client.stack.append(url=f"high{i}", priority=PRIORITY_HIGH)
+                await client.stack.append(url=f"low{i}", priority=PRIORITY_LOW)
+            await client.stack.start()
+            await client.stack.join()
+            await client.stack.stop()
+
+        self.assertTrue(any(url.startswith("low") for url in executed[:20]))
+
+    def test_schedule(self):
+        schedule = get_testclient().stack._schedule
+        self.assertEqual(schedule.count(PRIORITY_HIGH), 8)
+        self.assertEqual(schedule.count(PRIORITY_NORMAL), 4)
+        self.assertEqual(schedule.count(PRIORITY_LOW), 1)
+        self.assertEqual(schedule[:3], [0, 1, 2])
@@ -0,0 +1,164 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+
+import aiounittest
+
+from pydigitalstrom.dispatcher import DSEventDispatcher
+
+
+def get_event(name="callScene", zone_id="1", group_id="1", scene_id="5"):
+    return dict(
+        name=name,
+        properties=dict(zoneID=zone_id, groupID=group_id, sceneID=scene_id),
+    )
+
+
+class TestEventDispatcher(aiounittest.AsyncTestCase):
+    async def test_dispatch(self):
+        dispatcher = DSEventDispatcher()
+        events = []
+
+        async def callback(event):
+            events.append(event)
+
+        dispatcher.register(callback=callback)
+        dispatcher.register(callback=callback)
+        await dispatcher.start()
+        await dispatcher.put(event=get_event())
+        await dispatcher.join()
+        await dispatcher.stop()
+        self.assertEqual(events, [get_event(), get_event()])
+        self.assertEqual(dispatcher.received, 1)
+        self.assertEqual(dispatcher.dispatched, 1)
+
+    async def test_slow_callback_does_not_block_put(self):
+        dispatcher = DSEventDispatcher(callback_timeout=0.01)
+        release = asyncio.Event()
+
+        async def slow(event):
+            await release.wait()
+
+        dispatcher.register(callback=slow)
+        await dispatcher.start()
+        for _ in range(5):
+            await asyncio.wait_for(dispatcher.put(event=get_event()), timeout=0.01)
+        await dispatcher.join()
+        await dispatcher.stop()
+        self.assertEqual(dispatcher.timeouts, 5)
+
+    async def test_concurrent_and_sequential(self):
+        for concurrent, expected in ((True, ["a", "b", "a", "b"]), (False, None)):
+            dispatcher = DSEventDispatcher(concurrent=concurrent)
+            calls = []
+
+            def make_callback(name):
+                async def callback(event):
+                    calls.append(name)
+                    await asyncio.sleep(0)
+                    calls.append(name)
+
+                return callback
+
+            dispatcher.register(callback=make_callback("a"))
+            dispatcher.register(callback=make_callback("b"))
+            await dispatcher.dispatch(event=get_event())
+            self.assertEqual(calls, expected or ["a", "a", "b", "b"])
+
+    async def test_callback_errors_counted(self):
+        dispatcher = DSEventDispatcher()
+
+        async def broken(event):
+            raise ValueError()
+
+        dispatcher.register(callback=broken)
+        await dispatcher.dispatch(event=get_event())
+        self.assertEqual(dispatcher.errors, 1)
+
+    async def test_overflow_drop_oldest(self):
+        dispatcher = DSEventDispatcher(maxsize=2)
+        for scene_id in ("1", "2", "3"):
+            await dispatcher.put(event=get_event(scene_id=scene_id))
+        self.assertEqual(dispatcher.depth, 2)
+        self.assertEqual(dispatcher.dropped, 1)
+        self.assertEqual((await dispatcher._get())["properties"]["sceneID"], "2")
+
+    async def test_overflow_coalesce(self):
+        dispatcher = DSEventDispatcher(maxsize=2, overflow="coalesce")
+        await dispatcher.put(event=get_event(zone_id="1", scene_id="1"))
+        await dispatcher.put(event=get_event(zone_id="2", scene_id="2"))
+        await dispatcher.put(event=get_event(zone_id="1", scene_id="3"))
+        self.assertEqual(dispatcher.depth, 2)
+        self.assertEqual(dispatcher.coalesced, 1)
+        self.assertEqual(dispatcher.dropped, 0)
+        self.assertEqual((await dispatcher._get())["properties"]["sceneID"], "3")
+
+        # no queued event of the same key, fall back to dropping the oldest
+        await dispatcher.put(event=get_event(zone_id="3", scene_id="4"))
+        await dispatcher.put(event=get_event(zone_id="4", scene_id="5"))
+        self.assertEqual(dispatcher.dropped, 1)
+
+    async def test_overflow_block(self):
+        dispatcher = DSEventDispatcher(maxsize=1, overflow="block")
+        await dispatcher.put(event=get_event(scene_id="1"))
+        blocked = asyncio.ensure_future(dispatcher.put(event=get_event(scene_id="2")))
+        await asyncio.sleep(0.01)
+        self.assertFalse(blocked.done())
+        await dispatcher._get()
+        await asyncio.wait_for(blocked, timeout=0.1)
+        self.assertEqual(dispatcher.depth, 1)
+        self.assertEqual(dispatcher.dropped, 0)
+
+    def test_unknown_overflow(self):
+        with self.assertRaises(ValueError):
+            DSEventDispatcher(overflow="whatever")
+
+
+class TestEventRouting(aiounittest.AsyncTestCase):
+    def get_dispatcher(self):
+        dispatcher = DSEventDispatcher()
+        self.callbacks = dict()
+        for name, filters in (
+            ("all", dict()),
+            ("calls", dict(event_name="callScene")),
+            ("kitchen", dict(zone_id=1)),
+            ("kitchen_light", dict(event_name="callScene", zone_id=1, group=1)),
+            ("present", dict(scene_id=71)),
+        ):
+
+            async def callback(event):
+                pass
+
+            callback.__name__ = name
+            self.callbacks[name] = callback
+            dispatcher.register(callback=callback, **filters)
+        return dispatcher
+
+    def route(self, dispatcher, event):
+        return [callback.__name__ for callback in dispatcher.get_callbacks(event)]
+
+    def test_routes(self):
+        dispatcher = self.get_dispatcher()
+        self.assertEqual(
+            self.route(dispatcher, get_event()),
+            ["all", "calls", "kitchen", "kitchen_light"],
+        )
+        self.assertEqual(
+            self.route(dispatcher, get_event(name="undoScene", zone_id="2")),
+            ["all"],
+        )
+        self.assertEqual(
+            self.route(dispatcher, get_event(zone_id="2", scene_id="71")),
+            ["all", "calls", "present"],
+        )
+
+    def test_source_ids(self):
+        dispatcher = self.get_dispatcher()
+        event = dict(name="stateChange", source=dict(zoneID=1, groupID=2))
+        self.assertEqual(self.route(dispatcher, event), ["all", "kitchen"])
+
+    def test_unregister(self):
+        dispatcher = self.get_dispatcher()
+        dispatcher.unregister(callback=self.callbacks["kitchen_light"])
+        dispatcher.unregister(callback=self.callbacks["all"])
+        self.assertEqual(self.route(dispatcher, get_event()), ["calls", "kitchen"])
+        self.assertEqual(len(dispatcher._masks), 3)
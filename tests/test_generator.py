@@ -0,0 +1,73 @@
+# -*- coding: UTF-8 -*-
+import json
+import unittest
+
+from pydigitalstrom.generator import DSApartmentGenerator, query_tree
+from tests.common import get_testclient
+
+
+class TestQueryTree(unittest.TestCase):
+    def test_query(self):
+        tree = DSApartmentGenerator(zones=2, groups=1, scenes=2).build_tree()
+        result = query_tree(tree, "/apartment/zones/*(ZoneID,name)/groups/*(group)")
+        self.assertEqual(
+            result["zone1"],
+            dict(
+                ZoneID=1,
+                name="Dining room 1",
+                group0=dict(group=0),
+                group1=dict(group=1),
+            ),
+        )
+        result = query_tree(tree, "/apartment/zones/zone2/groups/*(*)/scenes/*(*)")
+        self.assertEqual(
+            result["group1"],
+            dict(
+                group=1,
+                name="yellow",
+                color=1,
+                isValid=True,
+                lastCalledScene=17,
+                scene5=dict(scene=5, name="Cleaning"),
+                scene17=dict(scene=17, name="Party"),
+            ),
+        )
+        self.assertEqual(query_tree(tree, "/apartment/zones/zone9(*)"), dict())
+
+
+class TestApartmentGenerator(unittest.TestCase):
+    def test_reproducible(self):
+        payload = DSApartmentGenerator(zones=20, seed=1).get_payload()
+        self.assertEqual(DSApartmentGenerator(zones=20, seed=1).get_payload(), payload)
+        self.assertNotEqual(
+            DSApartmentGenerator(zones=20, seed=2).get_payload(), payload
+        )
+
+    def test_parse(self):
+        generator = DSApartmentGenerator(zones=30, groups=4, scenes=5)
+        data = json.loads(generator.get_payload())
+        self.assertTrue(data["ok"])
+        self.assertEqual(len(data["result"]), 31)
+
+        client = get_testclient()
+        zones, named_scenes = client._parse_structure(result=data["result"])
+        self.assertEqual(len(zones), 31)
+        self.assertEqual(len(named_scenes), generator.scene_count)
+        self.assertEqual(generator.scene_count, 30 * 4 * 5)
+        self.assertEqual({color for _, color, _, _ in named_scenes}, {1, 2, 3, 4})
+
+    def test_limits(self):
+        generator = DSApartmentGenerator(zones=1, groups=20, scenes=20)
+        self.assertEqual(generator.scene_count, 9 * 13)
+
+    def test_events(self):
+        generator = DSApartmentGenerator(zones=5, groups=2, scenes=3)
+        events = generator.get_events(count=8, names=("callScene", "undoScene"))
+        self.assertEqual(
+            events, generator.get_events(count=8, names=("callScene", "undoScene"))
+        )
+        self.assertEqual([e["name"] for e in events[:2]], ["callScene", "undoScene"])
+        for event in events:
+            self.assertIn(int(event["properties"]["zoneID"]), range(1, 6))
+            self.assertIn(event["source"]["groupID"], (1, 2))
+            self.assertIn(event["properties"]["sceneID"], ("5", "17", "18"))
@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+import aiounittest
+
+from pydigitalstrom.constants import PRIORITY_HIGH, PRIORITY_NORMAL
+from pydigitalstrom.journal import DSCommandJournal
+from tests.common import get_testclient
+
+
+class TestCommandJournal(aiounittest.AsyncTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "journal")
+
+    async def test_replay_unacknowledged(self):
+        journal = DSCommandJournal(path=self.path)
+        first = journal.write(url="/json/zone/callScene?id=1&sceneNumber=5", lane=1)
+        journal.write(url="/json/zone/callScene?id=2&sceneNumber=5", lane=0)
+        journal.acknowledge(first)
+        journal.acknowledge(first)
+        await journal.close()
+        # all records of the batch were written with a single flush
+        self.assertEqual(journal.flushes, 1)
+
+        records = await DSCommandJournal(path=self.path).load()
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].id, first + 1)
+        self.assertEqual(records[0].lane, 0)
+        self.assertEqual(records[0].url, "/json/zone/callScene?id=2&sceneNumber=5")
+
+    async def test_flush_batches(self):
+        journal = DSCommandJournal(path=self.path, flush_interval=0.01)
+        for i in range(100):
+            journal.write(url=f"/json/zone/callScene?id={i}&sceneNumber=5", lane=1)
+        await asyncio.sleep(0.05)
+        self.assertEqual(journal.flushes, 1)
+        with open(self.path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 100)
+        await journal.close()
+
+    async def test_torn_and_expired_records(self):
+        now = time.time()
+        with open(self.path, "wb") as f:
+            f.write(b"A 1 %.3f 1 /json/old\n" % (now - 600))
+            f.write(b"A 2 %.3f 1 /json/new\n" % now)
+            f.write(b"A 3 garbage\n")
+            f.write(b"A 4 %.3f 1 /json/torn" % now)
+
+        journal = DSCommandJournal(path=self.path, ttl=300)
+        records = await journal.load()
+        self.assertEqual([record.url for record in records], ["/json/new"])
+        # the journal is compacted after loading and ids continue
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"A 2 %.3f 1 /json/new\n" % now)
+        self.assertGreater(journal.write(url="/json/next", lane=1), 2)
+        await journal.close()
+
+    async def test_compaction(self):
+        journal = DSCommandJournal(path=self.path, compact_after=10)
+        ids = [journal.write(url=f"/json/{i}", lane=1) for i in range(15)]
+        for id in ids[:10]:
+            journal.acknowledge(id)
+        await journal.flush()
+        self.assertEqual(journal.compactions, 1)
+        with open(self.path, "rb") as f:
+            self.assertEqual(len(f.readlines()), 5)
+        self.assertEqual(len(journal), 5)
+        await journal.close()
+
+
+class TestCommandStackJournal(aiounittest.AsyncTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "journal")
+
+    async def test_replay_after_stop(self):
+        client = get_testclient(stack_journal=DSCommandJournal(path=self.path))
+        # queued but never started, e.g. the process stopped before
+        future = await client.stack.append(
+            url="/json/zone/callScene?id=1&sceneNumber=5"
+        )
+        await client.stack.append(url="/json/zone/callScene?id=2&sceneNumber=0")
+        future.cancel()
+        await asyncio.sleep(0)
+        await client.stack.stop()
+
+        urls = []
+
+        async def request(url, **kwargs):
+            urls.append(url)
+            return dict(ok=True)
+
+        client = get_testclient(
+            stack_delay=0, stack_journal=DSCommandJournal(path=self.path)
+        )
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.stack.start()
+            await client.stack.join()
+            await client.stack.stop()
+        self.assertEqual(urls, ["/json/zone/callScene?id=2&sceneNumber=0"])
+        self.assertEqual(client.stack.replayed, 1)
+
+        # sent commands are not replayed again
+        journal = DSCommandJournal(path=self.path)
+        self.assertEqual(await journal.load(), [])
+
+    async def test_replay_keeps_lane_and_merges(self):
+        journal = DSCommandJournal(path=self.path)
+        journal.write(url="/json/zone/callScene?id=1&sceneNumber=5", lane=PRIORITY_HIGH)
+        await journal.close()
+
+        client = get_testclient(stack_journal=DSCommandJournal(path=self.path))
+        await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=5")
+        await client.stack.replay()
+        self.assertEqual(client.stack.merged, 1)
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_NORMAL), 1)
+        self.assertEqual(client.stack.get_queue_depth(PRIORITY_HIGH), 0)
+        self.assertEqual(len(client.stack._journal), 1)
+        await client.stack.stop()
+
+    async def test_superseded_commands_acknowledged(self):
+        client = get_testclient(
+            stack_coalesce=True, stack_journal=DSCommandJournal(path=self.path)
+        )
+        await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=5")
+        await client.stack.append(url="/json/zone/callScene?id=1&sceneNumber=17")
+        self.assertEqual(len(client.stack._journal), 1)
+        await client.stack.stop()
+
+        records = await DSCommandJournal(path=self.path).load()
+        self.assertEqual(
+            [record.url for record in records],
+            ["/json/zone/callScene?id=1&sceneNumber=17"],
+        )
@@ -0,0 +1,32 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+from pydigitalstrom.jsoncodec import DSJsonCodec
+
+
+class TestJsonCodec(unittest.TestCase):
+    def test_backends(self):
+        for backend in DSJsonCodec.BACKENDS:
+            if not DSJsonCodec.available(backend):
+                continue
+            codec = DSJsonCodec(backend=backend)
+            self.assertEqual(codec.backend, backend)
+            self.assertEqual(
+                codec.loads(b'{"ok": true, "result": {"name": "K\xc3\xbcche"}}'),
+                dict(ok=True, result=dict(name="Küche")),
+            )
+            self.assertEqual(codec.loads('{"ok": false}'), dict(ok=False))
+            with self.assertRaises(codec.DecodeError):
+                codec.loads(b"invalid")
+
+    def test_default(self):
+        codec = DSJsonCodec()
+        self.assertTrue(DSJsonCodec.available(codec.backend))
+        self.assertEqual(
+            codec.backend,
+            next(name for name in DSJsonCodec.BACKENDS if codec.available(name)),
+        )
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            DSJsonCodec(backend="simplejson")
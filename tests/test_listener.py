@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+
+import aiounittest
+from unittest.mock import patch
+
+from pydigitalstrom.backoff import DSBackoff
+from pydigitalstrom.exceptions import DSCommandFailedException
+from pydigitalstrom.listener import DSEventListener
+from tests.common import get_testclient
+
+
+class FakeServer:
+    def __init__(self, batches):
+        self.batches = list(batches)
+        self.urls = []
+
+    async def request(self, url, **kwargs):
+        self.urls.append(url)
+        if not url.startswith("/json/event/get"):
+            return dict(ok=True)
+        if not self.batches:
+            await asyncio.sleep(10)
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        return dict(ok=True, result=dict(events=batch))
+
+
+class TestEventListener(aiounittest.AsyncTestCase):
+    def get_listener(self, client, **kwargs):
+        return DSEventListener(
+            client=client,
+            event_id=7,
+            event_name="callScene",
+            timeout=1,
+            backoff=DSBackoff(base=0.001, maximum=0.001),
+            **kwargs,
+        )
+
+    async def test_poll_and_route(self):
+        client = get_testclient()
+        server = FakeServer(
+            [
+                [
+                    dict(name="callScene", properties=dict(zoneID="1")),
+                    dict(name="callScene", properties=dict(zoneID="2")),
+                ],
+                [dict(name="undoScene", properties=dict(zoneID="1"))],
+            ]
+        )
+        listener = self.get_listener(client, event_names=["undoScene"])
+        events = []
+        kitchen = []
+
+        async def callback(event):
+            events.append(event["name"])
+
+        async def kitchen_callback(event):
+            kitchen.append(event["name"])
+
+        listener.register(callback=callback)
+        listener.register(callback=kitchen_callback, zone_id=1)
+        with patch("pydigitalstrom.client.DSClient.request", new=server.request):
+            await listener.start()
+            await asyncio.sleep(0.02)
+            await listener.dispatcher.join()
+            await listener.stop()
+
+        self.assertEqual(events, ["callScene", "callScene", "undoScene"])
+        self.assertEqual(kitchen, ["callScene", "undoScene"])
+        self.assertEqual(
+            server.urls[:3],
+            [
+                "/json/event/subscribe?name=callScene&subscriptionID=7",
+                "/json/event/subscribe?name=undoScene&subscriptionID=7",
+                "/json/event/get?subscriptionID=7&timeout=1000",
+            ],
+        )
+        self.assertEqual(
+            server.urls[-2:],
+            [
+                "/json/event/unsubscribe?name=callScene&subscriptionID=7",
+                "/json/event/unsubscribe?name=undoScene&subscriptionID=7",
+            ],
+        )
+
+    async def test_resubscribe_after_error(self):
+        client = get_testclient()
+        server = FakeServer(
+            [DSCommandFailedException("invalid subscription"), [dict(name="callScene")]]
+        )
+        listener = self.get_listener(client)
+        events = []
+
+        async def callback(event):
+            events.append(event)
+
+        listener.register(callback=callback)
+        with patch("pydigitalstrom.client.DSClient.request", new=server.request):
+            await listener.start()
+            await asyncio.sleep(0.02)
+            await listener.stop()
+
+        subscribe = "/json/event/subscribe?name=callScene&subscriptionID=7"
+        self.assertEqual(server.urls.count(subscribe), 2)
+        self.assertEqual(len(events), 1)
+
+    async def test_resubscribe_after_token_change(self):
+        client = get_testclient()
+        server = FakeServer([[], []])
+        listener = self.get_listener(client)
+        with patch("pydigitalstrom.client.DSClient.request", new=server.request):
+            client.token_manager._token = "first"
+            await listener.poll()
+            client.token_manager._token = "second"
+            await listener.poll()
+        self.assertEqual(listener.resubscribes, 1)
+        self.assertEqual(listener.polls, 2)
@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+import unittest
+from unittest.mock import patch
+
+import aiounittest
+
+from pydigitalstrom import metering
+from pydigitalstrom.exceptions import DSRequestException
+from pydigitalstrom.metering import (
+    DSMeteringPoller,
+    DSRingBuffer,
+    aggregate,
+    downsample,
+)
+from tests.common import get_testclient
+
+
+class TestRingBuffer(unittest.TestCase):
+    def test_wrap_around(self):
+        buffer = DSRingBuffer(capacity=3)
+        self.assertIsNone(buffer.last_timestamp)
+        buffer.extend([(1, 10), (2, 20)])
+        self.assertEqual(list(buffer.get_samples()[1]), [10, 20])
+        buffer.extend([(3, 30), (4, 40)])
+        self.assertEqual(len(buffer), 3)
+        self.assertEqual(buffer.last_timestamp, 4)
+        timestamps, values = buffer.get_samples()
+        self.assertEqual(list(timestamps), [2, 3, 4])
+        self.assertEqual(list(values), [20, 30, 40])
+
+    def test_window(self):
+        buffer = DSRingBuffer(capacity=4)
+        buffer.extend((t, t * 10) for t in range(6))
+        for numpy in (metering.numpy, None):
+            with patch.object(metering, "numpy", numpy):
+                timestamps, values = buffer.window(start=3, end=5)
+                self.assertEqual(list(timestamps), [3, 4])
+                self.assertEqual(list(values), [30, 40])
+
+    @unittest.skipIf(metering.numpy is None, "numpy not installed")
+    def test_numpy_views(self):
+        buffer = DSRingBuffer(capacity=4, typecode="f")
+        buffer.extend([(1, 1.5), (2, 2.5)])
+        timestamps, values = buffer.as_numpy()
+        buffer.values[0] = 9
+        # not wrapped yet, the arrays share memory with the buffer
+        self.assertEqual(values.tolist(), [9, 2.5])
+        self.assertEqual(timestamps.dtype, metering.numpy.float64)
+        buffer.extend([(3, 3), (4, 4), (5, 5)])
+        self.assertEqual(buffer.as_numpy()[0].tolist(), [2, 3, 4, 5])
+
+
+class TestAggregation(unittest.TestCase):
+    SAMPLES = ([0, 1, 59, 60, 61, 180], [1, 2, 3, 4, 6, 8])
+
+    def test_downsample(self):
+        expected = dict(
+            mean=[2, 5, 8],
+            sum=[6, 10, 8],
+            min=[1, 4, 8],
+            max=[3, 6, 8],
+            first=[1, 4, 8],
+            last=[3, 6, 8],
+            count=[3, 2, 1],
+        )
+        for numpy in (metering.numpy, None):
+            with patch.object(metering, "numpy", numpy):
+                for how, values in expected.items():
+                    buckets, result = downsample(*self.SAMPLES, interval=60, how=how)
+                    self.assertEqual(list(buckets), [0, 60, 180])
+                    self.assertEqual(list(result), values, how)
+                self.assertEqual(len(downsample([], [], interval=60)[0]), 0)
+        with self.assertRaises(ValueError):
+            downsample(*self.SAMPLES, interval=60, how="median")
+
+    def test_aggregate(self):
+        for numpy in (metering.numpy, None):
+            with patch.object(metering, "numpy", numpy):
+                self.assertEqual(aggregate([1, 2, 6]), 3)
+                self.assertEqual(aggregate([1, 2, 6], how="max"), 6)
+                self.assertEqual(aggregate([1, 2, 6], how="last"), 6)
+                self.assertIsNone(aggregate([], how="min"))
+                self.assertEqual(aggregate([], how="count"), 0)
+
+
+class TestMeteringPoller(aiounittest.AsyncTestCase):
+    def get_poller(self, responses: dict, **kwargs):
+        client = get_testclient()
+        self.urls = []
+
+        async def request(url, **kwargs):
+            self.urls.append(url)
+            response = responses[url.split("?")[0].rsplit("/", 1)[1]]
+            if isinstance(response, Exception):
+                raise response
+            return response(url) if callable(response) else response
+
+        self.patcher = patch.object(client, "request", side_effect=request)
+        self.patcher.start()
+        self.addCleanup(self.patcher.stop)
+        return DSMeteringPoller(client=client, **kwargs)
+
+    @staticmethod
+    def latest(*values):
+        return dict(
+            ok=True,
+            result=dict(
+                values=[
+                    dict(dSUID=f"meter{i}", value=value, date="2020-01-01 00:00:00")
+                    for i, value in enumerate(values)
+                ]
+            ),
+        )
+
+    async def test_poll(self):
+        poller = self.get_poller(
+            dict(getLatest=self.latest(100, 50)),
+            interval=2,
+            types=("consumption", "energy"),
+        )
+        await poller.poll(timestamp=101.3)
+        await poller.poll(timestamp=103.9)
+        self.assertEqual(poller.get_meters(), ["meter0", "meter1"])
+        timestamps, values = poller.get_series("meter1").get_samples()
+        # aligned to the ticks of the interval
+        self.assertEqual(list(timestamps), [100, 102])
+        self.assertEqual(list(values), [50, 50])
+        self.assertEqual(len(poller.get_series("meter0", type="energy")), 2)
+        self.assertEqual(
+            self.urls[:2],
+            [
+                "/json/metering/getLatest?from=.meters(all)&type=consumption",
+                "/json/metering/getLatest?from=.meters(all)&type=energy",
+            ],
+        )
+
+        timestamps, values = poller.get_total()
+        self.assertEqual(list(timestamps), [100, 102])
+        self.assertEqual(list(values), [150, 150])
+        self.assertEqual(
+            poller.get_stats(), dict(series=4, samples=8, bytes=4 * 16 * 86400)
+        )
+
+    async def test_gap(self):
+        def values(url):
+            self.assertIn("dsuid=meter0&type=consumption&resolution=1", url)
+            self.assertIn("valueCount=4", url)
+            return dict(
+                ok=True, result=dict(values=[[12, 2], [11, 1], [13, 3], [14, 4]])
+            )
+
+        poller = self.get_poller(
+            dict(getLatest=self.latest(5), getValues=values), interval=1
+        )
+        await poller.poll(timestamp=10)
+        await poller.poll(timestamp=14)
+        timestamps, values = poller.get_series("meter0").get_samples()
+        self.assertEqual(list(timestamps), [10, 11, 12, 13, 14])
+        self.assertEqual(list(values), [5, 1, 2, 3, 5])
+        self.assertEqual(poller.backfilled, 3)
+
+    async def test_backfill(self):
+        history = dict(ok=True, result=dict(values=[[7, 1], [8, 2], [9, 3], [10, 4]]))
+        poller = self.get_poller(
+            dict(getLatest=self.latest(5), getValues=history), capacity=3
+        )
+        await poller.poll(timestamp=10)
+        await poller.backfill()
+        self.assertIn("valueCount=3", self.urls[-1])
+        timestamps, values = poller.get_series("meter0").get_samples()
+        self.assertEqual(list(timestamps), [8, 9, 10])
+        self.assertEqual(list(values), [2, 3, 5])
+
+    async def test_failures(self):
+        poller = self.get_poller(
+            dict(
+                getLatest=DSRequestException("request failed"), getValues=dict(ok=True)
+            )
+        )
+        await poller.poll(timestamp=1)
+        self.assertEqual(poller.failures, 1)
+        self.assertEqual(poller.get_meters(), [])
+
+    async def test_downsample(self):
+        poller = self.get_poller(dict(getLatest=self.latest(100, 50)))
+        for timestamp in range(120):
+            await poller.poll(timestamp=timestamp)
+        timestamps, values = poller.downsample(interval=60, how="sum")
+        self.assertEqual(list(timestamps), [0, 60])
+        self.assertEqual(list(values), [60 * 150, 60 * 150])
+        timestamps, values = poller.downsample(meter="meter1", interval=60, start=30)
+        self.assertEqual(list(values), [50, 50])
@@ -0,0 +1,209 @@
+# -*- coding: UTF-8 -*-
+import unittest
+
+import aiounittest
+from aioresponses import aioresponses
+from unittest.mock import patch
+
+from pydigitalstrom.exceptions import DSCommandFailedException, DSRequestException
+from pydigitalstrom.metrics import (
+    DSHistogram,
+    DSMemoryMetrics,
+    DSMetrics,
+    DSOpenTelemetryMetrics,
+    DSPrometheusMetrics,
+    get_url_template,
+)
+from pydigitalstrom.retry import DSRetryPolicy
+from tests.common import get_testclient
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+try:
+    from opentelemetry.sdk.metrics import MeterProvider
+    from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+except ImportError:  # pragma: no cover
+    MeterProvider = None
+
+
+class TestHistogram(unittest.TestCase):
+    def test_quantiles(self):
+        histogram = DSHistogram(buckets=(1, 2, 4, 8))
+        for value in range(1, 101):
+            histogram.observe(value / 10)
+        self.assertEqual(histogram.count, 100)
+        self.assertAlmostEqual(histogram.mean, 5.05)
+        self.assertEqual(histogram.min, 0.1)
+        self.assertEqual(histogram.max, 10)
+        self.assertTrue(4 <= histogram.quantile(0.5) <= 8)
+        self.assertTrue(8 <= histogram.quantile(0.99) <= 10)
+        self.assertIsNone(DSHistogram().quantile(0.5))
+
+    def test_url_template(self):
+        self.assertEqual(
+            get_url_template("/json/zone/callScene?id=1&sceneNumber=5"),
+            "/json/zone/callScene",
+        )
+
+
+class TestMemoryMetrics(unittest.TestCase):
+    def test_labels(self):
+        metrics = DSMemoryMetrics()
+        metrics.increment("events", event="callScene")
+        metrics.increment("events", event="callScene")
+        metrics.increment("events", event="undoScene")
+        metrics.set("queue_depth", 3, lane=1)
+        metrics.observe("request_duration", 0.1, endpoint="/json/a", error="")
+        self.assertEqual(metrics.get_counter("events", event="callScene"), 2)
+        self.assertEqual(metrics.get_counter("events"), 3)
+        self.assertEqual(metrics.get_gauge("queue_depth", lane=1), 3)
+        self.assertEqual(
+            metrics.get_histogram(
+                "request_duration", error="", endpoint="/json/a"
+            ).count,
+            1,
+        )
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counters"]["events"]["event=undoScene"], 1)
+
+
+class TestClientMetrics(aiounittest.AsyncTestCase):
+    async def test_request_metrics(self):
+        metrics = DSMemoryMetrics()
+        client = get_testclient(metrics=metrics, retry_policy=DSRetryPolicy(attempts=1))
+        with aioresponses() as mock_get:
+            mock_get.get(url="https://dss.local:8080/json/hello", payload=dict(ok=True))
+            mock_get.get(
+                url="https://dss.local:8080/json/hello", payload=dict(ok=False)
+            )
+            mock_get.get(url="https://dss.local:8080/json/hello", status=500)
+            await client.raw_request(url="/json/hello")
+            with self.assertRaises(DSCommandFailedException):
+                await client.raw_request(url="/json/hello")
+            with self.assertRaises(DSRequestException):
+                await client.raw_request(url="/json/hello")
+        await client.close()
+
+        self.assertEqual(
+            metrics.get_histogram(
+                DSMetrics.REQUEST_DURATION, endpoint="/json/hello", error=""
+            ).count,
+            1,
+        )
+        for error in ("DSCommandFailedException", "DSRequestException"):
+            self.assertEqual(
+                metrics.get_counter(
+                    DSMetrics.REQUEST_ERRORS, endpoint="/json/hello", error=error
+                ),
+                1,
+            )
+
+    async def test_command_metrics(self):
+        metrics = DSMemoryMetrics()
+        client = get_testclient(metrics=metrics, stack_delay=0)
+
+        async def request(url, **kwargs):
+            return url
+
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            futures = [
+                await client.stack.append(url=f"/json/zone/callScene?id={i}")
+                for i in range(3)
+            ]
+            self.assertEqual(metrics.get_gauge(DSMetrics.QUEUE_DEPTH, lane=1), 3)
+            await client.stack.start()
+            await client.stack.join()
+            await client.stack.stop()
+        for future in futures:
+            await future
+
+        labels = dict(lane=1, endpoint="/json/zone/callScene")
+        self.assertEqual(
+            metrics.get_histogram(DSMetrics.COMMAND_WAIT, **labels).count, 3
+        )
+        self.assertEqual(
+            metrics.get_histogram(DSMetrics.COMMAND_SERVICE, **labels).count, 3
+        )
+        self.assertEqual(metrics.get_gauge(DSMetrics.QUEUE_DEPTH, lane=1), 0)
+
+    async def test_retry_metrics(self):
+        metrics = DSMemoryMetrics()
+        client = get_testclient(metrics=metrics)
+        with aioresponses() as mock_get:
+            mock_get.get(
+                url="https://dss.local:8080/json/system/loginApplication?loginToken="
+                "token",
+                payload=dict(ok=True, result=dict(token="session")),
+                repeat=True,
+            )
+            mock_get.get(
+                url="https://dss.local:8080/json/hello?token=session",
+                payload=dict(ok=False, message="not logged in"),
+            )
+            mock_get.get(
+                url="https://dss.local:8080/json/hello?token=session",
+                payload=dict(ok=True),
+            )
+            await client.request(url="/json/hello")
+        await client.close()
+        self.assertEqual(
+            metrics.get_counter(
+                DSMetrics.REQUEST_RETRIES, endpoint="/json/hello", reason="unauthorized"
+            ),
+            1,
+        )
+        self.assertEqual(metrics.get_counter(DSMetrics.TOKEN_REFRESHES), 2)
+
+
+@unittest.skipIf(prometheus_client is None, "prometheus_client is not installed")
+class TestPrometheusMetrics(unittest.TestCase):
+    def test_export(self):
+        registry = prometheus_client.CollectorRegistry()
+        metrics = DSPrometheusMetrics(registry=registry)
+        metrics.observe("request_duration", 0.2, endpoint="/json/a", error="")
+        metrics.increment("events", event="callScene")
+        metrics.set("queue_depth", 2, lane=1)
+        self.assertEqual(
+            registry.get_sample_value(
+                "pydigitalstrom_request_duration_count",
+                dict(endpoint="/json/a", error=""),
+            ),
+            1,
+        )
+        self.assertEqual(
+            registry.get_sample_value(
+                "pydigitalstrom_events_total", dict(event="callScene")
+            ),
+            1,
+        )
+        self.assertEqual(
+            registry.get_sample_value("pydigitalstrom_queue_depth", dict(lane="1")), 2
+        )
+
+
+@unittest.skipIf(MeterProvider is None, "opentelemetry-sdk is not installed")
+class TestOpenTelemetryMetrics(unittest.TestCase):
+    def test_export(self):
+        reader = InMemoryMetricReader()
+        meter = MeterProvider(metric_readers=[reader]).get_meter("test")
+        metrics = DSOpenTelemetryMetrics(meter=meter)
+        metrics.observe("request_duration", 0.2, endpoint="/json/a", error="")
+        metrics.increment("events", event="callScene")
+        metrics.set("queue_depth", 2, lane=1)
+        metrics.set("queue_depth", 1, lane=1)
+        with metrics.span("request", endpoint="/json/a"):
+            pass
+
+        data = reader.get_metrics_data()
+        points = {
+            metric.name: metric.data.data_points[0]
+            for resource in data.resource_metrics
+            for scope in resource.scope_metrics
+            for metric in scope.metrics
+        }
+        self.assertEqual(points["pydigitalstrom.request_duration"].count, 1)
+        self.assertEqual(points["pydigitalstrom.events"].value, 1)
+        self.assertEqual(points["pydigitalstrom.queue_depth"].value, 1)
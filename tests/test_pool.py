@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import copy
+
+import aiounittest
+from unittest.mock import patch
+
+from pydigitalstrom.exceptions import DSRequestException
+from pydigitalstrom.pool import DSClientPool
+from tests.common import TEST_PORT, TEST_TOKEN, TEST_SCENES
+
+
+class TestClientPool(aiounittest.AsyncTestCase):
+    async def get_pool(self, count: int, **kwargs) -> DSClientPool:
+        pool = DSClientPool(**kwargs)
+        for i in range(count):
+            await pool.add(
+                name=f"site{i}",
+                host=f"dss{i}.local",
+                port=TEST_PORT,
+                apptoken=TEST_TOKEN,
+                apartment_name=f"Apartment {i}",
+            )
+        return pool
+
+    async def test_shared_session(self):
+        pool = await self.get_pool(count=3, limit_per_host=2)
+        session = await pool.get_session()
+        self.assertEqual(session.connector.limit_per_host, 2)
+        for name in pool:
+            self.assertIs(await pool.get(name).get_session(), session)
+
+        # closing one client keeps the shared session open
+        await pool.remove(name="site0")
+        self.assertFalse(session.closed)
+        self.assertEqual(len(pool), 2)
+
+        await pool.close()
+        self.assertTrue(session.closed)
+        self.assertEqual(len(pool), 0)
+
+    async def test_duplicate_name(self):
+        pool = await self.get_pool(count=1)
+        with self.assertRaises(ValueError):
+            await pool.add(
+                name="site0", host="x", port=1, apptoken="t", apartment_name="a"
+            )
+        await pool.close()
+
+    async def test_initialize_bounded(self):
+        pool = await self.get_pool(count=10, init_concurrency=3)
+        running = []
+        peak = []
+
+        async def request(self, url, **kwargs):
+            running.append(self)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(self)
+            if self.host == "dss4.local":
+                raise DSRequestException("request failed")
+            return copy.deepcopy(TEST_SCENES)
+
+        with patch("pydigitalstrom.client.DSClient.request", new=request):
+            await pool.initialize()
+
+        self.assertEqual(max(peak), 3)
+        health = pool.health()
+        self.assertEqual(health["states"], dict(ready=9, failed=1))
+        self.assertFalse(health["healthy"])
+        self.assertIsInstance(health["clients"]["site4"]["error"], DSRequestException)
+        self.assertEqual(len(pool.get("site0").get_scenes()), 69)
+        await pool.close()
+
+    async def test_health_new(self):
+        pool = await self.get_pool(count=2)
+        await pool.get("site1").stack.append(url="/json/hello")
+        health = pool.health()
+        self.assertEqual(health["states"], dict(new=2))
+        self.assertEqual(health["clients"]["site1"]["circuit"], "closed")
+        self.assertEqual(health["queued"], 1)
+        self.assertTrue(health["healthy"])
+        await pool.close()
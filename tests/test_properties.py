@@ -0,0 +1,176 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import aiounittest
+
+from pydigitalstrom.exceptions import DSCommandFailedException
+from pydigitalstrom.generator import DSApartmentGenerator, query_tree
+from pydigitalstrom.properties import (
+    DSPropertyReader,
+    extract_result,
+    format_query,
+    merge_queries,
+    parse_query,
+)
+from pydigitalstrom.simulator import DSSimulator
+from tests.common import get_testclient
+
+ZONE_NAMES = "/apartment/zones/*(ZoneID,name)"
+LAST_CALLED = "/apartment/zones/*(ZoneID)/groups/*(group,lastCalledScene)"
+SCENES = "/apartment/zones/*(*)/groups/*(*)/scenes/*(*)"
+ZONE2 = "/apartment/zones/zone2/groups/*(lastCalledScene)"
+
+
+class TestQueries(unittest.TestCase):
+    def test_parse_and_format(self):
+        segments = parse_query(" /apartment/zones/*(ZoneID, name,ZoneID)/groups ")
+        self.assertEqual(
+            segments,
+            (
+                ("apartment", None),
+                ("zones", None),
+                ("*", ("ZoneID", "name")),
+                ("groups", None),
+            ),
+        )
+        self.assertEqual(
+            format_query(segments), "/apartment/zones/*(ZoneID,name)/groups"
+        )
+        with self.assertRaises(ValueError):
+            parse_query("/apartment/(name)")
+
+    def test_merge(self):
+        queries = [
+            parse_query(path) for path in (ZONE_NAMES, LAST_CALLED, SCENES, ZONE2)
+        ]
+        groups = merge_queries(queries)
+        self.assertEqual(len(groups), 2)
+        self.assertEqual(
+            format_query(groups[0][0]),
+            "/apartment/zones/*(ZoneID,name,*)/groups/*(group,lastCalledScene,*)"
+            "/scenes/*(*)",
+        )
+        self.assertEqual(groups[0][1], queries[:3])
+        self.assertEqual(groups[1], (queries[3], [queries[3]]))
+
+    def test_extract(self):
+        # every query gets exactly what it would have got on its own
+        tree = DSApartmentGenerator(zones=5, groups=2, scenes=2).build_tree()
+        paths = (ZONE_NAMES, LAST_CALLED, SCENES, "/apartment/zones/*(name)")
+        merged, members = merge_queries([parse_query(path) for path in paths])[0]
+        result = query_tree(tree, format_query(merged))
+        for path, segments in zip(paths, members):
+            self.assertEqual(
+                extract_result(result=result, segments=segments),
+                query_tree(tree, path),
+            )
+
+
+class TestPropertyReader(aiounittest.AsyncTestCase):
+    async def test_batching(self):
+        async with DSSimulator(zones=3, groups=2, scenes=2) as simulator:
+            client = simulator.get_client()
+            zones, last_called, zone2 = await asyncio.gather(
+                client.properties.get(ZONE_NAMES),
+                client.properties.get(LAST_CALLED),
+                client.properties.get(ZONE2),
+            )
+            self.assertEqual(zones["zone2"], dict(ZoneID=2, name="Basement 2"))
+            self.assertEqual(last_called["zone2"]["group1"]["lastCalledScene"], 17)
+            self.assertEqual(zone2["group1"], dict(lastCalledScene=17))
+            # one merged query for all zones and one for zone 2
+            self.assertEqual(client.properties.queries, 2)
+
+            requests = simulator.requests
+            await client.properties.get_many([ZONE_NAMES, LAST_CALLED])
+            self.assertEqual(simulator.requests, requests)
+            self.assertEqual(client.properties.hits, 2)
+            await client.close()
+
+    async def test_shared_query(self):
+        client = get_testclient()
+        calls = []
+
+        async def request(url, **kwargs):
+            calls.append(url)
+            await asyncio.sleep(0.01)
+            return dict(ok=True, result=dict(zone1=dict(ZoneID=1, name="Kitchen")))
+
+        with patch.object(client, "request", side_effect=request):
+            first = asyncio.ensure_future(client.properties.get(ZONE_NAMES))
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(client.properties.get(ZONE_NAMES))
+            await asyncio.sleep(0)
+            # a cancelled caller doesn't cancel the query of the others
+            first.cancel()
+            self.assertEqual(await second, dict(zone1=dict(ZoneID=1, name="Kitchen")))
+        self.assertEqual(
+            calls, ["/json/property/query2?query=/apartment/zones/*(ZoneID,name)"]
+        )
+
+    async def test_ttl(self):
+        now = [0]
+        client = get_testclient()
+        client.properties = DSPropertyReader(
+            client=client,
+            ttl=5,
+            ttls={"/apartment/zones/*/groups": 1},
+            clock=lambda: now[0],
+        )
+
+        async def request(url, **kwargs):
+            return dict(ok=True, result=dict())
+
+        with patch.object(client, "request", side_effect=request) as mock:
+            await client.properties.get(ZONE_NAMES)
+            await client.properties.get(LAST_CALLED)
+            now[0] = 2
+            await client.properties.get(ZONE_NAMES)
+            await client.properties.get(LAST_CALLED)
+            self.assertEqual(mock.call_count, 3)
+            await client.properties.get(ZONE_NAMES, ttl=0)
+            self.assertEqual(mock.call_count, 4)
+
+    async def test_invalidate_on_event(self):
+        async with DSSimulator(zones=3, groups=2, scenes=2) as simulator:
+            client = simulator.get_client()
+            await client.properties.get_many([ZONE_NAMES, ZONE2])
+            self.assertEqual(client.properties.queries, 2)
+
+            # other zones keep their cached results
+            event = dict(name="callScene", properties=dict(zoneID="1", groupID="1"))
+            await client.properties._on_event(event=event)
+            self.assertEqual(client.properties.invalidated, 1)
+            await client.properties.get(ZONE2)
+            self.assertEqual(client.properties.queries, 2)
+
+            await client.request(
+                url="/json/zone/callScene?id=2&groupID=1&sceneNumber=5"
+            )
+            event = dict(name="callScene", properties=dict(zoneID="2", groupID="1"))
+            await client.properties._on_event(event=event)
+            result = await client.properties.get(ZONE2)
+            self.assertEqual(result["group1"], dict(lastCalledScene=5))
+            self.assertEqual(client.properties.queries, 3)
+
+            await client.properties._on_event(event=dict(name="ModelReady"))
+            self.assertEqual(client.properties._cache, dict())
+            await client.close()
+
+    async def test_failure(self):
+        client = get_testclient()
+
+        async def request(url, **kwargs):
+            return dict(ok=True)
+
+        with patch.object(client, "request", side_effect=request):
+            results = await asyncio.gather(
+                client.properties.get(ZONE_NAMES),
+                client.properties.get(LAST_CALLED),
+                return_exceptions=True,
+            )
+        for result in results:
+            self.assertIsInstance(result, DSCommandFailedException)
+        self.assertEqual(client.properties._inflight, dict())
@@ -0,0 +1,42 @@
+# -*- coding: UTF-8 -*-
+import aiounittest
+
+from pydigitalstrom.ratelimit import DSTokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(aiounittest.AsyncTestCase):
+    def test_burst(self):
+        clock = FakeClock()
+        bucket = DSTokenBucket(rate=2, capacity=3, clock=clock)
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    def test_refill(self):
+        clock = FakeClock()
+        bucket = DSTokenBucket(rate=2, capacity=1, clock=clock)
+        self.assertTrue(bucket.try_acquire())
+        clock.now += 0.25
+        self.assertFalse(bucket.try_acquire())
+        clock.now += 0.25
+        self.assertTrue(bucket.try_acquire())
+
+    def test_unlimited(self):
+        bucket = DSTokenBucket(rate=None)
+        for _ in range(100):
+            self.assertTrue(bucket.try_acquire())
+
+    async def test_acquire_waits(self):
+        bucket = DSTokenBucket(rate=100, capacity=1)
+        await bucket.acquire()
+        self.assertFalse(bucket.try_acquire())
+        await bucket.acquire()
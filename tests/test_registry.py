@@ -0,0 +1,72 @@
+# -*- coding: UTF-8 -*-
+import aiounittest
+
+from pydigitalstrom.devices.scene import DSScene, DSColorScene
+from pydigitalstrom.registry import DSSceneRegistry
+from tests.common import get_testclient
+
+
+class TestSceneRegistry(aiounittest.AsyncTestCase):
+    def get_registry(self):
+        registry = DSSceneRegistry(client=get_testclient())
+        registry.add("1_71", 1, "Kitchen", None, 71, "PRESENT")
+        registry.add("2_71", 2, "Living", None, 71, "PRESENT")
+        registry.add("1_1_5", 1, "Kitchen", 1, 5, "Bright")
+        registry.add("2_1_5", 2, "Living", 1, 5, "Reading")
+        registry.add("2_2_5", 2, "Living", 2, 5, "Open")
+        return registry
+
+    @staticmethod
+    def ids(scenes):
+        return sorted(scene.unique_id for scene in scenes)
+
+    def test_lazy_materialization(self):
+        registry = self.get_registry()
+        self.assertEqual(len(registry), 5)
+        self.assertIn("1_1_5", registry)
+        self.assertEqual(registry._objects, dict())
+
+        scene = registry["1_1_5"]
+        self.assertIsInstance(scene, DSColorScene)
+        self.assertEqual(scene.name, "Kitchen / Bright")
+        self.assertIs(registry["1_1_5"], scene)
+        self.assertIsInstance(registry["1_71"], DSScene)
+        self.assertEqual(len(registry._objects), 2)
+
+    def test_dict_view(self):
+        registry = self.get_registry()
+        self.assertEqual(
+            sorted(registry.keys()), ["1_1_5", "1_71", "2_1_5", "2_2_5", "2_71"]
+        )
+        self.assertEqual(registry.get("3_71"), None)
+        with self.assertRaises(KeyError):
+            registry["3_71"]
+        self.assertEqual(
+            {scene.unique_id for scene in registry.values()}, set(registry)
+        )
+
+    def test_find(self):
+        registry = self.get_registry()
+        self.assertEqual(self.ids(registry.by_zone(2)), ["2_1_5", "2_2_5", "2_71"])
+        self.assertEqual(self.ids(registry.by_color(1)), ["1_1_5", "2_1_5"])
+        self.assertEqual(self.ids(registry.by_scene_id(71)), ["1_71", "2_71"])
+        self.assertEqual(self.ids(registry.by_name("Open")), ["2_2_5"])
+        self.assertEqual(self.ids(registry.find(zone_id=2, color=1)), ["2_1_5"])
+        self.assertEqual(self.ids(registry.find_generic(zone_id=1)), ["1_71"])
+        self.assertEqual(registry.find(zone_id=3), [])
+
+    def test_update_and_remove(self):
+        registry = self.get_registry()
+        self.assertIsNone(registry.add("1_1_5", 1, "Kitchen", 1, 5, "Bright"))
+        scene = registry["1_1_5"]
+        self.assertEqual(
+            registry.add("1_1_5", 1, "Kitchen", 1, 5, "Brighter"), "changed"
+        )
+        self.assertIsNot(registry["1_1_5"], scene)
+        self.assertEqual(registry.by_name("Bright"), [])
+        self.assertEqual(len(registry.by_name("Brighter")), 1)
+
+        registry.remove("1_1_5")
+        self.assertNotIn("1_1_5", registry)
+        self.assertEqual(len(registry.by_color(1)), 1)
+        self.assertNotIn("Brighter", registry._indexes["name"])
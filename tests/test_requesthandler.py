@@ -1,4 +1,7 @@
 # -*- coding: UTF-8 -*-
+import time
+
+import aiohttp
 import aiounittest
 from aioresponses import aioresponses
 
@@ -58,3 +61,81 @@ class TestRequestHandler(aiounittest.AsyncTestCase):
             )
             with self.assertRaises(DSRequestException):
                 await client.raw_request(url="/json/hello")
+
+    async def test_pooled_session_reused(self):
+        client = get_testclient()
+        session = await client.get_session()
+        self.assertIs(await client.get_session(), session)
+        self.assertFalse(session.connector._ssl)
+        await client.close()
+        self.assertTrue(session.closed)
+        self.assertIsNot(await client.get_session(), session)
+        await client.close()
+
+    async def test_pooled_session_settings(self):
+        client = get_testclient(pool_size=3, keepalive_timeout=12, dns_cache_ttl=60)
+        connector = (await client.get_session()).connector
+        self.assertEqual(connector.limit, 3)
+        self.assertEqual(connector._keepalive_timeout, 12)
+        self.assertTrue(connector.use_dns_cache)
+        await client.close()
+
+    async def test_raw_request_keeps_session_open(self):
+        client = get_testclient()
+        with aioresponses() as mock_get:
+            mock_get.get(
+                url=f"https://{TEST_HOST}:{TEST_PORT}/json/hello",
+                payload=dict(ok=True),
+                repeat=True,
+            )
+            await client.raw_request(url="/json/hello")
+            session = await client.get_session()
+            await client.raw_request(url="/json/hello")
+            self.assertIs(await client.get_session(), session)
+            self.assertFalse(session.closed)
+        await client.close()
+
+    async def test_context_manager_closes_session(self):
+        async with get_testclient() as client:
+            session = await client.get_session()
+        self.assertTrue(session.closed)
+
+
+class TestRequestTimeouts(aiounittest.AsyncTestCase):
+    def test_timeout_per_kind(self):
+        client = get_testclient(
+            timeouts=dict(command=aiohttp.ClientTimeout(total=2, sock_connect=1))
+        )
+        self.assertEqual(
+            client.get_timeout("/json/zone/callScene?id=1&sceneNumber=5").total, 2
+        )
+        self.assertEqual(client.get_timeout(client.URL_SCENES).total, 60)
+        self.assertIsNone(client.get_timeout("/json/event/get?subscriptionID=1").total)
+        self.assertEqual(client.get_timeout("/json/system/version").total, 30)
+
+    def test_timeout_deadline(self):
+        client = get_testclient()
+        timeout = client.get_timeout(
+            "/json/event/get?subscriptionID=1", deadline=time.monotonic() + 5
+        )
+        self.assertTrue(4 < timeout.total <= 5)
+        self.assertEqual(timeout.sock_read, 300)
+        timeout = client.get_timeout("/json/zone/callScene", deadline=time.monotonic())
+        self.assertEqual(timeout.total, 0.001)
+
+    async def test_timeout_passed(self):
+        client = get_testclient()
+        with aioresponses() as mock_get:
+            mock_get.get(
+                url=f"https://{TEST_HOST}:{TEST_PORT}/json/zone/callScene",
+                payload=dict(ok=True),
+            )
+            await client.raw_request(url="/json/zone/callScene")
+            request = list(mock_get.requests.values())[0][0]
+        self.assertEqual(request.kwargs["timeout"].total, 10)
+        await client.close()
+
+    async def test_deadline_exceeded(self):
+        client = get_testclient()
+        with self.assertRaises(DSRequestException):
+            await client.raw_request(url="/json/hello", deadline=time.monotonic())
@@ -0,0 +1,160 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import unittest
+
+import aiohttp
+import aiounittest
+import yarl
+from aioresponses import aioresponses
+
+from pydigitalstrom.exceptions import (
+    DSCircuitOpenException,
+    DSCommandFailedException,
+    DSRequestException,
+)
+from pydigitalstrom.retry import DSCircuitBreaker, DSRetryPolicy
+from tests.common import get_testclient
+
+PATH = "/json/zone/callScene?id=1&sceneNumber=5"
+URL = "https://dss.local:8080" + PATH
+
+
+def get_error(cause):
+    try:
+        raise DSRequestException("request failed") from cause
+    except DSRequestException as e:
+        return e
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_idempotent(self):
+        policy = DSRetryPolicy()
+        self.assertTrue(policy.is_idempotent("/json/zone/callScene?id=1&sceneNumber=5"))
+        self.assertTrue(policy.is_idempotent("/json/property/query2?query=/"))
+        self.assertFalse(
+            policy.is_idempotent("/json/zone/callScene?id=1&sceneNumber=12")
+        )
+        self.assertFalse(policy.is_idempotent("/json/zone/undoScene?id=1"))
+        self.assertFalse(policy.is_idempotent("/json/event/get?subscriptionID=1"))
+
+    def test_retryable(self):
+        policy = DSRetryPolicy()
+        url = "/json/event/get?subscriptionID=1"
+        timeout = get_error(asyncio.TimeoutError())
+        refused = get_error(aiohttp.ClientConnectorError(None, OSError(111, "refused")))
+        self.assertTrue(policy.is_retryable(timeout, url="/json/zone/callScene"))
+        self.assertFalse(policy.is_retryable(timeout, url=url))
+        # nothing reached the server, safe for all requests
+        self.assertTrue(policy.is_retryable(refused, url=url))
+        self.assertTrue(
+            DSRetryPolicy(retry_non_idempotent=True).is_retryable(timeout, url=url)
+        )
+        self.assertFalse(policy.is_retryable(DSRequestException("invalid"), url="/"))
+        self.assertFalse(
+            policy.is_retryable(DSCommandFailedException("unknown"), url="/")
+        )
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_states(self):
+        clock = FakeClock()
+        breaker = DSCircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+        self.assertEqual(breaker.retry_after(), 10)
+
+        # only one probe at a time, a failed probe opens the circuit again
+        clock.now = 10
+        self.assertEqual(breaker.state, "half_open")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertEqual(breaker.opened, 2)
+
+        clock.now = 20
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.rejected, 2)
+
+
+class TestRequestRetry(aiounittest.AsyncTestCase):
+    def get_client(self, **kwargs):
+        return get_testclient(
+            retry_policy=DSRetryPolicy(attempts=3, base=0.001, maximum=0.001),
+            **kwargs,
+        )
+
+    async def test_retry_server_error(self):
+        client = self.get_client()
+        with aioresponses() as mock_get:
+            mock_get.get(url=URL, status=503)
+            mock_get.get(url=URL, exception=asyncio.TimeoutError())
+            mock_get.get(url=URL, payload=dict(ok=True))
+            data = await client.raw_request(url=PATH)
+        await client.close()
+        self.assertEqual(data, dict(ok=True))
+        self.assertEqual(client.circuit_breaker.failures, 0)
+
+    async def test_no_retry(self):
+        client = self.get_client()
+        with aioresponses() as mock_get:
+            mock_get.get(url=URL, status=400)
+            mock_get.get(url=URL, payload=dict(ok=True))
+            with self.assertRaises(DSRequestException):
+                await client.raw_request(url=PATH)
+
+            path = "/json/zone/callScene?id=1&sceneNumber=12"
+            mock_get.get(url="https://dss.local:8080" + path, status=500)
+            mock_get.get(url="https://dss.local:8080" + path, payload=dict(ok=True))
+            with self.assertRaises(DSRequestException):
+                await client.raw_request(url=path)
+        await client.close()
+
+    async def test_attempts_exhausted(self):
+        client = self.get_client()
+        with aioresponses() as mock_get:
+            mock_get.get(url=URL, status=500, repeat=True)
+            with self.assertRaises(DSRequestException):
+                await client.raw_request(url=PATH)
+            self.assertEqual(len(mock_get.requests[("GET", yarl.URL(URL))]), 3)
+        await client.close()
+
+    async def test_circuit_breaker(self):
+        clock = FakeClock()
+        client = get_testclient(
+            retry_policy=DSRetryPolicy(attempts=1),
+            circuit_breaker=DSCircuitBreaker(
+                failure_threshold=2, reset_timeout=10, clock=clock
+            ),
+        )
+        with aioresponses() as mock_get:
+            mock_get.get(url=URL, status=500, repeat=True)
+            for _ in range(2):
+                with self.assertRaises(DSRequestException):
+                    await client.raw_request(url=PATH)
+            with self.assertRaises(DSCircuitOpenException):
+                await client.raw_request(url=PATH)
+        self.assertEqual(client.circuit_breaker.rejected, 1)
+
+        # a successful probe closes the circuit
+        clock.now = 10
+        with aioresponses() as mock_get:
+            mock_get.get(url=URL, payload=dict(ok=True))
+            await client.raw_request(url=PATH)
+        self.assertEqual(client.circuit_breaker.state, "closed")
+        await client.close()
@@ -0,0 +1,80 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+
+import aiounittest
+
+from pydigitalstrom.sessiontoken import DSSessionTokenManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestSessionTokenManager(aiounittest.AsyncTestCase):
+    def get_manager(self, clock, tokens):
+        async def fetch():
+            await asyncio.sleep(0)
+            return next(tokens)
+
+        return DSSessionTokenManager(
+            fetch=fetch, lifetime=60, refresh_margin=10, clock=clock
+        )
+
+    async def test_cached_token(self):
+        clock = FakeClock()
+        manager = self.get_manager(clock, iter(["a", "b"]))
+        self.assertEqual(await manager.get_token(), "a")
+        clock.now += 30
+        self.assertEqual(await manager.get_token(), "a")
+        self.assertEqual(manager.refreshes, 1)
+        self.assertEqual(manager.hits, 1)
+
+    async def test_expired_token(self):
+        clock = FakeClock()
+        manager = self.get_manager(clock, iter(["a", "b"]))
+        await manager.get_token()
+        clock.now += 61
+        self.assertEqual(await manager.get_token(), "b")
+        self.assertEqual(manager.refreshes, 2)
+
+    async def test_touch_extends_lifetime(self):
+        clock = FakeClock()
+        manager = self.get_manager(clock, iter(["a", "b"]))
+        await manager.get_token()
+        clock.now += 40
+        manager.touch()
+        clock.now += 40
+        self.assertEqual(await manager.get_token(), "a")
+
+    async def test_background_refresh(self):
+        clock = FakeClock()
+        manager = self.get_manager(clock, iter(["a", "b"]))
+        await manager.get_token()
+        clock.now += 55
+        # still valid, the refresh runs in the background
+        self.assertEqual(await manager.get_token(), "a")
+        await asyncio.sleep(0.01)
+        self.assertEqual(manager.token, "b")
+        self.assertEqual(manager.refreshes, 2)
+
+    async def test_single_flight(self):
+        clock = FakeClock()
+        manager = self.get_manager(clock, iter(["a", "b"]))
+        tokens = await asyncio.gather(*[manager.get_token() for _ in range(5)])
+        self.assertEqual(tokens, ["a"] * 5)
+        self.assertEqual(manager.refreshes, 1)
+        self.assertEqual(manager.waits, 4)
+
+    async def test_invalidate_outdated_token(self):
+        clock = FakeClock()
+        manager = self.get_manager(clock, iter(["a", "b"]))
+        await manager.get_token()
+        manager.invalidate(token="other")
+        self.assertTrue(manager.is_valid())
+        manager.invalidate(token="a")
+        self.assertFalse(manager.is_valid())
+        self.assertEqual(await manager.get_token(), "b")
@@ -0,0 +1,131 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import os
+import tempfile
+
+import aiounittest
+
+from pydigitalstrom.apptokenhandler import DSAppTokenHandler
+from pydigitalstrom.cache import DSStructureCache
+from pydigitalstrom.exceptions import DSRequestException
+from pydigitalstrom.listener import DSEventListener
+from pydigitalstrom.retry import DSRetryPolicy
+from pydigitalstrom.simulator import DSSimulator
+from pydigitalstrom.websocket import DSWebsocketEventListener
+
+
+class TestSimulator(aiounittest.AsyncTestCase):
+    async def test_initialize_and_call_scene(self):
+        async with DSSimulator(zones=3, groups=2, scenes=2) as simulator:
+            client = simulator.get_client(stack_delay=0)
+            await client.initialize()
+            # 4 zones with generic scenes plus the named ones
+            self.assertEqual(len(client.get_scenes()), 4 * 22 + 3 * 2 * 2)
+            self.assertEqual(client.get_zones()[2], "Basement 2")
+
+            await client.stack.start()
+            # the generated apartment starts with scene 17 in zone 2
+            scene = client.get_scenes()["2_1_5"]
+            self.assertEqual(await (await scene.turn_on()), dict(ok=True))
+            await client.state.reconcile()
+            self.assertEqual(client.state.get(zone_id=2, group=1), 5)
+            self.assertEqual(simulator.scene_calls, 1)
+            await client.close()
+
+    async def test_warm_start_from_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = DSStructureCache(path=os.path.join(tmpdir, "structure.json"))
+            async with DSSimulator(zones=5) as simulator:
+                client = simulator.get_client(cache=cache)
+                await client.initialize()
+                await client.close()
+
+                # a scene call does not change the structure
+                group = simulator._get_group(zone_id=1, group=1)
+                group["properties"]["lastCalledScene"] = 0
+                requests = simulator.requests
+                client = simulator.get_client(cache=cache)
+                await client.initialize()
+                await client.close()
+            # login and the structure query
+            self.assertEqual(simulator.requests - requests, 2)
+            self.assertEqual(len(client.get_scenes()), 6 * 22 + 5 * 3 * 4)
+
+    async def test_expired_session(self):
+        async with DSSimulator(zones=1) as simulator:
+            client = simulator.get_client()
+            await client.initialize()
+            simulator.expire_tokens()
+            await client.refresh()
+            self.assertEqual(client.token_manager.refreshes, 2)
+            await client.close()
+
+    async def test_errors(self):
+        async with DSSimulator(zones=1, error_rate=1) as simulator:
+            client = simulator.get_client(retry_policy=DSRetryPolicy(attempts=1))
+            with self.assertRaises(DSRequestException):
+                await client.initialize()
+            self.assertEqual(simulator.errors, 1)
+            await client.close()
+
+    async def test_apptoken(self):
+        async with DSSimulator(zones=1) as simulator:
+            handler = DSAppTokenHandler(
+                host=simulator.host,
+                port=simulator.port,
+                username="dssadmin",
+                password="dssadmin",
+                scheme="http",
+            )
+            apptoken = await handler.request_apptoken()
+            await handler.close()
+            client = simulator.get_client(apptoken=apptoken)
+            await client.initialize()
+            self.assertIn("1_71", client.get_scenes())
+            await client.close()
+
+    async def test_poll_events(self):
+        async with DSSimulator(zones=1) as simulator:
+            client = simulator.get_client()
+            listener = DSEventListener(
+                client=client, event_id=1, event_name="callScene", timeout=1
+            )
+            events = asyncio.Queue()
+
+            async def callback(event):
+                await events.put(event)
+
+            listener.register(callback=callback)
+            await listener._subscribe()
+            await client.request(url="/json/zone/callScene?id=1&sceneNumber=5")
+            await listener.poll()
+            await listener.dispatcher.start()
+            event = await asyncio.wait_for(events.get(), timeout=1)
+            self.assertEqual(event["properties"]["sceneID"], "5")
+            await listener.stop()
+            await client.close()
+
+    async def test_websocket_events(self):
+        async with DSSimulator(zones=1) as simulator:
+            client = simulator.get_client()
+            listener = DSWebsocketEventListener(client=client, event_name="callScene")
+            events = asyncio.Queue()
+            connected = asyncio.Event()
+
+            async def callback(event):
+                await events.put(event)
+
+            async def state_callback(state):
+                if state == listener.STATE_CONNECTED:
+                    connected.set()
+
+            listener.register(callback=callback)
+            listener.register_state_callback(callback=state_callback)
+            task = asyncio.ensure_future(listener.start())
+            await asyncio.wait_for(connected.wait(), timeout=1)
+            await client.request(url="/json/apartment/callScene?sceneNumber=72")
+            event = await asyncio.wait_for(events.get(), timeout=1)
+            self.assertEqual(event["properties"]["zoneID"], "0")
+            await listener.stop()
+            await task
+            await client.close()
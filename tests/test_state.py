@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+import aiounittest
+from unittest.mock import patch
+
+from pydigitalstrom.listener import DSEventListener
+from tests.common import get_testclient
+
+
+def get_event(name, zone_id, group_id, scene_id):
+    return dict(
+        name=name,
+        properties=dict(
+            zoneID=str(zone_id), groupID=str(group_id), sceneID=str(scene_id)
+        ),
+    )
+
+
+class TestStateCache(aiounittest.AsyncTestCase):
+    async def test_events(self):
+        client = get_testclient()
+        listener = DSEventListener(client=client, event_id=1)
+        client.state.attach(listener=listener)
+        changes = []
+
+        async def callback(**kwargs):
+            changes.append(kwargs)
+
+        client.state.register(callback=callback)
+        for event in (
+            get_event("callScene", 1, 1, 5),
+            get_event("callScene", 1, 1, 5),
+            get_event("callScene", 1, 1, 17),
+            get_event("callScene", 2, 0, 71),
+        ):
+            await listener.dispatcher.dispatch(event=event)
+
+        self.assertEqual(client.state.get(zone_id=1, group=1), 17)
+        self.assertEqual(client.state.get(zone_id=2), 71)
+        self.assertIsNone(client.state.get(zone_id=3))
+        self.assertEqual(len(changes), 3)
+        self.assertEqual(changes[1], dict(zone_id=1, group=1, scene_id=17, previous=5))
+        scene_id, timestamp = client.state.get_state(zone_id=1, group=1)
+        self.assertGreater(timestamp, 0)
+
+        # undo reverts to the previous scene, undoing another scene is ignored
+        await listener.dispatcher.dispatch(event=get_event("undoScene", 1, 1, 5))
+        self.assertEqual(client.state.get(zone_id=1, group=1), 17)
+        await listener.dispatcher.dispatch(event=get_event("undoScene", 1, 1, 17))
+        self.assertEqual(client.state.get(zone_id=1, group=1), 5)
+        await listener.dispatcher.dispatch(event=get_event("undoScene", 1, 1, 5))
+        self.assertIsNone(client.state.get(zone_id=1, group=1))
+
+    async def test_reconcile(self):
+        client = get_testclient()
+        await client.state.set(zone_id=1, group=1, scene_id=5)
+        await client.state.set(zone_id=2, group=1, scene_id=0)
+
+        async def request(url, **kwargs):
+            return dict(
+                ok=True,
+                result=dict(
+                    zone1=dict(ZoneID=1, group1=dict(group=1, lastCalledScene=17)),
+                    zone2=dict(ZoneID=2, group1=dict(group=1, lastCalledScene=0)),
+                    zone3=dict(ZoneID=3, group2=dict(group=2)),
+                ),
+            )
+
+        changes = []
+
+        async def callback(**kwargs):
+            changes.append(kwargs)
+
+        client.state.register(callback=callback)
+        with patch("pydigitalstrom.client.DSClient.request", side_effect=request):
+            await client.state.reconcile()
+
+        self.assertEqual(client.state.get(zone_id=1, group=1), 17)
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(len(client.state), 2)
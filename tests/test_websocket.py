@@ -0,0 +1,180 @@
+# -*- coding: UTF-8 -*-
+import asyncio
+import json
+
+import aiohttp
+import aiounittest
+from unittest.mock import patch
+
+from pydigitalstrom.backoff import DSBackoff
+from pydigitalstrom.websocket import DSWebsocketEventListener
+from tests.common import get_testclient
+
+
+class FakeMessage:
+    def __init__(self, type, data=None):
+        self.type = type
+        self.data = data
+
+
+class FakeWebsocket:
+    """
+    replays the given events, then closes or hangs to simulate a stale
+    connection
+    """
+
+    def __init__(self, events, hang=False):
+        self._messages = [
+            FakeMessage(aiohttp.WSMsgType.TEXT, json.dumps(event)) for event in events
+        ]
+        self._hang = hang
+        self.closed = False
+
+    async def receive(self, timeout=None):
+        if self._messages:
+            return self._messages.pop(0)
+        if self._hang and not self.closed:
+            await asyncio.sleep(timeout)
+            raise asyncio.TimeoutError()
+        return FakeMessage(aiohttp.WSMsgType.CLOSED)
+
+    async def close(self):
+        self.closed = True
+
+
+class TestWebsocketEventListener(aiounittest.AsyncTestCase):
+    def get_listener(self, client, **kwargs):
+        return DSWebsocketEventListener(
+            client=client,
+            event_name="callScene",
+            backoff=DSBackoff(base=0.001, maximum=0.001),
+            **kwargs,
+        )
+
+    async def test_reconnect_with_fresh_token(self):
+        client = get_testclient()
+        sockets = [
+            FakeWebsocket([dict(name="callScene", properties=dict(sceneID="5"))]),
+            FakeWebsocket([dict(name="undoScene"), dict(name="callScene")]),
+        ]
+        seen_headers = []
+        events = []
+        states = []
+        tokens = iter(["token1", "token2"])
+
+        async def ws_connect(self, url, headers=None):
+            seen_headers.append(headers)
+            if not sockets:
+                await listener.stop()
+                return FakeWebsocket([])
+            return sockets.pop(0)
+
+        async def get_session_token():
+            return next(tokens, "token3")
+
+        async def callback(event):
+            events.append(event)
+
+        async def state_callback(state):
+            states.append(state)
+
+        listener = self.get_listener(client)
+        listener.register(callback=callback)
+        listener.register_state_callback(callback=state_callback)
+        with patch("aiohttp.ClientSession.ws_connect", new=ws_connect), patch.object(
+            client, "get_session_token", get_session_token
+        ):
+            await asyncio.wait_for(listener.start(), timeout=1)
+        await client.close()
+
+        self.assertEqual(len(events), 2)
+        self.assertEqual(seen_headers[0], {"Cookie": "token=token1"})
+        self.assertEqual(seen_headers[1], {"Cookie": "token=token2"})
+        self.assertEqual(listener.reconnects, 2)
+        self.assertEqual(
+            states[:4], ["connecting", "connected", "disconnected", "connecting"]
+        )
+        self.assertEqual(states[-1], "stopped")
+
+    async def test_stale_connection(self):
+        client = get_testclient()
+        sockets = [FakeWebsocket([], hang=True)]
+
+        async def ws_connect(self, url, headers=None):
+            if not sockets:
+                await listener.stop()
+                return FakeWebsocket([])
+            return sockets.pop(0)
+
+        async def get_session_token():
+            return "token"
+
+        listener = self.get_listener(client, keepalive_timeout=0.01)
+        with patch("aiohttp.ClientSession.ws_connect", new=ws_connect), patch.object(
+            client, "get_session_token", get_session_token
+        ):
+            await asyncio.wait_for(listener.start(), timeout=1)
+        await client.close()
+        self.assertEqual(listener.reconnects, 1)
+        self.assertEqual(listener.state, "stopped")
+
+    async def test_keepalive(self):
+        listener = self.get_listener(get_testclient(), keepalive_timeout=10)
+        listener._last_keepalive = 0
+        await listener._handle_event(event=dict(name="keepWebserviceAlive"))
+        self.assertGreater(listener._get_receive_timeout(), 9)
+
+    async def test_multiple_event_names(self):
+        listener = DSWebsocketEventListener(
+            client=get_testclient(), event_names=["callScene", "undoScene"]
+        )
+        events = []
+
+        async def callback(event):
+            events.append(event["name"])
+
+        async def sensor_callback(event):
+            events.append("sensor")
+
+        listener.register(callback=callback)
+        listener.register(callback=sensor_callback, event_name="zoneSensorValue")
+        for name in ("callScene", "undoScene", "zoneSensorValue", "stateChange"):
+            await listener._handle_event(event=dict(name=name))
+        await listener.dispatcher.start()
+        await listener.dispatcher.join()
+        await listener.dispatcher.stop()
+        self.assertEqual(
+            events, ["callScene", "undoScene", "zoneSensorValue", "sensor"]
+        )
+
+    async def test_prefilter(self):
+        client = get_testclient()
+        events = []
+
+        async def ws_connect(self, url, headers=None):
+            if events:
+                await listener.stop()
+                return FakeWebsocket([])
+            return FakeWebsocket(
+                [
+                    dict(name="zoneSensorValue", properties=dict(value="21.5")),
+                    dict(name="callScene", properties=dict(sceneID="5")),
+                    dict(name="keepWebserviceAlive"),
+                ]
+            )
+
+        async def get_session_token():
+            return "token"
+
+        async def callback(event):
+            events.append(event["name"])
+
+        listener = self.get_listener(client)
+        listener.register(callback=callback)
+        with patch("aiohttp.ClientSession.ws_connect", new=ws_connect), patch.object(
+            client, "get_session_token", get_session_token
+        ):
+            await asyncio.wait_for(listener.start(), timeout=1)
+        await client.close()
+        self.assertEqual(events, ["callScene"])
+        self.assertEqual(listener.skipped, 1)